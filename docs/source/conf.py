@@ -26,7 +26,6 @@ MOCK_MODULES = [
     "mpl_toolkits.axes_grid1",
     "PIL",
     "Pillow",
-    "cpuinfo",
 ]
 sys.modules.update((mod_name, MagicMock()) for mod_name in MOCK_MODULES)
 
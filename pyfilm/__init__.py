@@ -1,3 +1,10 @@
-from .pyfilm import make_film_1d, make_film_2d
+from .pyfilm import (
+    make_film_1d,
+    make_film_2d,
+    make_film_particles,
+    estimate_film,
+    LiveFilm,
+    FrameFunction,
+)
 
 __version__ = "0.2.5"
@@ -0,0 +1,308 @@
+"""
+.. module:: cli
+   :platform: Unix, OSX
+   :synopsis: Command line batch renderer driven by a job manifest.
+
+.. moduleauthor:: Ferdinand van Wyk <ferdinandvwyk@gmail.com>
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .pyfilm import (
+    make_film_1d,
+    make_film_2d,
+    make_film_particles,
+    film_outputs,
+    output_path,
+    cpu_count,
+)
+
+FILM_TYPES = {"1d": make_film_1d, "2d": make_film_2d, "particles": make_film_particles}
+
+
+def main(argv=None):
+    """
+    Render every film listed in a manifest and print a JSON summary.
+
+    The manifest is a JSON, TOML or YAML file of the form:
+
+    .. code-block:: json
+
+       {
+           "defaults": {"options": {"fps": 20}},
+           "films": [
+               {
+                   "name": "density",
+                   "type": "2d",
+                   "args": [
+                       "x.npy",
+                       "y.npy",
+                       {"file": "run.h5", "dataset": "density"}
+                   ],
+                   "options": {"cbar_label": "n"},
+                   "plot_options": {"cmap": "viridis"}
+               }
+           ]
+       }
+
+    Each entry of args is passed positionally to make_film_1d, make_film_2d
+    or make_film_particles, for films of type '1d', '2d' or 'particles', and
+    is either a path to a .npy file or a dictionary giving the file and the
+    name of the dataset in a .npz or HDF5 file. Relative paths are relative
+    to the manifest. Each film's frames are written to its own subdirectory of
+    the frame directory and the film is named after the film's name.
+
+    Up to --jobs films are rendered at the same time, each in its own
+    process started using spawn, so the worker pool of every film is started
+    from the main thread of a process of its own. --nprocs worker processes,
+    or one per CPU, are divided equally between the --jobs films, unless a
+    film sets options['nprocs']. Output from the renderer and encoder of
+    each film is sent to stderr so that stdout only contains the summary.
+    The exit status is 0 if every film was made and 1 otherwise.
+
+    As the films are rendered in spawned processes, a script calling main
+    must do so from within an ``if __name__ == "__main__":`` block.
+
+    Parameters
+    ----------
+
+    argv : list, optional
+        Command line arguments. Defaults to sys.argv[1:].
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="pyfilm", description="Render the films listed in a manifest."
+    )
+    parser.add_argument("manifest", help="JSON, TOML or YAML job manifest.")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of films rendered at the same time.",
+    )
+    parser.add_argument(
+        "-n",
+        "--nprocs",
+        type=int,
+        default=None,
+        help="Total number of worker processes, divided equally between the "
+        "films rendered at the same time.",
+    )
+    parser.add_argument(
+        "-s", "--summary", default=None, help="Also write the summary to a file."
+    )
+    args = parser.parse_args(argv)
+
+    manifest = load_manifest(args.manifest)
+    root = os.path.dirname(os.path.abspath(args.manifest))
+    nprocs = args.nprocs or cpu_count()
+    jobs = max(1, min(args.jobs, len(manifest["films"])))
+
+    films = [
+        film_job(i, film, manifest.get("defaults", {}), root, max(1, nprocs // jobs))
+        for i, film in enumerate(manifest["films"])
+    ]
+
+    kwargs = {"max_workers": jobs, "initializer": redirect_stdout}
+    if sys.version_info < (3, 7):
+        # The films are started using fork, from the main thread of this
+        # process, before 3.7.
+        del kwargs["initializer"]
+        films = [dict(film, redirect=True) for film in films]
+    else:
+        kwargs["mp_context"] = mp.get_context("spawn")
+    with ProcessPoolExecutor(**kwargs) as executor:
+        results = list(executor.map(render_film, films))
+
+    summary = {
+        "films": results,
+        "ok": sum(result["status"] == "ok" for result in results),
+        "failed": sum(result["status"] != "ok" for result in results),
+    }
+    print(json.dumps(summary, indent=2))
+    if args.summary is not None:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    return 0 if summary["failed"] == 0 else 1
+
+
+def redirect_stdout():
+    """
+    Send the standard output of a film process to stderr, so that the output
+    of the renderer and encoder doesn't mix with the summary.
+    """
+
+    sys.stdout.flush()
+    os.dup2(2, 1)
+
+
+def load_manifest(path):
+    """
+    Load a JSON, TOML or YAML job manifest.
+
+    TOML manifests require Python 3.11 or the tomli package and YAML
+    manifests require the PyYAML package.
+
+    Parameters
+    ----------
+
+    path : str
+        Path to the manifest. The format is determined by the extension.
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == ".json":
+        with open(path) as f:
+            manifest = json.load(f)
+    elif ext == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            manifest = tomllib.load(f)
+    elif ext in [".yaml", ".yml"]:
+        import yaml
+
+        with open(path) as f:
+            manifest = yaml.safe_load(f)
+    else:
+        raise ValueError("Unknown manifest format: " + ext)
+
+    if "films" not in manifest:
+        raise ValueError("Manifest does not list any films.")
+
+    return manifest
+
+
+def film_job(i, film, defaults, root, nprocs):
+    """
+    Combine a film from the manifest with the manifest defaults.
+
+    Parameters
+    ----------
+
+    i : int
+        Position of the film in the manifest.
+    film : dict
+        Film entry of the manifest.
+    defaults : dict
+        Default options and plot_options of the manifest.
+    root : str
+        Directory relative paths are resolved against.
+    nprocs : int
+        Number of worker processes used when the film doesn't set nprocs.
+    """
+
+    name = str(film.get("name", "film_{0}".format(i)))
+    options = dict(defaults.get("options", {}))
+    options.update(film.get("options", {}))
+    plot_options = dict(defaults.get("plot_options", {}))
+    plot_options.update(film.get("plot_options", {}))
+
+    options.setdefault("file_name", name)
+    options.setdefault("nprocs", nprocs)
+    options.setdefault("frame_dir", "films/film_frames")
+    if "frame_dir" not in film.get("options", {}):
+        options["frame_dir"] = os.path.join(options["frame_dir"], name)
+    if type(options.get("cbar_ticks")) == list:
+        options["cbar_ticks"] = np.array(options["cbar_ticks"])
+
+    return {
+        "name": name,
+        "type": str(film.get("type", "1d")).lower(),
+        "args": film["args"],
+        "root": root,
+        "options": options,
+        "plot_options": plot_options,
+    }
+
+
+def load_data(spec, root):
+    """
+    Load an array from a .npy, .npz or HDF5 file.
+
+    .npy files are memory mapped rather than read into memory.
+
+    Parameters
+    ----------
+
+    spec : str or dict or list
+        Path to a .npy file, a dictionary with the keys 'file' and 'dataset',
+        or a list which is used as the array itself.
+    root : str
+        Directory relative paths are resolved against.
+    """
+
+    if type(spec) == list:
+        return np.array(spec)
+    if type(spec) == str:
+        spec = {"file": spec}
+
+    path = os.path.join(root, spec["file"])
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == ".npy":
+        return np.load(path, mmap_mode="r")
+    elif ext == ".npz":
+        with np.load(path) as data:
+            return data[spec["dataset"]]
+    elif ext in [".h5", ".hdf5", ".nc"]:
+        import h5py
+
+        with h5py.File(path, "r") as data:
+            return data[spec["dataset"]][()]
+    else:
+        raise ValueError("Unknown data format: " + ext)
+
+
+def render_film(job):
+    """
+    Make a single film and return its entry in the summary.
+
+    Parameters
+    ----------
+
+    job : dict
+        Film job returned by film_job.
+    """
+
+    if job.get("redirect"):
+        redirect_stdout()
+
+    start = time.time()
+    result = {"name": job["name"], "type": job["type"]}
+
+    try:
+        if job["type"] not in FILM_TYPES:
+            raise ValueError("Unknown film type: " + job["type"])
+        args = [load_data(spec, job["root"]) for spec in job["args"]]
+        options = FILM_TYPES[job["type"]](
+            *args, options=job["options"], plot_options=job["plot_options"]
+        )
+        result["status"] = "ok"
+        result["frames"] = len(args[-1])
+        films = [output_path(output, options) for output in film_outputs(options)]
+        result["film"] = films[0]
+        if len(films) > 1:
+            result["outputs"] = films
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = "{0}: {1}".format(type(e).__name__, e)
+        traceback.print_exc()
+
+    result["seconds"] = round(time.time() - start, 3)
+
+    return result
@@ -6,18 +6,93 @@
 .. moduleauthor:: Ferdinand van Wyk <ferdinandvwyk@gmail.com>
 """
 
+import io
 import os
+import re
+import time
+import math
+import shlex
+import shutil
+import tempfile
+import tracemalloc
+import pstats
+import pickle
+import string
+import sys
+import struct
+import itertools
+import functools
+import cProfile
 import warnings
+import threading
+import subprocess
+import collections
+import zlib
 import multiprocessing as mp
+import multiprocessing.pool
 
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import matplotlib.tri as mtri
+import matplotlib.contour as mcontour
+import matplotlib.collections as mcollections
+from matplotlib.path import Path
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 plt.ioff()
-from PIL import Image
+from PIL import Image, GifImagePlugin
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from cpuinfo import cpuinfo
+
+# Film formats which are written using Pillow rather than ffmpeg/avconv.
+PILLOW_FORMATS = ["gif", "apng", "webp"]
+
+# Default ffmpeg codec arguments for containers which can't hold the default
+# H.264 stream.
+FFMPEG_CODECS = {
+    "apng": ["-c:v", "apng"],
+    "gif": ["-c:v", "gif"],
+    "webm": ["-pix_fmt", "yuv420p", "-c:v", "libvpx-vp9"],
+    "webp": ["-c:v", "libwebp_anim"],
+}
+
+# Environment variables which set the size of the thread pools of native
+# libraries (OpenMP, OpenBLAS, MKL, BLIS, Accelerate and numexpr).
+THREAD_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+# Options which frame_path and temp_frame_path need to find a frame.
+FRAME_PATH_OPTIONS = [
+    "frame_dir",
+    "file_name",
+    "img_fmt",
+    "frame_digits",
+    "frame_shard",
+]
+
+# Options which may be calculated from a sample of the frames of a film.
+LIMIT_OPTIONS = ["xlim", "ylim", "zlim", "cbar_ticks"]
+
+# Film-wide data shared with every pool worker through init_worker, e.g. the
+# options and the triangulation of an irregular grid. Populated once per
+# worker and keyed by a film id from film_ids, so films plotted at the same
+# time in one process don't overwrite each other's data.
+worker_data = {}
+film_ids = itertools.count()
+
+# Major version of each encoder found by encoder_version.
+encoder_versions = {}
+
+# Whether FilledContours draws the same contours as contourf with the
+# installed matplotlib, found by filled_contours_supported.
+filled_contours_checks = {}
 
 
 def make_film_1d(*args, **kwargs):
@@ -29,15 +104,28 @@ def make_film_1d(*args, **kwargs):
 
     x : array_like, optional
         Array specifying the x axis.
-    y : array_like
+    y : array_like or FrameFunction
         Two dimensional array assumed to be of the form y(t, x). This specifies
-        the values to be plotted as a function of time.
+        the values to be plotted as a function of time. A FrameFunction is
+        evaluated by the workers for the frames they plot.
+
+        Alternatively, for an ensemble of lines, y is three dimensional of the
+        form y(t, member, x). The members of each frame are drawn as a single
+        LineCollection, optionally over percentile bands of the ensemble.
     plot_options : dict, optional
         Dictionary of plot customizations which are evaluated for each plot,
         e.g. when plot is called it will be called as
         plt.plot(x, y, **plot_options)
     options : dict, optional
         Dictionary of options which control various program functions.
+
+    Returns
+    -------
+
+    options : dict
+        The options used to make the film, including the calculated limits and
+        titles. These can be passed back in to refine a preview or to make the
+        full film without calculating them again.
     """
 
     options = {}
@@ -50,41 +138,137 @@ def make_film_1d(*args, **kwargs):
     else:
         plot_options = {}
 
-    set_up_dirs(options)
-
-    if options["encoder"] == None:
-        options = find_encoder(options)
-
     if len(args) == 1:
-        y = np.array(args[0])
+        y = film_data(args[0])
         nt = y.shape[0]
-        nx = y.shape[1]
+        nx = y.shape[-1]
         x = np.arange(nx)
     elif len(args) == 2:
-        x = np.array(args[0])
-        y = np.array(args[1])
+        x = np.asanyarray(args[0])
+        y = film_data(args[1])
         nt = y.shape[0]
     else:
         raise ValueError("This function only takes in max. 2 arguments.")
 
     check_data_1d(x, y)
 
-    if options["ylim"] == None:
-        options = set_ylim(y, options)
+    shared = {"plot": "1d", "x": x}
+    return render_film(
+        nt, y, shared, options, plot_options, set_limits_1d, plot_frames_1d
+    )
 
-    options = make_plot_titles(nt, options)
 
-    pool = mp.Pool(processes=options["nprocs"])
-    params = zip(range(nt), [x] * nt, y, [plot_options] * nt, [options] * nt)
-    pool.map(plot_1d, params)
-    pool.close()
-    pool.join()
+def drop_sampled_limits(options, plot_options):
+    """
+    Drop the limits which were calculated from a sample of frames, e.g. by a
+    preview, so that they are calculated again from the frames of the full
+    film.
 
-    if options["img_fmt"] in ["png", "jpg"]:
-        if options["crop"]:
-            crop_images(nt, options)
+    The options are reset to the values given before the limits were
+    calculated, e.g. None or the number of color bar ticks, and the plot
+    options which were added, such as the levels, are removed from
+    plot_options.
 
-        encode_images(options)
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    sampled = options["sampled_limits"]
+    options = dict(options, sampled_limits=None)
+    options.update(sampled["options"])
+    for key in sampled["plot_options"]:
+        plot_options.pop(key, None)
+
+    return options, plot_options
+
+
+def set_limits_1d(nt, sample, options, plot_options):
+    """
+    Calculate the y limits of a 1D film from a sample of its frames, unless
+    options['ylim'] is given.
+
+    Parameters
+    ----------
+
+    nt : int
+        Length of the time dimension.
+    sample : array_like
+        Frames returned by preview_sample.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    if options["ylim"] is None:
+        if options["dynamic_limits"]:
+            options = set_frame_ylim(sample, options)
+        else:
+            options = set_ylim(sample, options)
+
+    return options, plot_options
+
+
+def plot_frames_1d(frames, source, y, shared, options):
+    """
+    Plot the frames of a 1D film, decimating long lines and drawing the
+    members of an ensemble together.
+
+    Returns True if the frames were piped to the encoder by raster_frames,
+    which leaves nothing to encode, and False otherwise.
+
+    Parameters
+    ----------
+
+    frames : array_like
+        Index of each frame being plotted.
+    source : array_like
+        Time index of the slice of y plotted in each frame.
+    y : array_like or FrameFunction
+        The array being plotted, with time as the first dimension.
+    shared : dict
+        Dictionary of data which is identical for every frame.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    x = shared["x"]
+    plot_options = shared["plot_options"]
+    nt = len(y)
+    lines = y
+    ensemble = y.ndim == 3
+    first = y[source[0]][0] if ensemble else y[source[0]]
+    columns = decimation_columns(x, first, options, plot_options)
+    if ensemble:
+        if isinstance(y, FrameFunction):
+            warnings.warn(
+                "The FrameFunction of an ensemble film is evaluated in this "
+                "process, which calculates the percentile bands."
+            )
+        lines = EnsembleLines(x, y, columns, source, options["bands"])
+        options, plot_options = set_up_ensemble(y.shape[1], options, plot_options)
+    elif columns is not None and isinstance(y, FrameFunction):
+        lines = FrameFunction(DecimatedFunction(x, y.func, columns), nt, y.block)
+    elif columns is not None:
+        lines = DecimatedLines(x, y, columns, source)
+
+    if options["line_raster"] and ensemble:
+        warnings.warn("line_raster is ignored for ensemble films.")
+
+    if options["line_raster"] and not ensemble:
+        return raster_frames(frames, source, x, lines, options, plot_options)
+
+    shared = dict(shared, plot_options=plot_options, options=options)
+    shared["decimated"] = columns is not None
+    shared["ensemble"] = ensemble
+    plot_frames(frames, source, lines, shared, options)
+
+    return False
 
 
 def make_film_2d(*args, **kwargs):
@@ -99,13 +283,28 @@ def make_film_2d(*args, **kwargs):
         Array specifying the y axis.
     z : array_like
         Three dimensional array assumed to be of the form z(t, x, y). This
-        specifies the values to be plotted as a function of time.
+        specifies the values to be plotted as a function of time. A
+        FrameFunction is evaluated by the workers for the frames they plot.
+
+        Alternatively, for data on an irregular grid, x and y are the 1D
+        coordinates of the N grid points and z is two dimensional of the form
+        z(t, N). The grid is triangulated once and the triangulation is shared
+        by all frames, which are plotted using tricontourf.
     plot_options : dict, optional
         Dictionary of plot customizations which are evaluated for each plot,
         e.g. when plot is called it will be called as
         plt.plot(x, y, **plot_options)
     options : dict, optional
         Dictionary of options which control various program functions.
+
+    Returns
+    -------
+
+    options : dict
+        The options used to make the film, including the calculated color bar
+        ticks and titles. These can be passed back in, along with the same
+        plot_options, to refine a preview or to make the full film without
+        calculating them again.
     """
     options = {}
     options = set_default_options(options)
@@ -117,13 +316,8 @@ def make_film_2d(*args, **kwargs):
     else:
         plot_options = {}
 
-    set_up_dirs(options)
-
-    if options["encoder"] == None:
-        options = find_encoder(options)
-
     if len(args) == 1:
-        z = np.array(args[0])
+        z = film_data(args[0])
 
         nt = z.shape[0]
         nx = z.shape[1]
@@ -134,223 +328,3231 @@ def make_film_2d(*args, **kwargs):
     elif len(args) == 2:
         raise ValueError("Specify either (x,y,z) or just z.")
     elif len(args) == 3:
-        x = np.array(args[0])
-        y = np.array(args[1])
-        z = np.array(args[2])
+        x = np.asanyarray(args[0])
+        y = np.asanyarray(args[1])
+        z = film_data(args[2])
 
-        check_data_2d(x, y, z)
+        if z.ndim == 2:
+            check_data_tri(x, y, z)
+            triangulation = make_triangulation(x, y, options)
+        else:
+            check_data_2d(x, y, z)
 
         nt = z.shape[0]
     else:
         raise ValueError("This function only takes in max. 3 arguments.")
 
+    shared = {"plot": "2d", "x": x, "y": y}
+    if z.ndim == 2:
+        shared["plot"] = "tri"
+        shared["triangles"] = triangulation.triangles
+        shared["mask"] = triangulation.mask
+
+    return render_film(
+        nt, z, shared, options, plot_options, set_limits_2d, plot_frames_2d
+    )
+
+
+def set_limits_2d(nt, sample, options, plot_options):
+    """
+    Calculate the contours and color bar ticks of a 2D film from a sample of
+    its frames, unless they are given.
+
+    Parameters
+    ----------
+
+    nt : int
+        Length of the time dimension.
+    sample : array_like
+        Frames returned by preview_sample.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    if (
+        options["preview"] is None
+        and sample_stride(nt, options) > 1
+        and options["zlim"] is None
+        and "levels" not in plot_options
+    ):
+        # Frames outside the sample may go beyond its limits, which would
+        # otherwise leave blank regions.
+        plot_options.setdefault("extend", "both")
+
+    if options["zlim"] is None and options["clip_percentile"] is not None:
+        options["zlim"] = list(find_extrema(sample, options))
+        plot_options.setdefault("extend", "both")
+
+    if (
+        options["dynamic_limits"]
+        and options["zlim"] is None
+        and "levels" not in plot_options
+    ):
+        plot_options = calculate_frame_contours(sample, options, plot_options)
+
     if "levels" not in plot_options:
-        plot_options = calculate_contours(z, options, plot_options)
+        plot_options = calculate_contours(sample, options, plot_options)
 
     if type(options["cbar_ticks"]) == np.ndarray:
         pass
     elif type(options["cbar_ticks"]) == int or options["cbar_ticks"] == None:
-        options = calculate_cbar_ticks(z, options)
-
-    options = make_plot_titles(nt, options)
-
-    pool = mp.Pool(processes=options["nprocs"])
-    params = zip(range(nt), [x] * nt, [y] * nt, z, [plot_options] * nt, [options] * nt)
-    pool.map(plot_2d, params)
-    pool.close()
-    pool.join()
-
-    if options["img_fmt"] in ["png", "jpg"]:
-        if options["crop"]:
-            crop_images(nt, options)
+        options = calculate_cbar_ticks(sample, options)
 
-        encode_images(options)
+    return options, plot_options
 
 
-def set_default_options(options):
+def plot_frames_2d(frames, source, z, shared, options):
     """
-    Sets the default options.
+    Plot the frames of a 2D film, without a static background when the
+    limits change from frame to frame.
+
+    Returns False, since the frames are left to be encoded.
 
     Parameters
     ----------
+
+    frames : array_like
+        Index of each frame being plotted.
+    source : array_like
+        Time index of the slice of z plotted in each frame.
+    z : array_like or FrameFunction
+        The array being plotted, with time as the first dimension.
+    shared : dict
+        Dictionary of data which is identical for every frame.
     options : dict
         Dictionary of options which control various program functions.
     """
 
-    options["aspect"] = "auto"
-    options["bbox_inches"] = None
-    options["cbar_label"] = "f(x,y)"
-    options["cbar_ticks"] = None
-    options["cbar_tick_format"] = "%.2f"
-    options["crop"] = True
-    options["dpi"] = None
-    options["encoder"] = None
-    options["file_name"] = "f"
-    options["film_dir"] = "films"
-    options["fps"] = 10
-    options["frame_dir"] = "films/film_frames"
-    options["grid"] = False
-    options["img_fmt"] = "png"
-    options["nprocs"] = cpuinfo.get_cpu_info()["count"]
-    options["ncontours"] = 11
-    options["title"] = ""
-    options["video_fmt"] = "mp4"
-    options["xlabel"] = "x"
-    options["xlim"] = None
-    options["xticks"] = None
-    options["ylabel"] = "y"
-    options["ylim"] = None
-    options["yticks"] = None
+    if options["static_background"] and (
+        np.ndim(shared["plot_options"].get("levels")) == 2
+        or np.ndim(options["cbar_ticks"]) == 2
+        or options["bbox_inches"] is not None
+    ):
+        warnings.warn(
+            "static_background is ignored for films with per-frame limits or "
+            "bbox_inches."
+        )
+        options = dict(options)
+        options["static_background"] = False
+        shared = dict(shared, options=options)
 
-    return options
+    plot_frames(frames, source, z, shared, options)
 
+    return False
 
-def set_user_options(options, user_options):
+
+def make_film_particles(*args, **kwargs):
     """
-    Replace default options with user specified ones.
+    The main function which generates films of particles.
 
-    An exhastive list of the available options is given in a table in the
-    documentation.
+    Each frame's particles are binned into a density image of
+    options['density_bins'] bins, which is plotted as a 2D film by
+    make_film_2d, so the time to plot a frame depends on the number of bins
+    rather than the number of particles. Films of at most
+    options['scatter_max'] particles are plotted as markers instead.
 
     Parameters
     ----------
 
-    options : dict
+    points : array_like or FrameFunction
+        Three dimensional array assumed to be of the form points(t, N, 2),
+        holding the x and y coordinates of N particles as a function of time.
+    plot_options : dict, optional
+        Dictionary of plot customizations which are evaluated for each plot,
+        e.g. for markers scatter is called as
+        ax.scatter(x, y, **plot_options)
+    options : dict, optional
         Dictionary of options which control various program functions.
-    user_options : dict
-        Dictionary of options passed in by the user as a keyword argument.
+
+    Returns
+    -------
+
+    options : dict
+        The options used to make the film, including the calculated limits,
+        color bar ticks and titles. These can be passed back in, along with
+        the same plot_options, to refine a preview or to make the full film
+        without calculating them again.
     """
-    for key, value in user_options.items():
-        options[key] = value
 
-    # Addtional checks
-    if options["nprocs"] == None:
-        options["nprocs"] = cpuinfo.get_cpu_info()["count"]
+    options = {}
+    options = set_default_options(options)
+    if "options" in kwargs:
+        options = set_user_options(options, kwargs["options"])
+        user_options = kwargs["options"]
+    else:
+        user_options = {}
 
-    if options["img_fmt"] not in ["png", "jpg"]:
-        warnings.warn(
-            "Image format selected will not create a film. Please " "select png or jpg."
+    if "plot_options" in kwargs:
+        plot_options = kwargs["plot_options"]
+    else:
+        plot_options = {}
+
+    if len(args) != 1:
+        raise ValueError("This function only takes in 1 argument.")
+
+    points = film_data(args[0])
+    check_data_particles(points)
+    nt, n = points.shape[:2]
+
+    if isinstance(points, FrameFunction) and options["limit_frames"] is None:
+        options["limit_frames"] = 100
+
+    if options["xlim"] is None or options["ylim"] is None:
+        sample = np.asarray(preview_sample(points, options))
+        options, plot_options = set_limits_particles(nt, sample, options, plot_options)
+
+    if n > options["scatter_max"]:
+        if "cbar_label" not in user_options:
+            options["cbar_label"] = "count"
+        block = max(1, 2**22 // max(n, 1))
+        density = ParticleDensity(points, options)
+        if (
+            not isinstance(points, FrameFunction)
+            and options["zlim"] is None
+            and options["clip_percentile"] is None
+            and not options["dynamic_limits"]
+            and "levels" not in plot_options
+            and options["preview"] is None
+            and options["frame_range"] is None
+        ):
+            options["zlim"] = density_limits(density, nt, block)
+        return make_film_2d(
+            density.x,
+            density.y,
+            FrameFunction(density, nt, block=block),
+            options=options,
+            plot_options=plot_options,
         )
 
-    return options
+    shared = {"plot": "particles"}
+    return render_film(
+        nt, points, shared, options, plot_options, set_limits_particles, plot_frames
+    )
 
 
-def set_up_dirs(options):
+def set_limits_particles(nt, sample, options, plot_options):
     """
-    Checks for film directories and creates them if they don't exist.
+    Set the x and y limits of a particle film to the range of the particles
+    in a sample of its frames, unless they are given.
 
     Parameters
     ----------
+
+    nt : int
+        Length of the time dimension.
+    sample : array_like
+        Frames returned by preview_sample.
     options : dict
         Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
     """
-    if options["film_dir"] not in os.listdir("."):
-        os.system("mkdir -p " + options["film_dir"])
-    if options["frame_dir"] not in os.listdir("."):
-        os.system("mkdir -p " + options["frame_dir"])
-    os.system(
-        "rm -f "
-        + options["frame_dir"]
-        + "/"
-        + options["file_name"]
-        + "_*."
-        + options["img_fmt"]
-    )
 
+    for key, axis in [("xlim", 0), ("ylim", 1)]:
+        if options[key] is None:
+            lower = float(np.nanmin(sample[..., axis]))
+            upper = float(np.nanmax(sample[..., axis]))
+            options[key] = [lower, max(upper, lower + 1)]
 
-def check_data_1d(x, y):
+    return options, plot_options
+
+
+def density_limits(density, nt, block):
     """
-    Performs consistency checks on the data passed into make_film_1d.
+    Returns the smallest and largest count of a ParticleDensity over every
+    frame.
 
-    These checks are only done when both x and y arguments are passed into the
-    function.
+    The counts are calculated for block frames at a time, so the limits of
+    a density film made from an array are exact without holding every
+    density image at once.
 
     Parameters
     ----------
 
-    x : array_like,
-        Array specifying the x axis.
-    y : array_like
-        Two dimensional array assumed to be of the form y(t, x). This specifies
-        the values to be plotted as a function of time.
+    density : ParticleDensity
+        Density of the particles of the film.
+    nt : int
+        Length of the time dimension.
+    block : int
+        Number of frames binned at once.
     """
-    x_s = x.shape
-    y_s = y.shape
-
-    if len(x_s) != 1:
-        raise IndexError("x must be one dimensional.")
 
-    if len(y_s) != 2:
-        raise IndexError("y must be two dimensional.")
+    lower = np.inf
+    upper = -np.inf
+    for start in range(0, nt, block):
+        counts = density(np.arange(start, min(start + block, nt)))
+        lower = min(lower, counts.min())
+        upper = max(upper, counts.max())
 
-    if x_s[0] != y_s[1]:
-        raise ValueError(
-            "x and y must have the same length: " "{0}, {1}".format(x_s[0], y_s[1])
-        )
+    return [float(lower), float(upper)]
 
 
-def check_data_2d(x, y, z):
+def render_film(nt, data, shared, options, plot_options, limits, plot):
     """
-    Performs consistency checks on the data passed into make_film_2d.
+    Calculate the limits of a film, then plot and encode its frames.
 
-    These checks are only done when both x, y, and z arguments are passed into
-    the function.
+    This is the pipeline shared by make_film_1d, make_film_2d and
+    make_film_particles. The limits are calculated by
+    limits(nt, sample, options, plot_options) from the frames returned by
+    preview_sample, after loading those of the whole film when re-rendering
+    a frame range, and saved for re-rendering when the film is encoded as
+    segments. The frames of a preview, of a frame range, or those left by
+    drop_duplicate_frames are then plotted, if there are any, by
+    plot(frames, source, data, shared, options), which returns True if it
+    encoded the film itself, before being cropped and encoded.
+
+    Returns the options used to make the film, including the calculated
+    limits and titles.
 
     Parameters
     ----------
-    x : array_like
-        Array specifying the x axis.
-    y : array_like
-        Array specifying the y axis.
-    z : array_like
-        Three dimensional array assumed to be of the form z(t, x, y). This
-        specifies the values to be plotted as a function of time.
+
+    nt : int
+        Length of the time dimension.
+    data : array_like or FrameFunction
+        The data being plotted, with time as the first dimension.
+    shared : dict
+        Dictionary of data which is identical for every frame, to which
+        plot_options and options are added.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    limits : callable
+        Function which calculates the limits of the film.
+    plot : callable
+        Function which plots the frames.
     """
-    x_s = x.shape
-    y_s = y.shape
-    z_s = z.shape
 
-    if len(x_s) != 1:
-        raise IndexError("x must be one dimensional.")
+    if options["preview"] is None:
+        set_up_dirs(options)
 
-    if len(y_s) != 1:
-        raise IndexError("y must be one dimensional.")
+    if options["encoder"] == None:
+        options = find_encoder(options)
 
-    if len(z_s) != 3:
-        raise IndexError("y must be three dimensional.")
+    if isinstance(data, FrameFunction) and options["limit_frames"] is None:
+        options["limit_frames"] = 100
+
+    if options["frame_digits"] is None:
+        options["frame_digits"] = max(5, len(str(nt - 1)))
+
+    if options["frame_range"] is not None:
+        options, plot_options = load_film_limits(options, plot_options)
+
+    if options["preview"] is None and options["sampled_limits"] is not None:
+        if sample_stride(nt, options) < options["sampled_limits"]["stride"]:
+            options, plot_options = drop_sampled_limits(options, plot_options)
+
+    stride = sample_stride(nt, options)
+    given_options = {key: options[key] for key in LIMIT_OPTIONS}
+    given_plot_options = set(plot_options)
+    sample = preview_sample(data, options)
+    options, plot_options = limits(nt, sample, options, plot_options)
+    if stride > 1 and options["sampled_limits"] is None:
+        options["sampled_limits"] = {
+            "stride": stride,
+            "options": {
+                key: value
+                for key, value in given_options.items()
+                if options[key] is not value
+            },
+            "plot_options": sorted(set(plot_options) - given_plot_options),
+        }
 
-    if x_s[0] != z_s[1]:
-        raise ValueError(
-            "x and z must have the same length: " "{0}, {1}".format(x_s[0], z_s[1])
-        )
-    elif y_s[0] != z_s[2]:
-        raise ValueError(
-            "y and z must have the same length: " "{0}, {1}".format(y_s[0], z_s[2])
+    options = make_plot_titles(nt, options)
+    options, plot_options = expand_frame_values(nt, options, plot_options)
+    if (
+        options["segment_frames"] is not None
+        and options["frame_range"] is None
+        and options["preview"] is None
+    ):
+        save_film_limits(options, plot_options)
+    film_options = options
+    frames = range(nt)
+    source = frames
+
+    if options["preview"] is not None:
+        frames, options = set_up_preview(nt, options)
+        source = frames
+    elif options["frame_range"] is not None:
+        frames, options = set_up_frame_range(nt, options)
+        source = frames
+    elif options["dedup_tol"] is not None:
+        source, options, plot_options = drop_duplicate_frames(
+            data, options, plot_options
         )
+        frames = range(len(source))
 
+    # A preview at a stride which is already done has no frames to plot, but
+    # is still encoded.
+    shared = dict(shared, plot_options=plot_options, options=options)
+    if len(frames) > 0 and plot(frames, source, data, shared, options):
+        return film_options
 
-def find_encoder(options):
+    if options["img_fmt"] in ["png", "jpg"]:
+        if options["crop"]:
+            crop_images(len(frames), options)
+
+        encode_images(options)
+
+    return film_options
+
+
+def estimate_film(make_film, *args, **kwargs):
     """
-    Determines which encoder the user has on their system.
+    Estimate the time, memory and disk space needed to make a film.
+
+    A sample of frames, evenly spaced through the film, is plotted serially
+    and encoded with the same options in a temporary directory. The time,
+    memory and bytes per frame are measured and extrapolated to the whole
+    film, assuming that plotting scales linearly with the number of
+    processes up to the number of cores.
+
+    Settings are also recommended for the given budgets: the fewest processes
+    which meet the time budget without exceeding the memory budget and, when
+    the time budget can't be met, JPEG frames and a lower dpi, assuming that
+    the plotting time scales with the number of pixels.
 
     Parameters
     ----------
-    options : dict
+
+    make_film : callable
+        make_film_1d, make_film_2d or make_film_particles.
+    args : array_like
+        Data passed to make_film, with the array being plotted last.
+    plot_options : dict, optional
+        Dictionary of plot customizations which are evaluated for each plot.
+    options : dict, optional
         Dictionary of options which control various program functions.
+    sample_frames : int, optional
+        Number of frames in the sample. Defaults to 10.
+    time_budget : float, optional
+        Time available to make the film in seconds.
+    memory_budget : int, optional
+        Memory available to make the film in bytes.
+
+    Returns
+    -------
+
+    estimate : dict
+        The estimated 'seconds', 'memory_bytes' and 'disk_bytes' of the film,
+        the measured 'render_seconds_per_frame', 'encode_seconds_per_frame',
+        'frame_bytes' and 'worker_bytes', and the 'recommended' 'nprocs',
+        'img_fmt' and 'dpi'.
     """
 
-    f = os.system("which ffmpeg")
-    a = os.system("which avconv")
+    options = set_default_options({})
+    options = set_user_options(options, kwargs.get("options", {}))
+    plot_options = kwargs.get("plot_options", {})
 
-    if a > 0 and f > 0:
-        raise EnvironmentError(
-            "This system does not have FFMPEG or AVCONV " "installed."
+    data = film_data(args[-1])
+    nt = data.shape[0]
+    data_bytes = 0 if isinstance(data, FrameFunction) else data.nbytes
+    sample = np.unique(
+        np.linspace(0, nt - 1, min(nt, kwargs.get("sample_frames", 10))).astype(int)
+    )
+    n = len(sample)
+
+    tmp = tempfile.mkdtemp()
+    sample_options = dict(kwargs.get("options", {}))
+    for key in ["title", "times", "frame_counts"]:
+        sample_options[key] = sample_frame_values(options[key], sample, nt)
+    for key in ["ylim", "cbar_ticks"]:
+        if np.ndim(options[key]) == 2:
+            sample_options[key] = options[key][sample]
+    sample_options.update(
+        {
+            "backend": "serial",
+            "dedup_tol": None,
+            "file_name": "estimate",
+            "film_dir": tmp,
+            "frame_dir": tmp + "/frames",
+            "frame_range": None,
+            "preview": None,
+            "profile": None,
+            "segment_frames": None,
+        }
+    )
+    sample_plot_options = dict(plot_options)
+    if np.ndim(plot_options.get("levels")) == 2:
+        sample_plot_options["levels"] = plot_options["levels"][sample]
+    sample_args = list(args[:-1]) + [data[sample]]
+
+    try:
+        start = time.time()
+        film_options = make_film(
+            *sample_args,
+            plot_options=dict(sample_plot_options),
+            options=dict(sample_options),
         )
-    elif a == 0 and f == 0:
-        warnings.warn(
-            "This system has both FFMPEG and AVCONV installed. " "Defaulting to AVCONV."
+        total = time.time() - start
+
+        start = time.time()
+        encode_images(film_options)
+        encode = time.time() - start
+
+        files = frame_files(film_options)
+        frame_bytes = np.mean([os.path.getsize(f) for f in files])
+        width, height = Image.open(files[0]).size
+        film_bytes = sum(
+            os.path.getsize(os.path.join(tmp, f))
+            for f in os.listdir(tmp)
+            if os.path.isfile(os.path.join(tmp, f))
         )
-        options["encoder"] = "avconv"
+
+        tracemalloc.start()
+        small_options = make_film(
+            *(list(args[:-1]) + [data[sample[:2]]]),
+            plot_options=dict(sample_plot_options),
+            options=dict(sample_options, title="", times=None, frame_counts=None),
+        )
+        worker_bytes = tracemalloc.get_traced_memory()[1] + 4 * width * height
+        tracemalloc.stop()
+
+        # The encoder's start up time is separated from the time per frame by
+        # also encoding the smaller film.
+        start = time.time()
+        encode_images(small_options)
+        encode_small = time.time() - start
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    render_seconds = nt * max(total - encode, 0) / n
+    m = min(n, 2)
+    if n > m:
+        per_frame = max(encode - encode_small, 0) / (n - m)
+    else:
+        per_frame = encode / n
+    encode_seconds = max(encode - per_frame * n, 0) + per_frame * nt
+    cpus = cpu_count()
+    nprocs = max(1, min(options["nprocs"], cpus, nt))
+    dpi = options["dpi"]
+    if dpi is None:
+        dpi = mpl.rcParams["savefig.dpi"]
+        if dpi == "figure":
+            dpi = mpl.rcParams["figure.dpi"]
+
+    limit = cpus
+    if kwargs.get("memory_budget") is not None:
+        spare = kwargs["memory_budget"] - data_bytes
+        limit = min(limit, max(1, int(spare // worker_bytes)))
+    recommended = {"nprocs": limit, "img_fmt": options["img_fmt"], "dpi": int(dpi)}
+
+    time_budget = kwargs.get("time_budget")
+    if time_budget is not None:
+        render_budget = time_budget - encode_seconds
+        if render_budget > 0:
+            recommended["nprocs"] = min(
+                limit, max(1, int(math.ceil(render_seconds / render_budget)))
+            )
+        seconds = render_seconds / recommended["nprocs"] + encode_seconds
+        if seconds > time_budget:
+            scale = max(render_budget, 0) * recommended["nprocs"] / render_seconds
+            recommended["img_fmt"] = "jpg"
+            recommended["dpi"] = max(50, int(dpi * math.sqrt(scale)))
+
+    return {
+        "frames": nt,
+        "sample_frames": n,
+        "render_seconds_per_frame": render_seconds / nt,
+        "encode_seconds_per_frame": encode_seconds / nt,
+        "frame_bytes": int(frame_bytes),
+        "worker_bytes": int(worker_bytes),
+        "seconds": render_seconds / nprocs + encode_seconds,
+        "memory_bytes": int(data_bytes + nprocs * worker_bytes),
+        "disk_bytes": int(nt * frame_bytes + film_bytes * nt / n),
+        "recommended": recommended,
+    }
+
+
+def sample_frame_values(values, sample, nt):
+    """
+    Returns the entries of a list or array of per-frame values, such as
+    titles or frame counts, for a sample of the frames.
+
+    Any other value, e.g. a fixed title, is returned unchanged.
+
+    Parameters
+    ----------
+
+    values : object
+        Value of an option which may be given per frame.
+    sample : array_like
+        Time indices of the sampled frames.
+    nt : int
+        Length of the time dimension.
+    """
+
+    if type(values) == list and len(values) == nt:
+        return [values[i] for i in sample]
+    elif type(values) == np.ndarray and values.ndim == 1 and len(values) == nt:
+        return values[sample]
+
+    return values
+
+
+class LiveFilm(object):
+    """
+    Film which is made while the data is still being generated, e.g. by a
+    running simulation.
+
+    Time slices are added one at a time using append, or from an iterator or
+    generator using extend. Each slice is plotted by a pool of workers as soon
+    as it arrives and the frames are piped, in order, to avconv/ffmpeg as they
+    complete. MP4 films are written as fragmented MP4 so the film can be
+    viewed while it is still growing. At most options['live_window'] frames
+    are being plotted at any time, which bounds the memory used.
+
+    The limits are fixed when options['ylim'] (1D) or plot_options['levels']
+    (2D) are specified. Otherwise they are set from the first slice and grow,
+    with a 10% margin, whenever a slice falls outside of them.
+
+    The film is finished by calling close, or by using the film as a context
+    manager, which calls cancel instead if an exception is raised.
+
+    Parameters
+    ----------
+
+    x : array_like, optional
+        Array specifying the x axis.
+    y : array_like, optional
+        Array specifying the y axis of 2D films.
+    plot_options : dict, optional
+        Dictionary of plot customizations which are evaluated for each plot.
+    options : dict, optional
+        Dictionary of options which control various program functions.
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+       with pf.LiveFilm(x, options={'title': 'live'}) as film:
+           for step in simulation:
+               film.append(step.values)
+    """
+
+    def __init__(self, x=None, y=None, plot_options=None, options=None):
+        self.options = set_default_options({})
+        if options is not None:
+            self.options = set_user_options(self.options, options)
+        self.plot_options = {} if plot_options is None else dict(plot_options)
+
+        if self.options["encoder"] is None:
+            self.options = find_encoder(self.options)
+        if self.options["encoder"] == "pillow":
+            raise ValueError("Live films require avconv or ffmpeg.")
+        if self.options["live_window"] is None:
+            self.options["live_window"] = 2 * self.options["nprocs"]
+
+        self.x = x
+        self.y = y
+        self.cbar_ticks = self.options["cbar_ticks"]
+        self.nt = 0
+        self.limits = None
+        self.pending = collections.deque()
+        self.pool = None
+        self.encoder = None
+
+        set_up_dirs(self.options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.cancel()
+
+    def append(self, z):
+        """
+        Add a time slice to the film.
+
+        Parameters
+        ----------
+
+        z : array_like
+            Time slice of the form z(x) for 1D films or z(x, y) for 2D films.
+        """
+
+        z = np.asarray(z)
+        if self.pool is None:
+            self.start(z)
+
+        self.update_limits(z)
+        make_frame_dirs([self.nt], self.options)
+
+        if z.ndim == 1:
+            args = (self.nt, self.x, z, self.plot_options, dict(self.options))
+            result = self.pool.apply_async(plot_1d, (args,))
+        else:
+            args = (
+                self.nt,
+                self.x,
+                self.y,
+                z,
+                dict(self.plot_options),
+                dict(self.options),
+            )
+            result = self.pool.apply_async(plot_2d, (args,))
+        self.pending.append((self.nt, result))
+        self.nt += 1
+
+        while len(self.pending) >= self.options["live_window"]:
+            self.write_frame()
+
+    def extend(self, slices):
+        """
+        Add every time slice from an iterable, e.g. a generator, to the film.
+
+        Parameters
+        ----------
+
+        slices : iterable
+            Time slices of the form z(x) for 1D films or z(x, y) for 2D films.
+        """
+
+        for z in slices:
+            self.append(z)
+
+    def close(self):
+        """
+        Wait for the remaining frames and finish the film.
+        """
+
+        if self.pool is None:
+            return
+
+        while len(self.pending) > 0:
+            self.write_frame()
+
+        self.pool.close()
+        self.pool.join()
+        self.encoder.stdin.close()
+        self.encoder.wait()
+        self.pool = None
+
+    def cancel(self):
+        """
+        Stop the workers and encoder straight away, e.g. after an exception
+        or Ctrl-C, leaving the frames piped so far in the film.
+        """
+
+        if self.pool is None:
+            return
+
+        self.pool.terminate()
+        self.pool.join()
+        self.pending.clear()
+        self.encoder.stdin.close()
+        self.encoder.wait()
+        self.pool = None
+        remove_temp_frames(self.options)
+
+    def start(self, z):
+        """
+        Set up the axes, workers and encoder using the first time slice.
+
+        Parameters
+        ----------
+
+        z : array_like
+            First time slice of the film.
+        """
+
+        if self.x is None:
+            self.x = np.arange(z.shape[0])
+        if z.ndim == 2 and self.y is None:
+            self.y = np.arange(z.shape[1])
+
+        if z.ndim == 1:
+            check_data_1d(self.x, z[np.newaxis])
+            fixed = self.options["ylim"] is not None
+        else:
+            check_data_2d(self.x, self.y, z[np.newaxis])
+            fixed = "levels" in self.plot_options
+            if fixed and self.options["cbar_ticks"] is None:
+                levels = self.plot_options["levels"]
+                self.options["cbar_ticks"] = np.around(
+                    np.linspace(levels[0], levels[-1], 5), 7
+                )
+        if fixed:
+            self.limits = False
+
+        self.pool = make_pool(self.options["live_window"], self.options)
+        self.encoder = start_encoder(
+            live_encoder_command(self.options), self.options, stdin=subprocess.PIPE
+        )
+
+    def update_limits(self, z):
+        """
+        Grow the limits of the film to include a time slice.
+
+        Parameters
+        ----------
+
+        z : array_like
+            Time slice being added.
+        """
+
+        if self.limits is False:
+            return
+
+        z_min, z_max = np.min(z), np.max(z)
+        if self.limits is not None:
+            if self.limits[0] <= z_min and z_max <= self.limits[1]:
+                return
+            z_min = min(z_min, self.limits[0])
+            z_max = max(z_max, self.limits[1])
+            margin = 0.1 * (z_max - z_min)
+            z_min = z_min - margin if z_min < self.limits[0] else z_min
+            z_max = z_max + margin if z_max > self.limits[1] else z_max
+        self.limits = [z_min, z_max]
+
+        extrema = np.array(self.limits)
+        if z.ndim == 1:
+            self.options = set_ylim(extrema, self.options)
+        else:
+            self.plot_options = calculate_contours(
+                extrema, self.options, self.plot_options
+            )
+            if type(self.cbar_ticks) != np.ndarray:
+                self.options["cbar_ticks"] = self.cbar_ticks
+                self.options = calculate_cbar_ticks(extrema, self.options)
+
+    def write_frame(self):
+        """
+        Wait for the oldest frame being plotted and pipe it to the encoder.
+        """
+
+        it, result = self.pending.popleft()
+        result.get()
+        with open(frame_path(it, self.options), "rb") as f:
+            self.encoder.stdin.write(f.read())
+        self.encoder.stdin.flush()
+
+
+def live_encoder_command(options, size=None):
+    """
+    Returns the avconv/ffmpeg command which encodes frames piped to it.
+
+    The frames are cropped to an even width and height by the encoder, and MP4
+    and MOV films are fragmented so they can be played while being written.
+    Every film in options['outputs'] is encoded from the same piped frames.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    size : tuple, optional
+        Width and height of raw RGB frames. By default the frames are piped
+        as encoded images.
+    """
+
+    command = [
+        options["encoder"],
+        "-threads",
+        str(options.get("encoder_cpus") or options["nprocs"]),
+        "-y",
+    ]
+    if size is None:
+        command += ["-f", "image2pipe"]
+    else:
+        command += ["-f", "rawvideo", "-pix_fmt", "rgb24"]
+        command += ["-s", "{0}x{1}".format(*size)]
+    command += ["-r", str(options["fps"]), "-i", "-"]
+    for output in film_outputs(options):
+        command += output_args(output, options, ["crop=trunc(iw/2)*2:trunc(ih/2)*2"])
+        if output["video_fmt"] in ["mp4", "mov"]:
+            command += ["-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+        command.append(output_path(output, options))
+
+    return command
+
+
+def set_default_options(options):
+    """
+    Sets the default options.
+
+    Parameters
+    ----------
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    options["aspect"] = "auto"
+    options["backend"] = "auto"
+    options["band_color"] = None
+    options["bands"] = None
+    options["bbox_inches"] = None
+    options["cbar_label"] = "f(x,y)"
+    options["cbar_ticks"] = None
+    options["cbar_tick_format"] = "%.2f"
+    options["clip_percentile"] = None
+    options["contour_threads"] = None
+    options["crop"] = True
+    options["decimate"] = True
+    options["dedup_tol"] = None
+    options["density_bins"] = 100
+    options["dpi"] = None
+    options["dynamic_limits"] = False
+    options["encoder"] = None
+    options["encoder_cpus"] = None
+    options["file_name"] = "f"
+    options["film_dir"] = "films"
+    options["fps"] = 10
+    options["frame_counts"] = None
+    options["frame_digits"] = None
+    options["frame_list"] = None
+    options["frame_range"] = None
+    options["frame_retries"] = 1
+    options["frame_shard"] = None
+    options["frame_timeout"] = None
+    options["frame_dir"] = "films/film_frames"
+    options["grid"] = False
+    options["img_fmt"] = "png"
+    options["limit_frames"] = None
+    options["line_raster"] = False
+    options["live_window"] = None
+    options["member_alpha"] = None
+    options["member_colors"] = None
+    options["nprocs"] = cpu_count()
+    options["ncontours"] = 11
+    options["outputs"] = None
+    options["pin_workers"] = False
+    options["sampled_limits"] = None
+    options["scatter_max"] = 10000
+    options["segment_frames"] = None
+    options["speculative"] = False
+    options["start_method"] = None
+    options["static_background"] = False
+    options["palette_frames"] = 10
+    options["preview"] = None
+    options["profile"] = None
+    options["preview_dpi"] = 50
+    options["preview_done"] = None
+    options["times"] = None
+    options["title"] = ""
+    options["tri_mask"] = None
+    options["tri_min_circle_ratio"] = None
+    options["triangles"] = None
+    options["video_fmt"] = "mp4"
+    options["worker_threads"] = 1
+    options["xlabel"] = "x"
+    options["xlim"] = None
+    options["xticks"] = None
+    options["ylabel"] = "y"
+    options["ylim"] = None
+    options["yticks"] = None
+    options["zlim"] = None
+
+    return options
+
+
+def set_user_options(options, user_options):
+    """
+    Replace default options with user specified ones.
+
+    An exhastive list of the available options is given in a table in the
+    documentation.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    user_options : dict
+        Dictionary of options passed in by the user as a keyword argument.
+    """
+    for key, value in user_options.items():
+        options[key] = value
+
+    # Addtional checks
+    if options["nprocs"] == None:
+        options["nprocs"] = cpu_count()
+
+    if options["img_fmt"] not in ["png", "jpg"]:
+        warnings.warn(
+            "Image format selected will not create a film. Please " "select png or jpg."
+        )
+
+    return options
+
+
+def set_up_dirs(options):
+    """
+    Checks for film directories and creates them if they don't exist.
+
+    Frames left over from a previous film of the same name, including the
+    subdirectories of sharded frames, are removed. The frame directory is
+    scanned in-process rather than using a shell glob, which fails for
+    directories with very many frames.
+
+    Parameters
+    ----------
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+    os.makedirs(options["film_dir"], exist_ok=True)
+    os.makedirs(options["frame_dir"], exist_ok=True)
+
+    prefix = re.escape(str(options["file_name"])) + r"_\d+"
+    frame = re.compile(prefix + re.escape("." + options["img_fmt"]) + "$")
+    shard = re.compile(prefix + "$")
+    with os.scandir(options["frame_dir"]) as entries:
+        for entry in entries:
+            if entry.is_dir() and shard.match(entry.name):
+                shutil.rmtree(entry.path)
+            elif frame.match(entry.name):
+                os.remove(entry.path)
+
+
+def check_data_1d(x, y):
+    """
+    Performs consistency checks on the data passed into make_film_1d.
+
+    These checks are only done when both x and y arguments are passed into the
+    function.
+
+    Parameters
+    ----------
+
+    x : array_like,
+        Array specifying the x axis.
+    y : array_like
+        Two dimensional array assumed to be of the form y(t, x), or three
+        dimensional of the form y(t, member, x) for an ensemble. This
+        specifies the values to be plotted as a function of time.
+    """
+    x_s = x.shape
+    y_s = y.shape
+
+    if len(x_s) != 1:
+        raise IndexError("x must be one dimensional.")
+
+    if len(y_s) not in [2, 3]:
+        raise IndexError("y must be two or three dimensional.")
+
+    if x_s[0] != y_s[-1]:
+        raise ValueError(
+            "x and y must have the same length: " "{0}, {1}".format(x_s[0], y_s[-1])
+        )
+
+
+def check_data_2d(x, y, z):
+    """
+    Performs consistency checks on the data passed into make_film_2d.
+
+    These checks are only done when both x, y, and z arguments are passed into
+    the function.
+
+    Parameters
+    ----------
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Array specifying the y axis.
+    z : array_like
+        Three dimensional array assumed to be of the form z(t, x, y). This
+        specifies the values to be plotted as a function of time.
+    """
+    x_s = x.shape
+    y_s = y.shape
+    z_s = z.shape
+
+    if len(x_s) != 1:
+        raise IndexError("x must be one dimensional.")
+
+    if len(y_s) != 1:
+        raise IndexError("y must be one dimensional.")
+
+    if len(z_s) != 3:
+        raise IndexError("y must be three dimensional.")
+
+    if x_s[0] != z_s[1]:
+        raise ValueError(
+            "x and z must have the same length: " "{0}, {1}".format(x_s[0], z_s[1])
+        )
+    elif y_s[0] != z_s[2]:
+        raise ValueError(
+            "y and z must have the same length: " "{0}, {1}".format(y_s[0], z_s[2])
+        )
+
+
+def check_data_tri(x, y, z):
+    """
+    Performs consistency checks on irregular grid data passed into
+    make_film_2d.
+
+    Parameters
+    ----------
+    x : array_like
+        Array specifying the x coordinates of the grid points.
+    y : array_like
+        Array specifying the y coordinates of the grid points.
+    z : array_like
+        Two dimensional array assumed to be of the form z(t, N), where N is the
+        number of grid points.
+    """
+    x_s = x.shape
+    y_s = y.shape
+    z_s = z.shape
+
+    if len(x_s) != 1:
+        raise IndexError("x must be one dimensional.")
+
+    if len(y_s) != 1:
+        raise IndexError("y must be one dimensional.")
+
+    if len(z_s) != 2:
+        raise IndexError("z must be two dimensional.")
+
+    if x_s[0] != y_s[0]:
+        raise ValueError(
+            "x and y must have the same length: " "{0}, {1}".format(x_s[0], y_s[0])
+        )
+    elif x_s[0] != z_s[1]:
+        raise ValueError(
+            "x and z must have the same length: " "{0}, {1}".format(x_s[0], z_s[1])
+        )
+
+
+def check_data_particles(points):
+    """
+    Performs consistency checks on the data passed into make_film_particles.
+
+    Parameters
+    ----------
+    points : array_like
+        Three dimensional array assumed to be of the form points(t, N, 2).
+    """
+
+    if len(points.shape) != 3:
+        raise IndexError("points must be three dimensional.")
+
+    if points.shape[2] != 2:
+        raise ValueError(
+            "points must hold 2 coordinates per particle: "
+            "{0}".format(points.shape[2])
+        )
+
+
+def make_triangulation(x, y, options):
+    """
+    Triangulates an irregular grid once for the whole film.
+
+    The Delaunay triangulation is only calculated when options['triangles'] is
+    not specified. Triangles can be masked explicitly using
+    options['tri_mask'] or, if options['tri_min_circle_ratio'] is set, by
+    masking the flat triangles found on the border of the grid.
+
+    Parameters
+    ----------
+    x : array_like
+        Array specifying the x coordinates of the grid points.
+    y : array_like
+        Array specifying the y coordinates of the grid points.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    triangulation = mtri.Triangulation(x, y, triangles=options["triangles"])
+
+    if options["tri_mask"] is not None:
+        triangulation.set_mask(options["tri_mask"])
+    elif options["tri_min_circle_ratio"] is not None:
+        analyzer = mtri.TriAnalyzer(triangulation)
+        triangulation.set_mask(
+            analyzer.get_flat_tri_mask(options["tri_min_circle_ratio"])
+        )
+
+    return triangulation
+
+
+def choose_backend(nt, options):
+    """
+    Returns the backend used to run a stage over nt tasks.
+
+    When options['backend'] is 'auto', small stages are run serially, since
+    starting the pool would take longer than the work itself. This is the case
+    when only one process is requested, when there is a single task, or when
+    the workers are started using spawn or forkserver, which import
+    matplotlib in every worker, and there are at most 10 tasks. Everything
+    else uses a process pool.
+
+    options['frame_timeout'] and options['speculative'] need workers which
+    run alongside the parent and can be terminated, so stages always use a
+    process pool when either is set and the backend is 'auto'. A warning is
+    issued if another backend has been chosen explicitly.
+
+    Parameters
+    ----------
+
+    nt : int
+        Number of tasks, usually frames, in the stage.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    backend = options.get("backend", "auto")
+    if backend not in ["auto", "process", "thread", "serial"]:
+        raise ValueError("Unknown backend: {0}".format(backend))
+    scheduled = options.get("frame_timeout") is not None or options.get("speculative")
+    if backend != "auto":
+        if scheduled and backend != "process":
+            warnings.warn(
+                "frame_timeout and speculative need the process backend: the "
+                "{0} backend can't stop hung frames.".format(backend)
+            )
+        return backend
+    elif scheduled:
+        return "process"
+
+    nprocs = options.get("nprocs") or cpu_count()
+    start_method = options.get("start_method") or mp.get_start_method()
+    if nprocs == 1 or nt <= 1:
+        return "serial"
+    elif start_method != "fork" and nt <= 10:
+        return "serial"
+
+    return "process"
+
+
+def make_pool(nt, options, initializer=None, initargs=()):
+    """
+    Create the pool of workers which runs a stage over nt tasks.
+
+    The backend is chosen by choose_backend:
+
+    * 'process': multiprocessing pool started using options['start_method']
+      ('fork', 'forkserver' or 'spawn'), or the platform default if None.
+    * 'thread': pool of threads in this process.
+    * 'serial': runs every task in this process as it is submitted. Useful for
+      debugging and tiny films.
+
+    Process workers are started by init_pool, which limits the thread pools
+    of native libraries to options['worker_threads'] and sets the CPU
+    affinity of the worker (see worker_cpus) before calling initializer.
+
+    Parameters
+    ----------
+
+    nt : int
+        Number of tasks, usually frames, in the stage.
+    options : dict
+        Dictionary of options which control various program functions.
+    initializer : callable, optional
+        Called with initargs by every worker when it starts.
+    initargs : tuple, optional
+        Arguments passed to initializer.
+    """
+
+    backend = choose_backend(nt, options)
+    nprocs = options.get("nprocs") or cpu_count()
+    nprocs = max(1, min(nprocs, nt))
+
+    if backend == "process":
+        context = mp.get_context(options.get("start_method"))
+        check_title_picklable(options, context.get_start_method())
+        limits = {
+            "threads": options.get("worker_threads"),
+            "cpus": worker_cpus(options),
+            "workers": None,
+        }
+        if options.get("pin_workers"):
+            limits["workers"] = context.Value("i", 0)
+        if options.get("encoder_cpus"):
+            nprocs = min(nprocs, len(limits["cpus"]))
+        return context.Pool(
+            processes=nprocs,
+            initializer=init_pool,
+            initargs=(limits, initializer, initargs),
+        )
+    elif backend == "thread":
+        return multiprocessing.pool.ThreadPool(
+            processes=nprocs, initializer=initializer, initargs=initargs
+        )
+
+    return SerialPool(initializer=initializer, initargs=initargs)
+
+
+def check_title_picklable(options, start_method):
+    """
+    Checks that a callable title can be sent to the workers.
+
+    Workers started with the 'spawn' or 'forkserver' start methods receive
+    the options pickled, so a callable title must be picklable, e.g. a
+    function defined at the top level of a module rather than a lambda or a
+    nested function.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    start_method : str
+        Start method of the worker processes.
+    """
+
+    if start_method == "fork" or not callable(options.get("title")):
+        return
+
+    try:
+        pickle.dumps(options["title"])
+    except Exception as e:
+        raise ValueError(
+            "A callable title must be picklable, e.g. a function defined at the "
+            "top level of a module, when workers are started with the "
+            "'{0}' start method: {1}".format(start_method, e)
+        )
+
+
+def init_pool(limits, initializer=None, initargs=()):
+    """
+    Limit the threads and CPUs of a process worker and call its initializer.
+
+    Native libraries such as OpenBLAS and OpenMP start a thread per CPU by
+    default, so nprocs workers could otherwise run nprocs times as many
+    threads as there are CPUs. The limit is set through THREAD_VARIABLES,
+    which covers libraries loaded after the worker starts and any processes
+    it starts, and through threadpoolctl, if it is installed, for libraries
+    numpy has already loaded.
+
+    Parameters
+    ----------
+
+    limits : dict
+        'threads' is the number of native threads each worker may run, or
+        None for no limit, and 'cpus' the CPUs the workers may run on, or
+        None. 'workers' counts the workers started so far when each worker is
+        pinned to a single one of these CPUs, and is None otherwise.
+    initializer : callable, optional
+        Called with initargs once the limits are set.
+    initargs : tuple, optional
+        Arguments passed to initializer.
+    """
+
+    if limits["threads"] is not None:
+        for name in THREAD_VARIABLES:
+            os.environ[name] = str(limits["threads"])
+        try:
+            import threadpoolctl
+        except ImportError:
+            pass
+        else:
+            threadpoolctl.threadpool_limits(limits["threads"])
+
+    cpus = limits["cpus"]
+    if cpus and hasattr(os, "sched_setaffinity"):
+        if limits["workers"] is not None:
+            # Replacement workers continue the count, so they take over the
+            # CPUs of the workers they replace.
+            with limits["workers"].get_lock():
+                worker = limits["workers"].value
+                limits["workers"].value += 1
+            cpus = [cpus[worker % len(cpus)]]
+        os.sched_setaffinity(0, cpus)
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def available_cpus():
+    """
+    Returns the CPUs this process may run on.
+
+    This respects the affinity mask of the process, e.g. set by taskset,
+    a batch scheduler or a cpuset cgroup.
+    """
+
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_count():
+    """
+    Returns the number of CPUs this process may use.
+
+    This is the number of CPUs in its affinity mask, limited by the CPU quota
+    of its cgroup, so containers and batch jobs don't start more workers than
+    they have CPUs.
+    """
+
+    count = len(available_cpus())
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (IOError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except IOError:
+            quota = "max"
+
+    if quota not in ["max", "-1"]:
+        count = min(count, max(1, int(math.ceil(int(quota) / int(period)))))
+
+    return count
+
+
+def worker_cpus(options):
+    """
+    Returns the CPUs the render workers run on, or None if they aren't
+    restricted.
+
+    When options['encoder_cpus'] is set the last encoder_cpus available CPUs
+    are left to the encoder (see encoder_affinity) and the workers run on the
+    rest, so frames can be rendered while another film is being encoded.
+    When options['pin_workers'] is set each worker is pinned to one of these
+    CPUs.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if not options.get("encoder_cpus") and not options.get("pin_workers"):
+        return None
+
+    cpus = available_cpus()
+    reserved = min(options.get("encoder_cpus") or 0, len(cpus) - 1)
+    return cpus[: len(cpus) - reserved]
+
+
+def encoder_affinity(options):
+    """
+    Returns the CPUs reserved for the encoder by options['encoder_cpus'], or
+    None if the encoder may use any CPU.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if not options.get("encoder_cpus") or not hasattr(os, "sched_setaffinity"):
+        return None
+
+    cpus = available_cpus()
+    return cpus[max(len(cpus) - options["encoder_cpus"], 0) :]
+
+
+def start_encoder(command, options, **kwargs):
+    """
+    Start an encoder process restricted to the CPUs returned by
+    encoder_affinity.
+
+    The command is run without a shell, so the affinity is set in the
+    encoder's own process before it starts, and every thread it starts
+    inherits it.
+
+    Parameters
+    ----------
+
+    command : str or list
+        Command passed to subprocess.Popen. A string is split into its
+        arguments as by a shell.
+    options : dict
+        Dictionary of options which control various program functions.
+    kwargs : dict
+        Other arguments passed to subprocess.Popen.
+    """
+
+    if isinstance(command, str):
+        command = shlex.split(command)
+
+    cpus = encoder_affinity(options)
+    if cpus is not None:
+        kwargs["preexec_fn"] = functools.partial(os.sched_setaffinity, 0, cpus)
+    encoder = subprocess.Popen(command, **kwargs)
+
+    return encoder
+
+
+def map_frames(
+    pool, func, params, options, profile=False, initializer=None, initargs=()
+):
+    """
+    Run func over the parameters of every frame using a pool of workers.
+
+    When profile is True and options['profile'] is set, each frame is run
+    under cProfile inside its worker by profile_task. The statistics of all
+    frames are merged in the parent, written to options['profile'] in pstats
+    format and summarized by profile_breakdown. From Python 3.12 only one
+    profiler can be active at once, so frames plotted by a pool of threads
+    aren't profiled there.
+
+    When options['frame_timeout'] or options['speculative'] is set the frames
+    are scheduled by schedule_frames, which retries hung frames and
+    re-executes stragglers. If the stage fails or is interrupted, e.g. by
+    Ctrl-C, the pool is terminated and partly written frames are removed.
+
+    Parameters
+    ----------
+
+    pool : multiprocessing.pool.Pool
+        Pool of workers created by make_pool.
+    func : callable
+        Function called with the parameters of each frame.
+    params : iterable
+        Parameters of each frame.
+    options : dict
+        Dictionary of options which control various program functions.
+    profile : bool, optional
+        Whether this stage may be profiled.
+    initializer : callable, optional
+        Initializer of the pool, used to start fresh workers.
+    initargs : tuple, optional
+        Arguments passed to initializer.
+    """
+
+    profile = profile and options.get("profile") is not None
+    if (
+        profile
+        and isinstance(pool, multiprocessing.pool.ThreadPool)
+        and sys.version_info >= (3, 12)
+    ):
+        warnings.warn(
+            "profile is ignored for the thread backend from Python 3.12, where "
+            "only one profiler can be active at once."
+        )
+        profile = False
+    if profile:
+        params = [(func, args) for args in params]
+        func = profile_task
+
+    try:
+        if options.get("frame_timeout") is None and not options.get("speculative"):
+            results = pool.map(func, params)
+        else:
+            results = schedule_frames(
+                pool, func, list(params), options, initializer, initargs
+            )
+    except BaseException:
+        pool.terminate()
+        remove_temp_frames(options)
+        raise
+
+    if not profile or len(results) == 0:
+        return results
+
+    stats = pstats.Stats(ProfileData(results[0][1]))
+    for result in results[1:]:
+        stats.add(ProfileData(result[1]))
+    stats.dump_stats(options["profile"])
+    print(profile_breakdown(stats, len(results)))
+
+    return [result[0] for result in results]
+
+
+def schedule_frames(pool, func, params, options, initializer=None, initargs=()):
+    """
+    Run func over the parameters of every frame, retrying hung frames and
+    re-executing stragglers.
+
+    No more frames are submitted than there are workers, so each frame's
+    time is measured from when it starts. A frame running for longer than
+    options['frame_timeout'] seconds is assumed to be hung: the pool is
+    terminated and replaced by a fresh one, to which the hung frame and the
+    other frames which were still running are submitted again. Only the hung
+    frame counts towards its options['frame_retries'] retries, and there are
+    never more than options['nprocs'] workers. When options['speculative']
+    is set and there are no frames left to submit, frames which have been
+    running for more than twice the median frame time are submitted a second
+    time to idle workers. The first attempt of a frame to finish is used.
+
+    Workers which are still running when every frame has finished are
+    terminated, so pool may no longer be running once this returns.
+
+    Parameters
+    ----------
+
+    pool : multiprocessing.pool.Pool
+        Pool of workers created by make_pool.
+    func : callable
+        Function called with the parameters of each frame.
+    params : list
+        Parameters of each frame.
+    options : dict
+        Dictionary of options which control various program functions.
+    initializer : callable, optional
+        Initializer of the pool, used to start fresh workers.
+    initargs : tuple, optional
+        Arguments passed to initializer.
+    """
+
+    n = len(params)
+    nprocs = options.get("nprocs") or cpu_count()
+    nprocs = max(1, min(nprocs, n))
+    timeout = options.get("frame_timeout")
+    retries = options.get("frame_retries", 1)
+
+    results = [None] * n
+    finished = [False] * n
+    timeouts = [0] * n
+    queue = collections.deque(range(n))
+    running = []
+    durations = []
+    replaced = False
+
+    try:
+        while not all(finished):
+            active = len(running)
+            while len(queue) > 0 and active < nprocs:
+                i = queue.popleft()
+                if not finished[i]:
+                    running.append(submit_frame(pool, func, params, i))
+                    active += 1
+
+            if len(queue) == 0 and options.get("speculative") and durations:
+                slow = 2 * np.median(durations)
+                for task in sorted(running, key=lambda task: task["start"]):
+                    copies = [t for t in running if t["frame"] == task["frame"]]
+                    if active >= nprocs:
+                        break
+                    if len(copies) == 1 and time.time() - task["start"] > slow:
+                        running.append(submit_frame(pool, func, params, task["frame"]))
+                        active += 1
+
+            if len(running) > 0:
+                running[0]["result"].wait(0.02)
+
+            now = time.time()
+            for task in list(running):
+                i = task["frame"]
+                if finished[i]:
+                    running.remove(task)
+                elif task["result"].ready():
+                    running.remove(task)
+                    results[i] = task["result"].get()
+                    finished[i] = True
+                    durations.append(now - task["start"])
+                elif timeout is not None and now - task["start"] > timeout:
+                    timeouts[i] += 1
+                    if timeouts[i] > retries:
+                        raise mp.TimeoutError(
+                            "Frame {0} timed out {1} times after {2} s.".format(
+                                i, timeouts[i], timeout
+                            )
+                        )
+                    warnings.warn(
+                        "Frame {0} timed out after {1} s, retrying on fresh "
+                        "workers.".format(i, timeout)
+                    )
+                    # The hung worker can't be stopped on its own, so every
+                    # frame running on the pool is resubmitted to a new one.
+                    for other in reversed(running):
+                        if other["frame"] not in queue:
+                            queue.appendleft(other["frame"])
+                    running = []
+                    pool.terminate()
+                    pool = make_pool(n, options, initializer, initargs)
+                    replaced = True
+                    break
+    finally:
+        if len(running) > 0:
+            pool.terminate()
+        elif replaced:
+            pool.close()
+            pool.join()
+        remove_temp_frames(options)
+
+    return results
+
+
+def submit_frame(pool, func, params, i):
+    """
+    Submit a frame to a pool and return the task tracked by schedule_frames.
+
+    Parameters
+    ----------
+
+    pool : multiprocessing.pool.Pool
+        Pool of workers the frame is submitted to.
+    func : callable
+        Function called with the parameters of the frame.
+    params : list
+        Parameters of each frame.
+    i : int
+        Index of the frame in params.
+    """
+
+    return {
+        "frame": i,
+        "pool": pool,
+        "start": time.time(),
+        "result": pool.apply_async(func, (params[i],)),
+    }
+
+
+def remove_temp_frames(options):
+    """
+    Remove frames of this film which were only partly written, e.g. by a
+    worker which was terminated. The temporary frames of other films being
+    written to options['frame_dir'] are left alone.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if not os.path.isdir(options["frame_dir"]):
+        return
+
+    prefix = re.escape(str(options["file_name"])) + r"_\d+"
+    temp = re.compile(prefix + re.escape("." + options["img_fmt"]) + r"\.\d+-\d+\.tmp$")
+    shard = re.compile(prefix + "$")
+    dirs = [options["frame_dir"]]
+    while len(dirs) > 0:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir() and shard.match(entry.name):
+                    dirs.append(entry.path)
+                elif temp.match(entry.name):
+                    os.remove(entry.path)
+
+
+def profile_task(args):
+    """
+    Run a single task under cProfile and return its result and statistics.
+
+    Parameters
+    ----------
+
+    func : callable
+        Function being profiled.
+    task : tuple
+        Parameters passed to func.
+    """
+
+    func, task = args
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        result = func(task)
+    finally:
+        profile.disable()
+
+    return result, pstats.Stats(profile).stats
+
+
+class ProfileData(object):
+    """
+    Profile statistics returned by a worker, in the form pstats.Stats loads.
+
+    Parameters
+    ----------
+
+    stats : dict
+        Raw statistics of a pstats.Stats object.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profile_breakdown(stats, nframes):
+    """
+    Summarize where the time plotting the frames was spent.
+
+    The time spent inside each function, excluding the functions it calls, is
+    attributed to one of the categories below using the module it belongs to.
+
+    Parameters
+    ----------
+
+    stats : pstats.Stats
+        Merged statistics of every frame.
+    nframes : int
+        Number of frames profiled.
+    """
+
+    categories = collections.OrderedDict(
+        [
+            (
+                "contour generation",
+                ["matplotlib.contour", "matplotlib.tri", "matplotlib._contour"]
+                + ["matplotlib._tri", "contourpy"],
+            ),
+            ("colorbar layout", ["matplotlib.colorbar", "mpl_toolkits.axes_grid1"]),
+            (
+                "text rendering",
+                ["matplotlib.text", "matplotlib.font_manager", "matplotlib.ft2font"]
+                + ["matplotlib.mathtext", "matplotlib._mathtext"]
+                + ["matplotlib.textpath", "matplotlib._text_helpers"],
+            ),
+            (
+                "axes and ticks",
+                ["matplotlib.axis", "matplotlib.axes", "matplotlib.ticker"]
+                + ["matplotlib.spines", "matplotlib.lines"],
+            ),
+            (
+                "drawing",
+                ["matplotlib.collections", "matplotlib.patches", "matplotlib.path"]
+                + ["matplotlib._path", "matplotlib.backends.backend_agg"]
+                + ["matplotlib.backends._backend_agg", "matplotlib.artist"]
+                + ["matplotlib.transforms", "matplotlib.image"],
+            ),
+            ("savefig/compression", ["PIL", "zlib", "matplotlib._png"]),
+        ]
+    )
+    times = collections.OrderedDict((name, 0.0) for name in categories)
+    times["other"] = 0.0
+
+    for (filename, lineno, funcname), stat in stats.stats.items():
+        module = profile_module(filename, funcname)
+        for name, modules in categories.items():
+            if any(module == m or module.startswith(m + ".") for m in modules):
+                times[name] += stat[2]
+                break
+        else:
+            times["other"] += stat[2]
+
+    total = max(stats.total_tt, 1e-12)
+    lines = [
+        "Profile of {0} frames: {1:.3f} s in total, {2:.3f} s per frame".format(
+            nframes, stats.total_tt, stats.total_tt / max(nframes, 1)
+        )
+    ]
+    for name, seconds in times.items():
+        lines.append(
+            "    {0:<20} {1:9.3f} s {2:6.1f}%".format(
+                name, seconds, 100 * seconds / total
+            )
+        )
+
+    return "\n".join(lines)
+
+
+def profile_module(filename, funcname):
+    """
+    Returns the name of the module a profiled function belongs to.
+
+    Python functions are identified by the path of their file below
+    site-packages, or the standard library, and built-in functions and
+    methods by the qualified name cProfile gives them. Methods of Pillow's
+    C types, which have no module, are attributed to PIL.
+
+    Parameters
+    ----------
+
+    filename : str
+        File name of the function in the profile statistics.
+    funcname : str
+        Name of the function in the profile statistics.
+    """
+
+    if filename == "~":
+        match = re.match(r"<(?:built-in method |method '\w+' of ')([\w.]+)", funcname)
+        if match is None:
+            return ""
+        name = match.group(1)
+        if "." not in name and name.startswith("Imaging"):
+            return "PIL"
+        return name.rsplit(".", 1)[0]
+
+    path = filename.replace("\\", "/")
+    match = re.match(r".*/(?:site-packages|dist-packages)/(.*)", path)
+    if match is None:
+        match = re.match(r".*/lib/python[\d.]+/(.*)", path)
+    parts = (match.group(1) if match else os.path.basename(path)).split("/")
+    parts[-1] = os.path.splitext(parts[-1])[0]
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+
+    return ".".join(parts)
+
+
+class SerialPool(object):
+    """
+    Drop-in replacement for a multiprocessing pool which runs every task in
+    the calling process.
+
+    Parameters
+    ----------
+
+    initializer : callable, optional
+        Called with initargs when the pool is created.
+    initargs : tuple, optional
+        Arguments passed to initializer.
+    """
+
+    def __init__(self, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+
+    def map(self, func, iterable, chunksize=None):
+        return [func(args) for args in iterable]
+
+    def apply_async(self, func, args=(), kwds={}):
+        return SerialResult(func, args, kwds)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class SerialResult(object):
+    """
+    Result of a task run by a SerialPool, mirroring multiprocessing's
+    AsyncResult.
+    """
+
+    def __init__(self, func, args, kwds):
+        self.value = None
+        self.error = None
+        try:
+            self.value = func(*args, **kwds)
+        except Exception as e:
+            self.error = e
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self.error is None
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def init_worker(key, shared):
+    """
+    Stores film-wide data in each pool worker before any frames are plotted.
+
+    When the shared data describes an irregular grid the triangulation is
+    rebuilt from the precomputed triangles and mask, so no Delaunay
+    triangulation is performed in the workers, and its C++ counterpart
+    (neighbours, edges and boundaries) is built once per worker rather than
+    once per frame.
+
+    Parameters
+    ----------
+    key : int
+        Id of the film the data belongs to.
+    shared : dict
+        Dictionary of data which is identical for every frame.
+    """
+
+    data = dict(shared)
+
+    if "triangles" in shared:
+        triangulation = mtri.Triangulation(
+            shared["x"], shared["y"], triangles=shared["triangles"], mask=shared["mask"]
+        )
+        triangulation.get_cpp_triangulation()
+        data["triangulation"] = triangulation
+
+    worker_data[key] = data
+
+
+def plot_frames(frames, source, z, shared, options):
+    """
+    Plot the frames of a film using a pool of workers.
+
+    The axes, options and plot_options are identical for every frame, so
+    they are sent to each worker once by init_worker. Each task only holds
+    the film id, the frame index and its time slice, which keeps the data
+    sent to the workers proportional to the size of the film. When z is a
+    FrameFunction, the task holds the time index instead and the worker
+    evaluates the slice itself.
+
+    Parameters
+    ----------
+
+    frames : array_like
+        Index of each frame being plotted.
+    source : array_like
+        Time index of the slice of z plotted in each frame.
+    z : array_like or FrameFunction
+        The array being plotted, with time as the first dimension.
+    shared : dict
+        Dictionary of data which is identical for every frame, where
+        shared['plot'] is '1d', '2d' or 'tri'.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    make_frame_dirs(frames, options)
+    if shared["plot"] == "2d" and contour_threads(shared):
+        if isinstance(z, FrameFunction):
+            warnings.warn(
+                "The FrameFunction is evaluated by the contour_threads in this "
+                "process, which calculate the contours."
+            )
+        blocks = contour_frames(frames, source, z, shared, options)
+    elif isinstance(z, FrameFunction):
+        # Only the function is sent to the workers, which evaluate it for the
+        # time indices of their frames.
+        shared = dict(shared, frame_function=z, source=np.asarray(source))
+        blocks = [zip(frames, source)]
+    else:
+        blocks = [zip(frames, (z[i] for i in source))]
+    key = next(film_ids)
+    pool = make_pool(
+        len(frames), options, initializer=init_worker, initargs=(key, shared)
+    )
+    if options.get("frame_timeout") is not None or options.get("speculative"):
+        # schedule_frames may replace the pool, so every frame is mapped at once.
+        blocks = [itertools.chain.from_iterable(blocks)]
+    try:
+        for block in blocks:
+            map_frames(
+                pool,
+                plot_frame,
+                [(key, it, z_it) for it, z_it in block],
+                options,
+                profile=True,
+                initializer=init_worker,
+                initargs=(key, shared),
+            )
+    finally:
+        worker_data.pop(key, None)
+    pool.close()
+    pool.join()
+
+
+def contour_threads(shared):
+    """
+    Returns whether the contours of a 2D film are calculated by contour_frames.
+
+    This is the case when options['contour_threads'] is set, the film has
+    explicit, finite levels which aren't log scaled and FilledContours is
+    supported (see filled_contours_supported). Other films are left to
+    contourf, with a warning if contour_threads is set but unsupported.
+
+    Parameters
+    ----------
+
+    shared : dict
+        Dictionary of data which is identical for every frame.
+    """
+
+    if not shared["options"].get("contour_threads"):
+        return False
+    elif not filled_contours_supported():
+        warnings.warn(
+            "contour_threads needs matplotlib 3.8 or later and contourpy, and "
+            "contour sets which FilledContours can draw, so the contours are "
+            "calculated by contourf."
+        )
+        return False
+
+    plot_options = shared["plot_options"]
+    levels = plot_options.get("levels")
+    return (
+        np.ndim(levels) > 0
+        and np.all(np.isfinite(levels))
+        and not isinstance(plot_options.get("norm"), mpl.colors.LogNorm)
+        and not isinstance(plot_options.get("locator"), mpl.ticker.LogLocator)
+    )
+
+
+def contour_frames(frames, source, z, shared, options):
+    """
+    Calculate the filled contours of the frames of a 2D film in a pool of
+    threads.
+
+    The contours are calculated by contour_slice using contourpy, which
+    releases the GIL, so options['contour_threads'] threads in this process
+    calculate contours in parallel without the memory of a process per
+    thread. The frames are split into blocks, and the contours of the next
+    block are calculated while the current block is being plotted. Yields
+    each block as a list of (frame index, contours) pairs.
+
+    Parameters
+    ----------
+
+    frames : array_like
+        Index of each frame being plotted.
+    source : array_like
+        Time index of the slice of z plotted in each frame.
+    z : array_like
+        The array being plotted, with time as the first dimension.
+    shared : dict
+        Dictionary of data which is identical for every frame.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    # A single block when profiling, so the statistics cover every frame.
+    size = max(64, 8 * (options.get("nprocs") or 1))
+    if options.get("profile") is not None:
+        size = len(frames)
+    blocks = [
+        (frames[k : k + size], source[k : k + size])
+        for k in range(0, len(frames), size)
+    ]
+
+    threads = multiprocessing.pool.ThreadPool(options["contour_threads"])
+    try:
+        pending = None
+        for k, (block, slices) in enumerate(blocks):
+            if pending is None:
+                pending = threads.map_async(
+                    contour_slice, [(it, z[i], shared) for it, i in zip(block, slices)]
+                )
+            contours = pending.get()
+            pending = None
+            if k + 1 < len(blocks):
+                pending = threads.map_async(
+                    contour_slice,
+                    [(it, z[i], shared) for it, i in zip(*blocks[k + 1])],
+                )
+            yield list(zip(block, contours))
+    finally:
+        threads.terminate()
+        threads.join()
+
+
+def contour_slice(args):
+    """
+    Calculate the filled contours of a time slice of a 2D film.
+
+    The bands between the levels, including the extended bands of
+    plot_options['extend'], are calculated with the same contourpy algorithm
+    and settings as contourf. Returns a dictionary holding the vertices and
+    codes of the path of each band and the range of the slice, which is
+    drawn by FilledContours.
+
+    Parameters
+    ----------
+
+    it : int
+        Frame index being plotted.
+    z : array_like
+        Time slice being plotted.
+    shared : dict
+        Dictionary of data which is identical for every frame.
+    """
+
+    import contourpy
+
+    it, z, shared = args
+    plot_options = frame_options(it, shared["options"], shared["plot_options"])[1]
+
+    x = np.asarray(shared["x"], dtype=np.float64)
+    y = np.asarray(shared["y"], dtype=np.float64)
+    z = np.ma.masked_invalid(np.asarray(z).T, copy=False)
+    zmin = float(z.min())
+    zmax = float(z.max())
+
+    levels = list(np.asarray(plot_options["levels"], dtype=np.float64))
+    if plot_options.get("extend", "neither") in ["both", "min"]:
+        levels.insert(0, -1e250)
+    if plot_options.get("extend", "neither") in ["both", "max"]:
+        levels.append(1e250)
+    lowers = levels[:-1]
+    if zmin == lowers[0]:
+        # Include the minimum in the lowest band, as contourf does.
+        lowers[0] -= 1
+
+    algorithm = plot_options.get("algorithm") or mpl.rcParams["contour.algorithm"]
+    corner_mask = plot_options.get("corner_mask")
+    if corner_mask is None:
+        corner_mask = algorithm != "mpl2005" and mpl.rcParams["contour.corner_mask"]
+    generator = contourpy.contour_generator(
+        x,
+        y,
+        z,
+        name=algorithm,
+        corner_mask=corner_mask,
+        fill_type=contourpy.FillType.OuterCode,
+        chunk_size=plot_options.get("nchunk", 0),
+    )
+
+    paths = []
+    for lower, upper in zip(lowers, levels[1:]):
+        vertices, codes = generator.filled(lower, upper)
+        if len(vertices) > 0:
+            paths.append((np.concatenate(vertices), np.concatenate(codes)))
+        else:
+            paths.append((np.empty((0, 2)), None))
+
+    return {
+        "paths": paths,
+        "zmin": zmin,
+        "zmax": zmax,
+        "mins": [x.min(), y.min()],
+        "maxs": [x.max(), y.max()],
+    }
+
+
+def filled_contours(ax, x, y, z, plot_options):
+    """
+    Plot the filled contours of a time slice of a 2D film.
+
+    Parameters
+    ----------
+
+    ax : matplotlib.axes.Axes
+        Axes the contours are plotted in.
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Array specifying the y axis.
+    z : array_like or dict
+        Time slice being plotted, or its contours calculated by
+        contour_slice.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    if type(z) == dict:
+        return FilledContours(ax, z, filled=True, **plot_options)
+
+    return ax.contourf(x, y, z.T, **plot_options)
+
+
+def filled_contours_supported():
+    """
+    Returns whether FilledContours can be used.
+
+    FilledContours relies on the contour sets of matplotlib 3.8 and later,
+    which store a single path per level, and the contours are calculated
+    using contourpy, which matplotlib only requires from 3.6. As it replaces
+    private methods of ContourSet, which may change in any later version,
+    a small contour plot and its color bar are also drawn both by
+    FilledContours and by contourf, and FilledContours is only used if the
+    two images are identical. The result is kept for the installed version
+    of matplotlib.
+    """
+
+    try:
+        import contourpy
+    except ImportError:
+        return False
+
+    version = re.match(r"(\d+)\.(\d+)", mpl.__version__)
+    if tuple(int(v) for v in version.groups()) < (3, 8):
+        return False
+
+    if mpl.__version__ not in filled_contours_checks:
+        x, y = np.arange(4.0), np.arange(3.0)
+        z = np.add.outer(x, y**2)
+        plot_options = {"levels": [1, 3, 5, 7], "extend": "both"}
+        shared = {"x": x, "y": y, "options": {}, "plot_options": plot_options}
+        images = []
+        for contours in [z, contour_slice((0, z, shared))]:
+            fig = Figure(figsize=(2, 1), dpi=40)
+            canvas = FigureCanvasAgg(fig)
+            ax = fig.subplots()
+            try:
+                fig.colorbar(filled_contours(ax, x, y, contours, plot_options))
+                canvas.draw()
+            except Exception:
+                break
+            images.append(np.asarray(canvas.buffer_rgba()))
+        filled_contours_checks[mpl.__version__] = len(images) == 2 and bool(
+            np.all(images[0] == images[1])
+        )
+
+    return filled_contours_checks[mpl.__version__]
+
+
+class FilledContours(mcontour.ContourSet):
+    """
+    Filled contours drawn from paths calculated by contour_slice.
+
+    This behaves like the contour set returned by contourf, e.g. when making
+    the color bar, but no contours are calculated while the frame is
+    plotted. Only used when filled_contours_supported returns True.
+
+    Parameters
+    ----------
+
+    ax : matplotlib.axes.Axes
+        Axes the contours are plotted in.
+    contours : dict
+        Contours of the time slice returned by contour_slice.
+    **kwargs
+        Keyword arguments of contourf.
+    """
+
+    def _process_args(self, contours, corner_mask=None, algorithm=None, **kwargs):
+        self.levels = np.asarray(self.levels, dtype=np.float64)
+        self.zmin = contours["zmin"]
+        self.zmax = contours["zmax"]
+        self._mins = contours["mins"]
+        self._maxs = contours["maxs"]
+        self._paths = [Path(vertices, codes) for vertices, codes in contours["paths"]]
+
+        return kwargs
+
+
+def plot_frame(args):
+    """
+    Plot a single frame using the film-wide data stored by init_worker.
+
+    Parameters
+    ----------
+
+    key : int
+        Id of the film being plotted.
+    it : int
+        Frame index being plotted.
+    z : array_like or int
+        Time slice plotted in the frame, or its time index when the film's
+        data is a FrameFunction.
+    """
+
+    key, it, z = args
+    data = worker_data[key]
+    if "frame_function" in data:
+        z = data["frame_function"].frame(z, data["source"])
+
+    if data["plot"] == "particles":
+        plot_particles((it, z, data["plot_options"], data["options"]))
+    elif data["plot"] == "1d" and data.get("ensemble"):
+        plot_ensemble((it, data["x"], z, data["plot_options"], data["options"]))
+    elif data["plot"] == "1d" and data.get("decimated"):
+        plot_1d((it, z[0], z[1], data["plot_options"], data["options"]))
+    elif data["plot"] == "1d":
+        plot_1d((it, data["x"], z, data["plot_options"], data["options"]))
+    elif data["options"]["static_background"]:
+        backgrounds = data.setdefault("backgrounds", {})
+        thread = threading.get_ident()
+        if thread not in backgrounds:
+            backgrounds[thread] = StaticBackground(data, z)
+        backgrounds[thread].plot(it, z)
+    elif data["plot"] == "2d":
+        plot_2d((it, data["x"], data["y"], z, data["plot_options"], data["options"]))
+    else:
+        plot_tri((it, data["triangulation"], z, data["plot_options"], data["options"]))
+
+
+class StaticBackground(object):
+    """
+    Plots the frames of a 2D film over a background which is drawn once.
+
+    The axes, tick labels, axis labels and color bar of a film with fixed
+    contours and color bar ticks are the same in every frame. They are drawn
+    once, without the data and title, and the resulting bitmap is kept. Each
+    frame then restores the bitmap and draws only the filled contours, the
+    spines and grid lines on top of them and the title, before the pixels
+    are written out using Pillow.
+
+    Every worker thread creates its own StaticBackground, since figures can't
+    be drawn by several threads at once.
+
+    Parameters
+    ----------
+
+    data : dict
+        Film-wide data stored by init_worker.
+    z : array_like
+        Time slice used to lay out the first frame.
+    """
+
+    def __init__(self, data, z):
+        self.data = data
+        self.options = data["options"]
+        self.plot_options = data["plot_options"]
+
+        dpi = self.options["dpi"]
+        if dpi is None and mpl.rcParams["savefig.dpi"] != "figure":
+            dpi = mpl.rcParams["savefig.dpi"]
+        self.fig = Figure(dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+
+        im = self.contour(z)
+        decorate_2d_plot(0, self.fig, self.ax, im, self.options)
+        title = self.ax.title.get_text()
+        self.ax.title.set_text("")
+        im.set_visible(False)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        im.remove()
+        self.ax.title.set_text(title)
+
+        self.overlay = list(self.ax.spines.values())
+        if self.options["grid"]:
+            for axis in [self.ax.xaxis, self.ax.yaxis]:
+                self.overlay += [tick.gridline for tick in axis.get_major_ticks()]
+
+    def contour(self, z):
+        """
+        Plot the filled contours of a time slice.
+
+        Parameters
+        ----------
+
+        z : array_like
+            Time slice being plotted.
+        """
+
+        if self.data["plot"] == "tri":
+            return self.ax.tricontourf(
+                self.data["triangulation"], z, **self.plot_options
+            )
+
+        return filled_contours(
+            self.ax, self.data["x"], self.data["y"], z, self.plot_options
+        )
+
+    def plot(self, it, z):
+        """
+        Plot and save the frame of a time step.
+
+        Parameters
+        ----------
+
+        it : int
+            Time index being plotted.
+        z : array_like
+            Time slice being plotted.
+        """
+
+        self.canvas.restore_region(self.background)
+
+        im = self.contour(z)
+        self.ax.draw_artist(im)
+        for artist in self.overlay:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+        self.ax.title.set_text(frame_title(it, self.options))
+        self.ax.draw_artist(self.ax.title)
+        im.remove()
+
+        image = Image.fromarray(np.asarray(self.canvas.buffer_rgba()))
+        if self.options["img_fmt"] == "jpg":
+            image = image.convert("RGB")
+        image.save(
+            temp_frame_path(it, self.options),
+            format=Image.registered_extensions()["." + self.options["img_fmt"]],
+        )
+        os.replace(temp_frame_path(it, self.options), frame_path(it, self.options))
+
+
+def raster_frames(frames, source, x, y, options, plot_options):
+    """
+    Draw the frames of a 1D film using LineRaster.
+
+    When the whole film is being made by ffmpeg/avconv the raw frames are
+    piped straight to the encoder, so no image files are written, and True is
+    returned once the film is encoded. Otherwise, e.g. for previews, frame
+    ranges, deduplicated and GIF films, the frames are saved as images and
+    False is returned so they are encoded as usual.
+
+    Parameters
+    ----------
+
+    frames : array_like
+        Index of each frame being plotted.
+    source : array_like
+        Time index of the slice of y plotted in each frame.
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Two dimensional array of the form y(t, x), or DecimatedLines.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations of the line.
+    """
+
+    raster = LineRaster(x, y[source[0]], options, plot_options)
+
+    pipe = (
+        options["encoder"] in ["ffmpeg", "avconv"]
+        and options.get("segment_frames") is None
+        and options.get("frame_range") is None
+        and options.get("frame_list") is None
+        and options.get("frame_counts") is None
+    )
+    if not pipe:
+        make_frame_dirs(frames, options)
+        for it, i in zip(frames, source):
+            image = Image.fromarray(raster.frame(it, y[i]))
+            image.save(
+                temp_frame_path(it, options),
+                format=Image.registered_extensions()["." + options["img_fmt"]],
+            )
+            os.replace(temp_frame_path(it, options), frame_path(it, options))
+        return False
+
+    command = live_encoder_command(options, raster.size)
+    encoder = start_encoder(command, options, stdin=subprocess.PIPE)
+    try:
+        for it, i in zip(frames, source):
+            encoder.stdin.write(raster.frame(it, y[i]).tobytes())
+    except BaseException:
+        encoder.kill()
+        raise
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+    print("Encode command: " + " ".join(shlex.quote(arg) for arg in command))
+
+    return True
+
+
+class LineRaster(object):
+    """
+    Draws the frames of a 1D film by rasterizing the line with NumPy.
+
+    The axes, ticks, labels and title are rendered once by Matplotlib and
+    kept as a bitmap. The line of each frame is then drawn over a copy of the
+    bitmap without Matplotlib: the line is sampled every half pixel, the
+    anti-aliased coverage of the pixels around each sample is calculated in
+    one vectorised pass and the line's color is blended in using the largest
+    coverage of each pixel. The axes are only rendered again when the title
+    or the y limits of a frame change.
+
+    Only solid lines without markers are supported, using the color,
+    linewidth and alpha of plot_options.
+
+    Parameters
+    ----------
+
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Line of the first frame, used to lay out the axes, or the x and y
+        values of its decimated line (see DecimatedLines).
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations of the line.
+    """
+
+    def __init__(self, x, y, options, plot_options):
+        self.options = options
+        self.x = np.asarray(x, dtype=np.float64)
+        if np.ndim(y) == 2:
+            x, y = y
+
+        dpi = options["dpi"]
+        if dpi is None and mpl.rcParams["savefig.dpi"] != "figure":
+            dpi = mpl.rcParams["savefig.dpi"]
+        self.fig = Figure(dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+
+        line = self.ax.plot(x, y, **plot_options)[0]
+        if line.get_linestyle() not in ["-", "solid"] or line.get_marker() not in [
+            None,
+            "",
+            "None",
+            "none",
+        ]:
+            raise ValueError("line_raster only draws solid lines without markers.")
+        alpha = line.get_alpha()
+        rgba = mpl.colors.to_rgba(line.get_color(), alpha)
+        self.color = 255 * np.array(rgba[:3], dtype=np.float32)
+        width = line.get_linewidth() * self.fig.dpi / 72
+        self.radius = width / 2 + 0.5
+        self.weight = min(width, 1) * rgba[3]
+        # Pixels around a sample that no point of its pixel can reach within
+        # the radius are left out.
+        k = int(np.ceil(self.radius))
+        offsets = np.arange(-k, k + 1)
+        du, dv = np.repeat(offsets, len(offsets)), np.tile(offsets, len(offsets))
+        near = np.hypot(np.maximum(abs(du) - 0.5, 0), np.maximum(abs(dv) - 0.5, 0))
+        self.offsets = (du[near < self.radius], dv[near < self.radius])
+
+        decorate_1d_plot(0, self.ax, frame_options(0, options, plot_options)[0])
+        line.set_visible(False)
+        self.ax.title.set_text("")
+        self.key = None
+        self.buffer = np.zeros(0)
+        self.layout(self.ax.get_ylim())
+
+    def layout(self, ylim):
+        """
+        Render the axes with the given y limits and find the pixel coordinates
+        of the data.
+
+        Parameters
+        ----------
+
+        ylim : array_like
+            Limits of the y axis.
+        """
+
+        self.ax.set_ylim(ylim)
+        self.canvas.draw()
+        self.blank = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.size = self.canvas.get_width_height()
+
+        # Pixel rows run down from the top of the figure.
+        height = self.size[1]
+        (u0, v0), (u1, v1) = self.ax.transData.transform([[0, 0], [1, 1]])
+        self.scale = (u1 - u0, -(v1 - v0))
+        self.offset = (u0, height - v0)
+        self.u = self.offset[0] + self.scale[0] * self.x
+        x0, y0, x1, y1 = self.ax.bbox.extents
+        self.clip = (
+            int(round(x0)),
+            int(round(height - y1)),
+            int(round(x1)),
+            int(round(height - y0)),
+        )
+        self.limits = tuple(np.asarray(ylim, dtype=np.float64))
+
+    def frame(self, it, y):
+        """
+        Returns the RGB pixels of the frame of a time step.
+
+        Parameters
+        ----------
+
+        it : int
+            Time index being plotted.
+        y : array_like
+            Line being plotted, or the x and y values of its decimated line.
+        """
+
+        options = frame_options(it, self.options, {})[0]
+        ylim = self.ax.get_ylim() if options["ylim"] is None else options["ylim"]
+        title = frame_title(it, options)
+
+        if self.limits != tuple(np.asarray(ylim, dtype=np.float64)):
+            self.layout(ylim)
+            self.key = None
+        if self.key != title:
+            self.canvas.restore_region(self.blank)
+            self.ax.title.set_text(title)
+            self.ax.draw_artist(self.ax.title)
+            rgba = np.asarray(self.canvas.buffer_rgba())
+            self.background = np.ascontiguousarray(rgba[:, :, :3])
+            self.key = title
+
+        if np.ndim(y) == 2:
+            u = self.offset[0] + self.scale[0] * np.asarray(y[0], dtype=np.float64)
+            y = y[1]
+        else:
+            u = self.u
+        covered, alpha = self.coverage(u, np.asarray(y, dtype=np.float64))
+        pixels = self.background.copy()
+        flat = pixels.reshape(-1, 3)
+        a = alpha[:, np.newaxis]
+        flat[covered] = flat[covered] * (1 - a) + self.color * a + 0.5
+
+        return pixels
+
+    def coverage(self, u, y):
+        """
+        Returns the flat indices of the pixels covered by the line of a frame
+        and their coverage.
+
+        Parameters
+        ----------
+
+        u : array_like
+            Pixel column of each point of the line.
+        y : array_like
+            Line being plotted.
+        """
+
+        width, height = self.size
+        v = self.offset[1] + self.scale[1] * y
+        x0, y0, x1, y1 = self.clip
+        k = self.offsets[0][-1]
+
+        # Segments with a missing end point break the line, as in Matplotlib.
+        ok = np.isfinite(u) & np.isfinite(v)
+        seg = ok[:-1] & ok[1:]
+        u0, v0 = u[:-1][seg], v[:-1][seg]
+        du, dv = np.diff(u)[seg], np.diff(v)[seg]
+
+        steps = np.maximum(np.ceil(2 * np.hypot(du, dv)), 1).astype(np.intp)
+        steps = np.minimum(steps, 4 * (width + height))
+        index = np.repeat(np.arange(len(steps)), steps)
+        t = np.arange(len(index)) - np.repeat(np.cumsum(steps) - steps, steps)
+        t = t / steps[index]
+        su = np.append(u0[index] + t * du[index], u0 + du)
+        sv = np.append(v0[index] + t * dv[index], v0 + dv)
+
+        near = (su > x0 - k) & (su < x1 + k) & (sv > y0 - k) & (sv < y1 + k)
+        su, sv = su[near], sv[near]
+
+        pu = np.floor(su).astype(np.intp)[:, np.newaxis] + self.offsets[0]
+        pv = np.floor(sv).astype(np.intp)[:, np.newaxis] + self.offsets[1]
+        distance = np.hypot(pu + 0.5 - su[:, np.newaxis], pv + 0.5 - sv[:, np.newaxis])
+        cover = np.clip(self.radius - distance, 0, 1) * self.weight
+        inside = (cover > 0) & (pu >= x0) & (pu < x1) & (pv >= y0) & (pv < y1)
+
+        # Keep the largest coverage of each pixel in a flat frame buffer,
+        # which is cleared again for the next frame.
+        if self.buffer.size != width * height:
+            self.buffer = np.zeros(width * height)
+        np.maximum.at(self.buffer, (pv * width + pu)[inside], cover[inside])
+        covered = np.flatnonzero(self.buffer)
+        alpha = self.buffer[covered]
+        self.buffer[covered] = 0
+
+        return covered, alpha
+
+
+def decimation_columns(x, y, options, plot_options):
+    """
+    Returns the index of the first point in each column of a 1D film, or
+    None if the lines aren't decimated.
+
+    The columns are a quarter of a pixel wide. The stroke of a point which
+    isn't the minimum or maximum of its column can still reach beyond those
+    of a neighbouring column, so narrower columns keep the edges of the line
+    closer to those of the whole line. Lines are decimated by DecimatedLines
+    when options['decimate'] is set and they have more than four points per
+    column, i.e. sixteen per pixel. The x values must be increasing and the
+    line drawn without markers, and the axes must have the 'auto' aspect.
+    Points left and right of the axes are gathered into a column on either
+    side.
+
+    Parameters
+    ----------
+
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Line of the first frame.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations of the line.
+    """
+
+    x = np.asarray(x)
+    if (
+        not options["decimate"]
+        or options["aspect"] != "auto"
+        or len(x) < 8
+        or not np.all(np.diff(x) >= 0)
+        or not np.all(np.isfinite(x[[0, -1]]))
+    ):
+        return None
+
+    dpi = options["dpi"]
+    if dpi is None and mpl.rcParams["savefig.dpi"] != "figure":
+        dpi = mpl.rcParams["savefig.dpi"]
+    fig = Figure(dpi=dpi)
+    ax = fig.subplots()
+    line = ax.plot(x[[0, -1]], np.asarray(y)[[0, -1]], **plot_options)[0]
+    if line.get_marker() not in [None, "", "None", "none"]:
+        return None
+    decorate_1d_plot(0, ax, frame_options(0, options, plot_options)[0])
+    ax.apply_aspect()
+
+    left, right = 4 * ax.bbox.intervalx
+    u = 4 * ax.transData.transform(np.column_stack([x, np.zeros(len(x))]))[:, 0]
+    columns = np.clip(np.floor(u), np.floor(left) - 1, np.ceil(right))
+    starts = np.flatnonzero(np.diff(columns, prepend=-np.inf))
+    if len(x) <= 4 * len(starts):
+        return None
+
+    return starts
+
+
+def decimate_lines(x, y, starts):
+    """
+    Reduce a block of lines to the first, minimum, maximum and last point of
+    each column from decimation_columns.
+
+    A line drawn through these points (M4 decimation) spans the same range
+    in every column as the whole line, so the plot looks the same while only
+    four points per column are drawn. The dropped points can still move the
+    stroke of the line by up to a column sideways, so where the line is
+    steep the top or bottom of a pixel column may come from its neighbour,
+    with or without antialiasing. The points are found for every line of
+    the block at once. Returns an array of shape (lines, 2, 4 * columns)
+    holding the x and y values of the points of each line.
+
+    Parameters
+    ----------
+
+    x : array_like
+        Increasing x values of the lines.
+    y : array_like
+        Two dimensional array of lines of the form y(t, x).
+    starts : array_like
+        Index of the first point in each pixel column, from
+        decimation_columns.
+    """
+
+    n = y.shape[1]
+    ends = np.append(starts[1:], n) - 1
+    column = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    index = np.arange(n)
+
+    points = [np.broadcast_to(starts, (len(y), len(starts)))]
+    for reduce in [np.fmin, np.fmax]:
+        extreme = reduce.reduceat(y, starts, axis=1)[:, column]
+        first = np.minimum.reduceat(np.where(y == extreme, index, n), starts, axis=1)
+        # Columns where every point is NaN keep their first point.
+        points.append(np.where(first == n, starts, first))
+    points.append(np.broadcast_to(ends, (len(y), len(starts))))
+
+    keep = np.sort(np.stack(points, axis=2), axis=2).reshape(len(y), -1)
+
+    return np.stack([x[keep], np.take_along_axis(y, keep, axis=1)], axis=1)
+
+
+class DecimatedLines(object):
+    """
+    The lines of a 1D film, decimated by decimate_lines as they are plotted.
+
+    Indexing with a time index returns the x and y values of the decimated
+    line. Lines are decimated in blocks of up to about 32 MB of the
+    following frames in source, which are kept until a frame outside the
+    block is requested.
+
+    Parameters
+    ----------
+
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Two dimensional array of the form y(t, x).
+    starts : array_like
+        Index of the first point in each pixel column, from
+        decimation_columns.
+    source : array_like
+        Time indices in the order the frames are plotted.
+    """
+
+    def __init__(self, x, y, starts, source):
+        self.x = np.asarray(x)
+        self.y = y
+        self.starts = starts
+        self.source = np.asarray(source)
+        self.block = max(1, 2**25 // max(y[0].nbytes, 1))
+        self.lines = {}
+
+    def __len__(self):
+        return len(self.y)
+
+    def __getitem__(self, i):
+        if i not in self.lines:
+            k = np.searchsorted(self.source, i)
+            rows = self.source[k : k + self.block]
+            if len(rows) == 0 or rows[0] != i:
+                rows = np.array([i])
+            block = decimate_lines(self.x, np.asarray(self.y[rows]), self.starts)
+            self.lines = dict(zip(rows.tolist(), block))
+
+        return self.lines[i]
+
+
+class DecimatedFunction(object):
+    """
+    Vectorised function of the time index which returns the lines of a
+    FrameFunction decimated by decimate_lines.
+
+    Wrapping the function of a 1D film in a FrameFunction of this class
+    means the lines are both evaluated and decimated by the workers.
+
+    Parameters
+    ----------
+
+    x : array_like
+        Array specifying the x axis.
+    func : callable
+        Function of the FrameFunction being decimated.
+    starts : array_like
+        Index of the first point in each pixel column, from
+        decimation_columns.
+    """
+
+    def __init__(self, x, func, starts):
+        self.x = np.asarray(x)
+        self.func = func
+        self.starts = starts
+
+    def __call__(self, index):
+        return decimate_lines(self.x, np.asarray(self.func(index)), self.starts)
+
+
+def film_data(data):
+    """
+    Returns the data of a film as an array, leaving a FrameFunction to be
+    evaluated as it is plotted.
+
+    Parameters
+    ----------
+
+    data : array_like or FrameFunction
+        The data being plotted, with time as the first dimension.
+    """
+
+    if isinstance(data, FrameFunction):
+        return data
+
+    return np.asanyarray(data)
+
+
+class FrameFunction(object):
+    """
+    Data of a film calculated by a function of the time index.
+
+    Passing a FrameFunction in place of the array to make_film_1d or
+    make_film_2d means the data is never held in memory as a whole: each
+    worker receives the function once and evaluates it for the frames it
+    plots, in blocks of consecutive time indices. The limits of the film are
+    calculated from options['limit_frames'] evenly spaced frames, 100 by
+    default, evaluated in the parent. Frames outside this sample may go
+    beyond its limits, so the contours of 2D films are extended to cover
+    them unless plot_options['extend'] is given. The frames of ensemble
+    films, and of 2D films whose contours are calculated by
+    options['contour_threads'], are evaluated in the parent instead.
+
+    Indexing with a time index, slice or array of time indices returns the
+    corresponding frames, like indexing an array.
+
+    Parameters
+    ----------
+
+    func : callable
+        Vectorised function which takes an array of time indices and returns
+        the frames at those times, with time as the first dimension. When the
+        workers are started with the spawn or forkserver start methods, func
+        must be picklable, e.g. a function defined at the top level of a
+        module.
+    nt : int
+        Length of the time dimension.
+    block : int, optional
+        Number of consecutive frames evaluated by each call of func in the
+        workers. Defaults to 8.
+    """
+
+    def __init__(self, func, nt, block=8):
+        self.func = func
+        self.nt = int(nt)
+        self.block = max(1, int(block))
+        first = np.asanyarray(func(np.arange(1)))
+        self.shape = (self.nt,) + first.shape[1:]
+        self.ndim = len(self.shape)
+        self.dtype = first.dtype
+        self.local = threading.local()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def __len__(self):
+        return self.nt
+
+    @property
+    def frames(self):
+        """
+        Frames of the block last evaluated by frame in this thread.
+        """
+
+        return getattr(self.local, "frames", {})
+
+    def __getitem__(self, key):
+        index = np.arange(self.nt)[key]
+        if index.size == 0:
+            return np.empty(index.shape + self.shape[1:], dtype=self.dtype)
+        frames = np.asanyarray(self.func(np.atleast_1d(index)))
+        if index.ndim == 0:
+            return frames[0]
+
+        return frames
+
+    def frame(self, i, source=None):
+        """
+        Returns the frame at time index i.
+
+        The frames of the block starting at i are evaluated together and kept
+        until a frame outside the block is requested. Each thread keeps its
+        own block, so threads plotting different frames don't evict each
+        other's.
+
+        Parameters
+        ----------
+
+        i : int
+            Time index of the frame.
+        source : array_like, optional
+            Sorted time indices of the frames being plotted, which the block
+            is taken from. Defaults to every time index.
+        """
+
+        frames = self.frames
+        if i not in frames:
+            if source is None:
+                index = np.arange(i, min(i + self.block, self.nt))
+            else:
+                k = np.searchsorted(source, i)
+                index = np.asarray(source[k : k + self.block])
+                if len(index) == 0 or index[0] != i:
+                    index = np.array([i])
+            frames = dict(zip(index.tolist(), self[index]))
+            self.local.frames = frames
+
+        return frames[i]
+
+
+class EnsembleLines(object):
+    """
+    The members and percentile bands of each frame of an ensemble film.
+
+    Indexing with a time index returns the lines of the members, of the form
+    lines(member, x), and the lower and upper line of each band, of the form
+    bands(2 * band, x), or None when there are no bands. The percentiles
+    are calculated over the member axis for blocks of up to about 32 MB of
+    the following frames in source at once, which are kept until a frame
+    outside the block is requested. When starts is given, the lines and
+    bands are also decimated by decimate_lines and have the form
+    (line, 2, 4 * columns).
+
+    Parameters
+    ----------
+
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Three dimensional array of the form y(t, member, x).
+    starts : array_like or None
+        Index of the first point in each pixel column, from
+        decimation_columns, or None if the lines aren't decimated.
+    source : array_like
+        Time indices in the order the frames are plotted.
+    bands : array_like or None
+        Lower and upper percentile of each band.
+    """
+
+    def __init__(self, x, y, starts, source, bands):
+        self.x = np.asarray(x)
+        self.y = y
+        self.starts = starts
+        self.source = np.asarray(source)
+        self.percentiles = None if bands is None else np.ravel(bands)
+        frame_bytes = int(np.prod(y.shape[1:])) * np.dtype(y.dtype).itemsize
+        self.block = max(1, 2**25 // max(frame_bytes, 1))
+        self.frames = {}
+
+    def __len__(self):
+        return len(self.y)
+
+    def __getitem__(self, i):
+        if i not in self.frames:
+            k = np.searchsorted(self.source, i)
+            rows = self.source[k : k + self.block]
+            if len(rows) == 0 or rows[0] != i:
+                rows = np.array([i])
+            lines = np.asarray(self.y[rows])
+            bands = [None] * len(rows)
+            if self.percentiles is not None:
+                bands = np.percentile(lines, self.percentiles, axis=1)
+                bands = self.decimate(np.moveaxis(bands, 0, 1))
+            self.frames = dict(zip(rows.tolist(), zip(self.decimate(lines), bands)))
+
+        return self.frames[i]
+
+    def decimate(self, lines):
+        """
+        Decimate a block of lines of the form lines(t, line, x), if the film
+        is decimated.
+
+        Parameters
+        ----------
+
+        lines : array_like
+            Three dimensional array of the lines of each frame in a block.
+        """
+
+        if self.starts is None:
+            return lines
+
+        flat = decimate_lines(self.x, lines.reshape(-1, lines.shape[-1]), self.starts)
+
+        return flat.reshape(lines.shape[:2] + flat.shape[1:])
+
+
+def set_up_ensemble(members, options, plot_options):
+    """
+    Calculate the colours of the members and bands of an ensemble film once,
+    before any frames are plotted.
+
+    options['member_colors'] is set to an array of one RGBA colour per
+    member and options['band_color'] to an RGBA colour, and plot_options is
+    converted to the keyword arguments of a LineCollection.
+
+    The members take the colours of options['member_colors'], which is a
+    colormap name or a list of colours, or otherwise plot_options['color'] or
+    the colours of the axes property cycle in turn. Their alpha is
+    options['member_alpha'], which may be one value per member, or
+    plot_options['alpha']. The bands are drawn in options['band_color'],
+    defaulting to the colour of the first member with an alpha of 0.3 per
+    band.
+
+    Parameters
+    ----------
+
+    members : int
+        Number of members of the ensemble.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations of the lines.
+    """
+
+    options = dict(options)
+    plot_options = dict(plot_options)
+
+    colors = options["member_colors"]
+    color = plot_options.pop("color", plot_options.pop("c", None))
+    if type(colors) == str:
+        colors = mpl.colormaps[colors](np.linspace(0, 1, members))
+    elif colors is None and color is not None:
+        colors = [color]
+    elif colors is None:
+        colors = mpl.rcParams["axes.prop_cycle"].by_key()["color"]
+    rgba = mpl.colors.to_rgba_array(colors)
+    rgba = rgba[np.arange(members) % len(rgba)]
+
+    alpha = options["member_alpha"]
+    if alpha is None:
+        alpha = plot_options.get("alpha")
+    plot_options.pop("alpha", None)
+    if alpha is not None:
+        rgba[:, 3] = alpha
+
+    if options["band_color"] is None:
+        options["band_color"] = mpl.colors.to_rgba(rgba[0], 0.3)
+    else:
+        options["band_color"] = mpl.colors.to_rgba(options["band_color"])
+    options["member_colors"] = rgba
+
+    for short, line, collection in [
+        ("lw", "linewidth", "linewidths"),
+        ("ls", "linestyle", "linestyles"),
+        ("aa", "antialiased", "antialiaseds"),
+    ]:
+        for key in [short, line]:
+            if key in plot_options:
+                plot_options[collection] = plot_options.pop(key)
+    plot_options["colors"] = rgba
+
+    return options, plot_options
+
+
+class ParticleDensity(object):
+    """
+    Bins the particles of a block of frames into density images.
+
+    Called with an array of time indices, it returns the number of particles
+    in each of the options['density_bins'] bins spanning options['xlim'] and
+    options['ylim'] for each frame, of the form density(t, x, y), calculated
+    for the whole block by a single bincount. Particles outside the limits
+    aren't counted. The centres of the bins are kept in x and y.
+
+    Parameters
+    ----------
+
+    points : array_like
+        Three dimensional array of the form points(t, N, 2).
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    def __init__(self, points, options):
+        self.points = points
+        self.bins = np.broadcast_to(options["density_bins"], 2).astype(int)
+        self.lower = np.array([options["xlim"][0], options["ylim"][0]], dtype=float)
+        upper = np.array([options["xlim"][1], options["ylim"][1]], dtype=float)
+        self.width = (upper - self.lower) / self.bins
+        self.x, self.y = [
+            self.lower[i] + (np.arange(self.bins[i]) + 0.5) * self.width[i]
+            for i in range(2)
+        ]
+
+    def __call__(self, it):
+        p = np.asarray(self.points[it])
+        size = int(np.prod(self.bins))
+        flat = np.zeros(p.shape[:2], dtype=np.intp)
+        inside = np.ones(p.shape[:2], dtype=bool)
+        # Coordinates outside the limits, including NaN, are cast to
+        # arbitrary bins and then moved to a spare bin which is dropped.
+        with np.errstate(invalid="ignore"):
+            for i in range(2):
+                u = (p[..., i] - self.lower[i]) / self.width[i]
+                inside &= (u >= 0) & (u <= self.bins[i])
+                flat *= self.bins[i]
+                flat += np.minimum(u.astype(np.intp), self.bins[i] - 1)
+        flat += np.arange(len(p))[:, np.newaxis] * size
+        flat[~inside] = len(p) * size
+        density = np.bincount(flat.ravel(), minlength=len(p) * size + 1)[:-1]
+
+        return density.reshape((len(p),) + tuple(self.bins))
+
+
+def find_encoder(options):
+    """
+    Determines which encoder the user has on their system.
+
+    Animated GIF, APNG and WebP films are written directly by Pillow, so no
+    external encoder is required when every film is in one of these formats.
+
+    Parameters
+    ----------
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if options.get("outputs"):
+        formats = [
+            output.get("video_fmt", options.get("video_fmt"))
+            for output in options["outputs"]
+        ]
+    else:
+        formats = [options.get("video_fmt")]
+
+    if all(video_fmt in PILLOW_FORMATS for video_fmt in formats):
+        options["encoder"] = "pillow"
+        return options
+
+    f = os.system("which ffmpeg")
+    a = os.system("which avconv")
+
+    if a > 0 and f > 0:
+        raise EnvironmentError(
+            "This system does not have FFMPEG or AVCONV installed. Films can "
+            "still be made in the following formats: " + ", ".join(PILLOW_FORMATS)
+        )
+    elif a == 0 and f == 0:
+        warnings.warn(
+            "This system has both FFMPEG and AVCONV installed. " "Defaulting to AVCONV."
+        )
+        options["encoder"] = "avconv"
     elif a == 0 and f > 0:
         options["encoder"] = "avconv"
     elif f == 0 and a > 0:
@@ -359,446 +3561,2311 @@ def find_encoder(options):
     return options
 
 
-def set_ylim(y, options):
+def set_ylim(y, options):
+    """
+    Sets the y limit for 1D films if not specified in options.
+
+    Parameters
+    ----------
+    y : array_like
+        Two dimensional array assumed to be of the form y(t, x). This specifies
+        the values to be plotted as a function of time.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    y_min, y_max = find_extrema(y, options)
+    if y_min * y_max < 0:
+        if np.abs(y_min) > np.abs(y_max):
+            options["ylim"] = [y_min, -y_min]
+        else:
+            options["ylim"] = [-y_max, y_max]
+    else:
+        options["ylim"] = [y_min, y_max]
+
+    return options
+
+
+def find_extrema(z, options):
+    """
+    Find the extremes of the data used to set axis and color limits.
+
+    By default these are the exact minimum and maximum. When
+    options['clip_percentile'] is set to p, the p and (100 - p) percentiles
+    are used instead so that isolated outliers don't compress the range of
+    every frame. The percentiles are estimated in a single pass with bounded
+    memory using a QuantileSketch of each chunk of frames, calculated in
+    parallel and merged.
+
+    Parameters
+    ----------
+    z : array_like
+        The array being plotted, with time as the first dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if options.get("clip_percentile") is None:
+        return np.min(z), np.max(z)
+
+    q = options["clip_percentile"] / 100.0
+    if not 0 <= q < 0.5:
+        raise ValueError(
+            "clip_percentile must be in the range [0, 50): "
+            "{0}".format(options["clip_percentile"])
+        )
+
+    sketch = sketch_array(z, options)
+    z_min, z_max = sketch.quantile([q, 1 - q])
+
+    return z_min, z_max
+
+
+def sketch_array(z, options):
+    """
+    Calculate a QuantileSketch of an array in parallel.
+
+    The array is split into chunks of frames along the time dimension, each
+    chunk is sketched by a separate process and the sketches are merged.
+    Each chunk's sketch is seeded by its index and the sketches are merged
+    in order, so the same array always gives the same sketch.
+
+    Parameters
+    ----------
+    z : array_like
+        The array being plotted, with time as the first dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    frame_size = max(1, int(np.prod(np.shape(z)[1:])))
+    chunk_len = max(1, 2**20 // frame_size)
+    chunks = [z[i : i + chunk_len] for i in range(0, len(z), chunk_len)]
+
+    if len(chunks) == 1:
+        return sketch_chunk((0, chunks[0]))
+
+    pool = make_pool(len(chunks), options)
+    sketches = pool.map(sketch_chunk, enumerate(chunks))
+    pool.close()
+    pool.join()
+
+    sketch = sketches[0]
+    for other in sketches[1:]:
+        sketch.merge(other)
+
+    return sketch
+
+
+def sketch_chunk(args):
+    """
+    Returns the QuantileSketch of a chunk of frames.
+
+    Parameters
+    ----------
+    i : int
+        Index of the chunk, which seeds its sketch.
+    chunk : array_like
+        Chunk of frames being sketched.
+    """
+
+    i, chunk = args
+
+    return QuantileSketch(seed=i).update(chunk)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable streaming quantile sketch.
+
+    This is a compactor based sketch in the style of KLL: values are stored in
+    a hierarchy of levels, where an item on level h represents 2**h of the
+    original values. Whenever a level holds more than k items it is sorted
+    and every other item, starting from a random offset, is promoted to the
+    level above. Memory is therefore O(k log(n / k)) and sketches of separate
+    chunks of data can be merged level by level. The exact minimum and maximum
+    are tracked so the 0 and 100 percentiles are exact.
+
+    Parameters
+    ----------
+    k : int, optional
+        Maximum number of items kept on each level. Larger values are more
+        accurate.
+    seed : int, optional
+        Seed for the random compaction offsets. Defaults to 0, so the same
+        values always give the same sketch.
+    """
+
+    def __init__(self, k=2048, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = []
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        """
+        Add an array of values to the sketch. NaNs are ignored.
+
+        Parameters
+        ----------
+        values : array_like
+            Values being added.
+        """
+
+        values = np.ravel(values)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+
+        self.n += values.size
+        self.min = min(self.min, np.min(values))
+        self.max = max(self.max, np.max(values))
+        if len(self.levels) == 0:
+            self.levels.append(values)
+        else:
+            self.levels[0] = np.concatenate((self.levels[0], values))
+        self.compress()
+
+        return self
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+
+        Parameters
+        ----------
+        other : QuantileSketch
+            Sketch being merged.
+        """
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, dtype=other.levels[0].dtype))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], items))
+
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+        return self
+
+    def compress(self):
+        """
+        Compact every level which holds more than k items.
+        """
+
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if items.size > self.k:
+                items = np.sort(items)
+                n_even = 2 * (items.size // 2)
+                offset = self.rng.integers(2)
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0, dtype=items.dtype))
+                self.levels[h + 1] = np.concatenate(
+                    (self.levels[h + 1], items[offset:n_even:2])
+                )
+                self.levels[h] = items[n_even:]
+            h += 1
+
+    def quantile(self, q):
+        """
+        Estimate the quantiles of the values added to the sketch.
+
+        Parameters
+        ----------
+        q : float or array_like
+            Quantiles to estimate, in the range [0, 1].
+        """
+
+        if self.n == 0:
+            raise ValueError("Cannot calculate the quantiles of an empty sketch.")
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(level.size, 2**h) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(items)
+        items = items[order]
+        ranks = np.cumsum(weights[order])
+
+        q = np.asarray(q, dtype=float)
+        idx = np.searchsorted(ranks, q * ranks[-1], side="left")
+        values = items[np.clip(idx, 0, items.size - 1)]
+        values = np.where(q <= 0, self.min, values)
+        values = np.where(q >= 1, self.max, values)
+
+        return values
+
+
+def calculate_contours(z, options, plot_options):
+    """
+    Calculate the contours based on the array extremes.
+
+    The extrema are taken from options['zlim'] when specified, otherwise they
+    are found using find_extrema.
+
+    There are two options for options['ncontours']:
+
+    * None: Automatically determine the extrama and set 11 contours.
+    * int: Automatically determine the extrama and set specified number of
+      contours.
+
+    Parameters
+    ----------
+
+    z : array_like
+        The 3D array being plotted: z(x, y).
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+        Here we modify the matplotlib option 'levels'.
+    """
+
+    if options.get("zlim") is not None:
+        z_min, z_max = options["zlim"]
+    else:
+        z_min, z_max = find_extrema(z, options)
+    if z_min * z_max < 0:
+        if np.abs(z_max) > np.abs(z_min):
+            plot_options["levels"] = np.around(
+                np.linspace(-z_max, z_max, options["ncontours"]), 7
+            )
+        else:
+            plot_options["levels"] = np.around(
+                np.linspace(z_min, -z_min, options["ncontours"]), 7
+            )
+    elif z_min * z_max >= 0:
+        plot_options["levels"] = np.around(
+            np.linspace(z_min, z_max, options["ncontours"]), 7
+        )
+
+    return plot_options
+
+
+def calculate_cbar_ticks(z, options):
+    """
+    Calculate the color bar ticks based on the array extremes.
+
+    The extrema are taken from options['zlim'] when specified, otherwise they
+    are found using find_extrema.
+
+    There are three options for options['cbar_ticks']:
+
+    * None: Automatically determine the extrama and set 5 ticks.
+    * int: Automatically determine the extrama and set specified number of
+      ticks.
+    * array: Set cbar_ticks to user specified values.
+
+    Parameters
+    ----------
+
+    z : array_like
+        The 3D array being plotted: z(x, y).
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if options.get("zlim") is not None:
+        z_min, z_max = options["zlim"]
+    else:
+        z_min, z_max = find_extrema(z, options)
+    if z_min * z_max < 0:
+        if options["cbar_ticks"] == None:
+            if np.abs(z_max) > np.abs(z_min):
+                options["cbar_ticks"] = np.around(np.linspace(-z_max, z_max, 5), 7)
+            else:
+                options["cbar_ticks"] = np.around(np.linspace(z_min, -z_min, 5), 7)
+        else:
+            if np.abs(z_max) > np.abs(z_min):
+                options["cbar_ticks"] = np.around(
+                    np.linspace(-z_max, z_max, options["cbar_ticks"]), 7
+                )
+            else:
+                options["cbar_ticks"] = np.around(
+                    np.linspace(z_min, -z_min, options["cbar_ticks"]), 7
+                )
+    elif z_min * z_max >= 0:
+        if options["cbar_ticks"] == None:
+            options["cbar_ticks"] = np.around(np.linspace(z_min, z_max, 5), 7)
+        else:
+            options["cbar_ticks"] = np.around(
+                np.linspace(z_min, z_max, options["cbar_ticks"]), 7
+            )
+
+    return options
+
+
+def frame_extrema(z, options):
+    """
+    Find the extremes of every frame in one vectorised reduction over the
+    spatial dimensions.
+
+    When options['dynamic_limits'] is an integer greater than one, the
+    extremes are taken over a rolling window of that many frames centred on
+    each frame, which avoids the limits flickering from frame to frame. When
+    options['clip_percentile'] is set, the percentiles of each frame are used
+    instead of its extremes.
+
+    Parameters
+    ----------
+    z : array_like
+        The array being plotted, with time as the first dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    axes = tuple(range(1, np.ndim(z)))
+    if options.get("clip_percentile") is None:
+        z_min = np.min(z, axis=axes)
+        z_max = np.max(z, axis=axes)
+    else:
+        q = options["clip_percentile"]
+        z_min, z_max = np.nanpercentile(z, [q, 100 - q], axis=axes)
+
+    window = options["dynamic_limits"]
+    if window is not True and window > 1:
+        z_min = rolling_extreme(z_min, window, np.minimum)
+        z_max = rolling_extreme(z_max, window, np.maximum)
+
+    return z_min, z_max
+
+
+def rolling_extreme(values, window, reduce):
+    """
+    Returns the extreme of the window of values centred on each value.
+
+    The values are padded with the first and last value and split into
+    blocks of window values. Each window spans the end of one block and the
+    start of the next, so its extreme is the extreme of a backward and a
+    forward cumulative reduction of the blocks (van Herk/Gil-Werman), which
+    takes a fixed time per value whatever the window.
+
+    Parameters
+    ----------
+    values : array_like
+        One dimensional array of values.
+    window : int
+        Number of values in each window.
+    reduce : numpy.ufunc
+        np.minimum or np.maximum.
+    """
+
+    values = np.asarray(values)
+    n = len(values)
+    padded = np.pad(values, (window // 2, (window - 1) // 2), mode="edge")
+    # The end of the last block is filled with a value which never wins.
+    fill = np.max(values) if reduce is np.minimum else np.min(values)
+    blocks = np.full(-(-len(padded) // window) * window, fill, dtype=padded.dtype)
+    blocks[: len(padded)] = padded
+    blocks = blocks.reshape(-1, window)
+
+    forward = reduce.accumulate(blocks, axis=1).ravel()
+    backward = reduce.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    return reduce(backward[:n], forward[window - 1 : window - 1 + n])
+
+
+def symmetric_limits(z_min, z_max):
+    """
+    Vectorised version of the limit calculation used by set_ylim and
+    calculate_contours.
+
+    Limits of data which changes sign are made symmetric about zero. Frames
+    where the data is constant are given a range of one so that contour
+    levels remain increasing.
+
+    Parameters
+    ----------
+    z_min : array_like
+        Minimum of each frame.
+    z_max : array_like
+        Maximum of each frame.
+    """
+
+    z_abs = np.maximum(np.abs(z_min), np.abs(z_max))
+    sign_change = z_min * z_max < 0
+    lower = np.where(sign_change, -z_abs, z_min)
+    upper = np.where(sign_change, z_abs, z_max)
+
+    constant = lower == upper
+    lower = np.where(constant, lower - 0.5, lower)
+    upper = np.where(constant, upper + 0.5, upper)
+
+    return lower, upper
+
+
+def set_frame_ylim(y, options):
+    """
+    Sets a y limit for every frame of a 1D film.
+
+    The limits of all frames are calculated up front and stored in
+    options['ylim'] as an array of shape (nt, 2).
+
+    Parameters
+    ----------
+    y : array_like
+        Two dimensional array assumed to be of the form y(t, x). This specifies
+        the values to be plotted as a function of time.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    lower, upper = symmetric_limits(*frame_extrema(y, options))
+    options["ylim"] = np.stack((lower, upper), axis=1)
+
+    return options
+
+
+def calculate_frame_contours(z, options, plot_options):
+    """
+    Calculate the contours and color bar ticks of every frame of a 2D film.
+
+    The contour levels are stored in plot_options['levels'] as an array of
+    shape (nt, ncontours). Unless options['cbar_ticks'] is an array, the color
+    bar ticks are stored in options['cbar_ticks'] as an array of shape
+    (nt, nticks), with the number of ticks determined in the same way as
+    calculate_cbar_ticks.
+
+    Parameters
+    ----------
+    z : array_like
+        The 3D array being plotted: z(x, y).
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+        Here we modify the matplotlib option 'levels'.
+    """
+
+    lower, upper = symmetric_limits(*frame_extrema(z, options))
+
+    plot_options["levels"] = np.around(
+        np.linspace(lower, upper, options["ncontours"], axis=1), 7
+    )
+
+    if type(options["cbar_ticks"]) != np.ndarray:
+        nticks = 5 if options["cbar_ticks"] is None else options["cbar_ticks"]
+        options["cbar_ticks"] = np.around(np.linspace(lower, upper, nticks, axis=1), 7)
+
+    return plot_options
+
+
+def frame_options(it, options, plot_options):
+    """
+    Select the per-frame limits, levels and ticks for a given time step.
+
+    Films with dynamic limits store these as arrays with one row per frame.
+    Copies of options and plot_options are returned holding the rows for
+    frame it, so the arrays are never rescanned by the plotting functions.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    if np.ndim(options.get("ylim")) == 2 or np.ndim(options.get("cbar_ticks")) == 2:
+        options = dict(options)
+        for key in ["ylim", "cbar_ticks"]:
+            if np.ndim(options.get(key)) == 2:
+                options[key] = options[key][it]
+
+    if np.ndim(plot_options.get("levels")) == 2:
+        plot_options = dict(plot_options)
+        plot_options["levels"] = plot_options["levels"][it]
+
+    return options, plot_options
+
+
+def find_unique_frames(z, options, plot_options):
+    """
+    Find the frames which differ from the frame before them.
+
+    Consecutive time slices are compared in a vectorised pass over chunks of
+    the time dimension. A slice is a duplicate when its maximum absolute
+    difference from the previous slice is at most options['dedup_tol'] and
+    its title, limits, contours and color bar ticks are unchanged. For a
+    non-zero tolerance, duplicates are also checked against the last frame
+    kept before them, in a single pass, so that slow drifts are not lost.
+
+    Returns the time indices of the unique frames.
+
+    Parameters
+    ----------
+    z : array_like
+        The array being plotted, with time as the first dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    nt = z.shape[0]
+    tol = options["dedup_tol"]
+    axes = tuple(range(1, z.ndim))
+    chunk_len = max(1, 2**20 // max(1, int(np.prod(z.shape[1:]))))
+
+    new = np.ones(nt, dtype=bool)
+    for i in range(0, nt - 1, chunk_len):
+        after = z[i + 1 : i + 1 + chunk_len]
+        diff = np.max(np.abs(after - z[i : i + len(after)]), axis=axes)
+        new[i + 1 : i + 1 + len(after)] = ~(diff <= tol)
+
+    if type(options["title"]) == list:
+        titles = np.array(options["title"][:nt], dtype=object)
+        new[1:] |= titles[1:] != titles[:-1]
+    for frame_values in [
+        options.get("ylim"),
+        options.get("cbar_ticks"),
+        plot_options.get("levels"),
+    ]:
+        if np.ndim(frame_values) == 2:
+            new[1:] |= np.any(frame_values[1:] != frame_values[:-1], axis=1)
+
+    # Duplicates are compared with the last kept frame, in chunks of the run
+    # of duplicates after it, and the first which drifted too far is kept.
+    kept = 0
+    i = 1
+    while tol > 0 and i < nt:
+        if new[i]:
+            kept = i
+            i += 1
+            continue
+        end = min(i + chunk_len, nt)
+        end = i + np.argmin(np.append(~new[i:end], False))
+        diff = np.max(np.abs(z[i:end] - z[kept]), axis=axes)
+        drift = np.flatnonzero(~(diff <= tol))
+        if drift.size == 0:
+            i = end
+        else:
+            kept = i + drift[0]
+            new[kept] = True
+            i = kept + 1
+
+    return np.flatnonzero(new)
+
+
+def drop_duplicate_frames(z, options, plot_options):
+    """
+    Remove duplicate frames so that each unique frame is only plotted once.
+
+    Returns the time indices of the unique frames, rather than a copy of
+    them, along with options and plot_options in which the per-frame titles,
+    limits, contours and color bar ticks are reduced to the unique frames.
+    options['frame_counts'] is set to the number of time steps each unique
+    frame is shown for, which the encoder uses as the frame durations.
+
+    Parameters
+    ----------
+    z : array_like
+        The array being plotted, with time as the first dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    nt = z.shape[0]
+    if lazy_title(options["title"]):
+        options = dict(options)
+        options["title"] = [frame_title(it, options) for it in range(nt)]
+    keep = find_unique_frames(z, options, plot_options)
+
+    if options["frame_counts"] is None:
+        counts = np.ones(nt, dtype=int)
+    else:
+        counts = np.asarray(options["frame_counts"][:nt])
+
+    options = dict(options)
+    plot_options = dict(plot_options)
+
+    options["frame_counts"] = np.add.reduceat(counts, keep)
+    if type(options["title"]) == list:
+        options["title"] = [options["title"][i] for i in keep]
+    for opts in [options, plot_options]:
+        for key in ["ylim", "cbar_ticks", "levels"]:
+            if np.ndim(opts.get(key)) == 2:
+                opts[key] = opts[key][keep]
+
+    return keep, options, plot_options
+
+
+def preview_sample(z, options):
+    """
+    Returns the frames used to calculate the limits of the film.
+
+    This is every sample_stride-th frame, which for a film made without
+    a preview or options['limit_frames'] is the whole array.
+
+    Parameters
+    ----------
+    z : array_like
+        The array being plotted, with time as the first dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    stride = sample_stride(len(z), options)
+    if stride == 1 and not isinstance(z, FrameFunction):
+        return z
+
+    return z[::stride]
+
+
+def sample_stride(nt, options):
+    """
+    Returns the stride of the frames the limits of the film are calculated
+    from.
+
+    For a preview this is options['preview'], otherwise it is the smallest
+    stride which samples at most options['limit_frames'] frames.
+
+    Parameters
+    ----------
+    nt : int
+        Length of the time dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if options["preview"] is not None:
+        return options["preview"]
+    if options.get("limit_frames") is None:
+        return 1
+
+    return max(1, int(math.ceil(nt / options["limit_frames"])))
+
+
+def expand_frame_values(nt, options, plot_options):
+    """
+    Expand per-frame limits calculated from a sample of frames to every frame.
+
+    Each frame uses the limits of the last sampled frame before it.
+
+    Parameters
+    ----------
+    nt : int
+        Length of the time dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    for opts in [options, plot_options]:
+        for key in ["ylim", "cbar_ticks", "levels"]:
+            values = opts.get(key)
+            if np.ndim(values) == 2 and len(values) != nt:
+                opts[key] = values[np.arange(nt) // sample_stride(nt, options)]
+
+    return options, plot_options
+
+
+def set_up_preview(nt, options):
+    """
+    Set up a low cost preview of the film.
+
+    Every options['preview']-th frame is plotted at options['preview_dpi']
+    with the file name prefixed by 'preview_'. Each frame is shown until the
+    next sampled frame so that the preview plays at the speed of the film.
+
+    The time indices of the frames already plotted are kept in
+    options['preview_done']. When the options returned from a preview are
+    passed back in with a smaller stride, only the missing frames are plotted,
+    progressively refining the preview.
+
+    Returns the time indices to be plotted and the options used to plot them.
+
+    Parameters
+    ----------
+    nt : int
+        Length of the time dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    sample = np.arange(0, nt, options["preview"])
+    if options["preview_done"] is None:
+        done = np.array([], dtype=int)
+    else:
+        done = np.asarray(options["preview_done"], dtype=int)
+    frames = np.setdiff1d(sample, done)
+    options["preview_done"] = np.union1d(sample, done)
+
+    options = dict(options)
+    options["dpi"] = options["preview_dpi"]
+    options["file_name"] = "preview_" + str(options["file_name"])
+    options["frame_list"] = options["preview_done"]
+    options["segment_frames"] = None
+    options["frame_counts"] = np.diff(np.append(options["frame_list"], nt))
+
+    if len(done) == 0:
+        set_up_dirs(options)
+
+    return frames, options
+
+
+def plot_1d(args):
+    """
+    Plot the 1D graph for a given time step.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Two dimensional array assumed to be of the form y(t, x). This specifies
+        the values to be plotted as a function of time.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot,
+        e.g. when plot is called it will be called as
+        plt.plot(x, y, **plot_options)
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    it, x, y, plot_options, options = args
+    options, plot_options = frame_options(it, options, plot_options)
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(x, y, **plot_options)
+    decorate_1d_plot(it, ax, options)
+
+    fig.savefig(
+        temp_frame_path(it, options),
+        format=options["img_fmt"],
+        dpi=options["dpi"],
+        bbox_inches=options["bbox_inches"],
+    )
+    os.replace(temp_frame_path(it, options), frame_path(it, options))
+
+
+def decorate_1d_plot(it, ax, options):
+    """
+    Add the title, labels, limits and grid to a 1D plot.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    ax : matplotlib.axes.Axes
+        Axes containing the line.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    ax.set_title(frame_title(it, options))
+    ax.set_xlabel(options["xlabel"])
+    ax.set_ylabel(options["ylabel"])
+
+    ax.set_xlim(options["xlim"])
+    ax.set_ylim(options["ylim"])
+    if options["xticks"] is not None:
+        ax.set_xticks(options["xticks"])
+    if options["yticks"] is not None:
+        ax.set_yticks(options["yticks"])
+
+    ax.grid(options["grid"])
+
+    ax.set_aspect(options["aspect"])
+
+
+def plot_ensemble(args):
+    """
+    Plot the members and bands of an ensemble for a given time step.
+
+    The members are drawn as a single LineCollection over the bands, which
+    are drawn as a single PolyCollection.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    x : array_like
+        Array specifying the x axis.
+    lines : tuple
+        The lines of the members and bands of the frame, from EnsembleLines.
+    plot_options : dict
+        Keyword arguments of the LineCollection, from set_up_ensemble.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    it, x, (lines, bands), plot_options, options = args
+    options, plot_options = frame_options(it, options, plot_options)
+
+    fig = Figure()
+    ax = fig.subplots()
+    if bands is not None:
+        edges = line_segments(x, bands)
+        polygons = np.concatenate([edges[0::2], edges[1::2, ::-1]], axis=1)
+        ax.add_collection(
+            mcollections.PolyCollection(
+                polygons, facecolors=options["band_color"], edgecolors="none"
+            )
+        )
+    ax.add_collection(
+        mcollections.LineCollection(line_segments(x, lines), **plot_options)
+    )
+    ax.autoscale_view()
+    decorate_1d_plot(it, ax, options)
+
+    fig.savefig(
+        temp_frame_path(it, options),
+        format=options["img_fmt"],
+        dpi=options["dpi"],
+        bbox_inches=options["bbox_inches"],
+    )
+    os.replace(temp_frame_path(it, options), frame_path(it, options))
+
+
+def line_segments(x, lines):
+    """
+    Returns the points of each line as an array of the form
+    (line, point, 2), as used by LineCollection.
+
+    Parameters
+    ----------
+
+    x : array_like
+        Array specifying the x axis.
+    lines : array_like
+        Lines of the form lines(line, x), or decimated lines of the form
+        (line, 2, 4 * columns) holding their own x values.
+    """
+
+    if lines.ndim == 3:
+        return np.swapaxes(lines, 1, 2)
+
+    return np.stack(np.broadcast_arrays(x, lines), axis=-1)
+
+
+def plot_particles(args):
+    """
+    Plot the particles of a given time step as markers.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    points : array_like
+        Two dimensional array of the form points(N, 2) of the particles.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot,
+        e.g. when scatter is called it will be called as
+        ax.scatter(x, y, **plot_options)
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    it, points, plot_options, options = args
+    options, plot_options = frame_options(it, options, plot_options)
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.scatter(points[:, 0], points[:, 1], **plot_options)
+    decorate_1d_plot(it, ax, options)
+
+    fig.savefig(
+        temp_frame_path(it, options),
+        format=options["img_fmt"],
+        dpi=options["dpi"],
+        bbox_inches=options["bbox_inches"],
+    )
+    os.replace(temp_frame_path(it, options), frame_path(it, options))
+
+
+def plot_2d(args):
+    """
+    Plot the 2D contour plot for a given time step.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    x : array_like
+        Array specifying the x axis.
+    y : array_like
+        Array specifying the y axis.
+    z : array_like
+        Three dimensional array assumed to be of the form z(t, x, y). This
+        specifies the values to be plotted as a function of time.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot,
+        e.g. when plot is called it will be called as
+        plt.plot(x, y, **plot_options)
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    it, x, y, z, plot_options, options = args
+    options, plot_options = frame_options(it, options, plot_options)
+
+    fig = Figure()
+    ax = fig.subplots()
+    im = filled_contours(ax, x, y, z, plot_options)
+
+    finish_2d_plot(it, fig, ax, im, options)
+
+
+def plot_tri(args):
+    """
+    Plot the 2D contour plot of irregular grid data for a given time step.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    triangulation : matplotlib.tri.Triangulation
+        Triangulation of the grid, shared with every frame by init_worker.
+    z : array_like
+        Two dimensional array assumed to be of the form z(t, N). This
+        specifies the values to be plotted as a function of time.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot,
+        e.g. when plot is called it will be called as
+        plt.plot(x, y, **plot_options)
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    it, triangulation, z, plot_options, options = args
+    options, plot_options = frame_options(it, options, plot_options)
+
+    fig = Figure()
+    ax = fig.subplots()
+    im = ax.tricontourf(triangulation, z, **plot_options)
+
+    finish_2d_plot(it, fig, ax, im, options)
+
+
+def finish_2d_plot(it, fig, ax, im, options):
+    """
+    Add labels, limits and the color bar to a 2D plot and save the frame.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    fig : matplotlib.figure.Figure
+        Figure containing the plot.
+    ax : matplotlib.axes.Axes
+        Axes containing the contour plot.
+    im : matplotlib.contour.ContourSet
+        Filled contours which the color bar describes.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    decorate_2d_plot(it, fig, ax, im, options)
+
+    fig.savefig(
+        temp_frame_path(it, options),
+        format=options["img_fmt"],
+        dpi=options["dpi"],
+        bbox_inches=options["bbox_inches"],
+    )
+    os.replace(temp_frame_path(it, options), frame_path(it, options))
+
+
+def decorate_2d_plot(it, fig, ax, im, options):
+    """
+    Add the title, labels, limits and the color bar to a 2D plot.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    fig : matplotlib.figure.Figure
+        Figure containing the plot.
+    ax : matplotlib.axes.Axes
+        Axes containing the contour plot.
+    im : matplotlib.contour.ContourSet
+        Filled contours which the color bar describes.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    ax.set_title(frame_title(it, options))
+    ax.set_xlabel(options["xlabel"])
+    ax.set_ylabel(options["ylabel"])
+
+    ax.set_xlim(options["xlim"])
+    ax.set_ylim(options["ylim"])
+    if options["xticks"] is not None:
+        ax.set_xticks(options["xticks"])
+    if options["yticks"] is not None:
+        ax.set_yticks(options["yticks"])
+
+    ax.grid(options["grid"])
+
+    ax.set_aspect(options["aspect"])
+
+    divider = make_axes_locatable(ax)
+    cax = divider.append_axes("right", size="5%", pad=0.05)
+
+    fig.colorbar(
+        im,
+        cax=cax,
+        label=options["cbar_label"],
+        ticks=options["cbar_ticks"],
+        format=options["cbar_tick_format"],
+    )
+
+
+def crop_images(nt, options):
+    """
+    Ensures that PNG files have height and width that are even.
+
+    This owes to a quirk of avconv and libx264 that requires this. At the
+    moment there is no easy way to specifically set the pixel count using
+    Matplotlib and this is not desirable anyway since plots can be almost
+    any size and aspect ratio depending on the data. The other solution
+    found online is to use the `-vf` flag for avconv to control the output
+    size but this does not seem to work. The most reliable solution
+    therefore is to use Pillow to load and crop images.
+
+    Only the options needed to find the frames, FRAME_PATH_OPTIONS, are sent
+    to the workers, once through init_worker, and each task is just the time
+    index of a frame.
+
+    Parameters
+    ----------
+
+    nt : int
+        Length of the time dimension. Ignored when options['frame_list'] or
+        options['frame_range'] is set, in which case only the frames of the
+        listed time indices or the range are cropped.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if options.get("frame_list") is not None:
+        frames = options["frame_list"]
+    elif options.get("frame_range") is not None:
+        frames = range(*options["frame_range"])
+    else:
+        frames = range(nt)
+    nt = len(frames)
+
+    shared = {"options": {key: options.get(key) for key in FRAME_PATH_OPTIONS}}
+    frame_dims = np.array(map_frame_files(frames, get_image_size, shared, options))
+
+    w_min = np.min(frame_dims[:, 0])
+    h_min = np.min(frame_dims[:, 1])
+    shared["new_w"] = int(w_min / 2) * 2
+    shared["new_h"] = int(h_min / 2) * 2
+
+    map_frame_files(frames, crop_image, shared, options)
+
+
+def map_frame_files(frames, func, shared, options):
+    """
+    Run func over the files of the given frames in a pool of workers.
+
+    shared is stored in each worker by init_worker and func is called with
+    (key, it) for each frame, where worker_data[key] holds shared.
+
+    Parameters
+    ----------
+
+    frames : array_like
+        Time index of each frame.
+    func : callable
+        Function called for each frame.
+    shared : dict
+        Dictionary of data which is identical for every frame, holding the
+        options needed to find the frames.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    key = next(film_ids)
+    pool = make_pool(
+        len(frames), options, initializer=init_worker, initargs=(key, shared)
+    )
+    try:
+        results = map_frames(
+            pool,
+            func,
+            [(key, it) for it in frames],
+            options,
+            initializer=init_worker,
+            initargs=(key, shared),
+        )
+    finally:
+        worker_data.pop(key, None)
+    pool.close()
+    pool.join()
+
+    return results
+
+
+def get_image_size(args):
+    """
+    Returns the size of an image as a tuple of (width, height) in pixels.
+
+    Parameters
+    ----------
+
+    key : int
+        Id of the film, whose options are stored by init_worker.
+    it : int
+        Time step of frame being analyzed.
+    """
+
+    key, it = args
+
+    with Image.open(frame_path(it, worker_data[key]["options"])) as im:
+        return (im.size[0], im.size[1])
+
+
+def crop_image(args):
+    """
+    Crop single image at a given time step.
+
+    Parameters
+    ----------
+
+    key : int
+        Id of the film, whose options and the new width and height the
+        images are cropped to, new_w and new_h, are stored by init_worker.
+    it : int
+        Time step of frame being analyzed.
+    """
+
+    key, it = args
+    data = worker_data[key]
+    options = data["options"]
+    new_w = data["new_w"]
+    new_h = data["new_h"]
+
+    im = Image.open(frame_path(it, options))
+    if im.size == (new_w, new_h):
+        return
+    im_crop = im.crop((0, 0, new_w, new_h))
+    im_crop.save(temp_frame_path(it, options), format=im.format)
+    os.replace(temp_frame_path(it, options), frame_path(it, options))
+
+
+def frame_path(it, options):
+    """
+    Returns the path of the frame at a given time step.
+
+    Parameters
+    ----------
+
+    it : int
+        Time step of the frame.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    name = "{0}_{1:0{2}d}.{3}".format(
+        options["file_name"], it, options.get("frame_digits") or 5, options["img_fmt"]
+    )
+    if options.get("frame_shard"):
+        shard = "{0}_{1:05d}".format(options["file_name"], it // options["frame_shard"])
+        return options["frame_dir"] + "/" + shard + "/" + name
+
+    return options["frame_dir"] + "/" + name
+
+
+def make_frame_dirs(frames, options):
+    """
+    Create the subdirectories frames are written to when options['frame_shard']
+    is set.
+
+    Each subdirectory holds options['frame_shard'] consecutive frames, which
+    keeps the directories of very long films small.
+
+    Parameters
+    ----------
+
+    frames : array_like
+        Index of each frame being written.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if not options.get("frame_shard"):
+        return
+
+    for shard in np.unique(np.asarray(frames) // options["frame_shard"]):
+        path = frame_path(int(shard) * options["frame_shard"], options)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+def temp_frame_path(it, options):
+    """
+    Returns the path a frame is written to before being moved to frame_path.
+
+    Frames are moved into place once complete, so a frame is never left
+    partly written and attempts of the same frame by different workers don't
+    write to the same file.
+
+    Parameters
+    ----------
+
+    it : int
+        Time step of the frame.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    return frame_path(it, options) + ".{0}-{1}.tmp".format(
+        os.getpid(), threading.get_ident()
+    )
+
+
+def frame_files(options):
+    """
+    Returns the paths of the frames making up the film.
+
+    These are the frames of the time indices in options['frame_list'] when it
+    is set, otherwise all consecutive frames written for the film.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if options.get("frame_list") is not None:
+        return [frame_path(it, options) for it in options["frame_list"]]
+
+    files = []
+    while os.path.exists(frame_path(len(files), options)):
+        files.append(frame_path(len(files), options))
+
+    return files
+
+
+def frame_title(it, options):
+    """
+    Returns the plot title of a given time step.
+
+    Titles which depend on the time step are generated here, in the worker,
+    from a callable or a format string (see lazy_title), rather than being
+    stored for every frame.
+
+    Parameters
+    ----------
+
+    it : int
+        Time index being plotted.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    title = options["title"]
+    if lazy_title(title):
+        t = it if options.get("times") is None else options["times"][it]
+        if callable(title):
+            return title(it, t)
+        return title.format(it=it, t=t)
+    elif type(title) == str:
+        return title
+
+    return title[it]
+
+
+def lazy_title(title):
+    """
+    Returns whether a title is generated from the time step.
+
+    This is the case for a callable, which is called with the time index and
+    time value, and for a format string whose only fields are {it}, the time
+    index, and {t}, the time value, e.g. 't = {t:.2f}'. Any other string is
+    used as it is.
+
+    Parameters
+    ----------
+
+    title : str or list or callable
+        Title given in options['title'].
+    """
+
+    if callable(title):
+        return True
+    if type(title) != str:
+        return False
+
+    try:
+        fields = [
+            field
+            for _, field, _, _ in string.Formatter().parse(title)
+            if field is not None
+        ]
+    except ValueError:
+        return False
+
+    return len(fields) > 0 and all(field in ["it", "t"] for field in fields)
+
+
+def make_plot_titles(nt, options):
+    """
+    Checks the plot titles passed to the plotting function.
+
+    This function allows dynamic plot titles such as the frame number or time.
+    Fixed strings, format strings and callables are used as they are, so
+    no title is stored per frame. A list of titles must cover the time
+    dimension.
+
+    Parameters
+    ----------
+
+    nt : int
+        Length of the time dimension.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if type(options["title"]) == list:
+        if len(options["title"]) > nt:
+            warnings.warn(
+                "Dimension of time and length of plot titles "
+                "different: {0}, {1}".format(nt, len(options["title"]))
+            )
+        elif len(options["title"]) < nt:
+            raise ValueError(
+                "Dimension of time greater than length of plot "
+                "titles: {0}, {1}".format(nt, len(options["title"]))
+            )
+
+    return options
+
+
+def encode_images(options):
     """
-    Sets the y limit for 1D films if not specified in options.
+    Encode PNG images into a film.
+
+    When options['frame_counts'] is set, frame i is shown for
+    options['frame_counts'][i] time steps, which produces a variable frame
+    rate film from a concat list written by write_concat_list.
 
     Parameters
     ----------
-    y : array_like
-        Two dimensional array assumed to be of the form y(t, x). This specifies
-        the values to be plotted as a function of time.
+
     options : dict
         Dictionary of options which control various program functions.
     """
 
-    y_min = np.min(y)
-    y_max = np.max(y)
-    if y_min * y_max < 0:
-        if np.abs(y_min) > np.abs(y_max):
-            options["ylim"] = [y_min, -y_min]
-        else:
-            options["ylim"] = [-y_max, y_max]
+    if options["encoder"] == "pillow":
+        encode_images_pillow(options)
+    elif options.get("segment_frames") is not None:
+        encode_segments(options)
+    elif options["encoder"] in ["avconv", "ffmpeg"]:
+        command = encoder_command(options)
+        with start_encoder(command, options) as encoder:
+            encoder.wait()
+        print("Encode command: " + command)
+
+
+def encoder_command(options, frames=None):
+    """
+    Returns the avconv/ffmpeg command which encodes the frames into a film.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    frames : range, optional
+        Frames of a single segment, which are encoded into the segment files
+        rather than the film (see encode_segments).
+    """
+
+    outputs = film_outputs(options)
+    paths = [output_path(output, options) for output in outputs]
+
+    if frames is not None:
+        segment = frames[0] // options["segment_frames"]
+        paths = [segment_path(output, segment, options) for output in outputs]
+        concat_list = write_concat_list(options, frames)
+        frames = (
+            "-f concat -safe 0 -i '"
+            + concat_list
+            + "' -vsync vfr -frames:v "
+            + str(len(frames))
+        )
+    elif (
+        options.get("frame_counts") is not None
+        or options.get("frame_list") is not None
+        or options.get("frame_shard")
+    ):
+        concat_list = write_concat_list(options)
+        frames = "-f concat -safe 0 -i '" + concat_list + "' -vsync vfr"
     else:
-        options["ylim"] = [y_min, y_max]
+        frames = (
+            "-r "
+            + str(options["fps"])
+            + " -i "
+            + "'"
+            + options["frame_dir"]
+            + "/"
+            + str(options["file_name"])
+            + "_%0{0}d.".format(options.get("frame_digits") or 5)
+            + options["img_fmt"]
+            + "'"
+        )
+        if options["encoder"] == "avconv":
+            frames = "-f image2 " + frames
+
+    outputs = [
+        " ".join(shlex.quote(arg) for arg in output_args(output, options) + [path])
+        for output, path in zip(outputs, paths)
+    ]
+
+    return (
+        options["encoder"]
+        + " -threads "
+        + str(options.get("encoder_cpus") or options["nprocs"])
+        + " -y "
+        + frames
+        + " "
+        + " ".join(outputs)
+    )
 
-    return options
 
+def film_outputs(options):
+    """
+    Returns the films which are encoded from the frames.
 
-def calculate_contours(z, options, plot_options):
+    options['outputs'] is a list of dictionaries, one per film, with the keys
+    'file_name', 'video_fmt', 'codec', 'scale', 'bitrate' and 'args'. Missing
+    keys are taken from options or left unset. When options['outputs'] is not
+    specified a single film is made from options['file_name'] and
+    options['video_fmt'].
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
     """
-    Calculate the contours based on the array extremes.
 
-    There are two options for options['ncontours']:
+    outputs = []
+    for spec in options.get("outputs") or [{}]:
+        output = {
+            "file_name": options["file_name"],
+            "video_fmt": options["video_fmt"],
+            "codec": None,
+            "scale": None,
+            "bitrate": None,
+            "args": [],
+        }
+        output.update(spec)
+        outputs.append(output)
 
-    * None: Automatically determine the extrama and set 11 contours.
-    * int: Automatically determine the extrama and set specified number of
-      contours.
+    paths = [output_path(output, options) for output in outputs]
+    if len(set(paths)) < len(paths):
+        raise ValueError("Every output must be written to a different file.")
+
+    return outputs
+
+
+def output_path(output, options):
+    """
+    Returns the path of a film returned by film_outputs.
+
+    Parameters
+    ----------
+
+    output : dict
+        Film returned by film_outputs.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    return (
+        options["film_dir"] + "/" + str(output["file_name"]) + "." + output["video_fmt"]
+    )
+
+
+def output_args(output, options, filters=()):
+    """
+    Returns the avconv/ffmpeg arguments which encode one film.
+
+    When output['codec'] is not specified, avconv uses its default codec for
+    the container and ffmpeg uses H.264, or the codec in FFMPEG_CODECS for
+    containers which can't hold H.264. output['scale'] is either a factor
+    applied to the width and height of the frames or a (width, height) pair,
+    where -2 keeps the aspect ratio.
+
+    Parameters
+    ----------
+
+    output : dict
+        Film returned by film_outputs.
+    options : dict
+        Dictionary of options which control various program functions.
+    filters : list, optional
+        Video filters applied before the frames are scaled.
+    """
+
+    if output["codec"] is not None:
+        args = ["-c:v", output["codec"]]
+        if output["video_fmt"] not in PILLOW_FORMATS:
+            args = ["-pix_fmt", "yuv420p"] + args
+    elif options["encoder"] == "avconv":
+        args = ["-q", "1"]
+    else:
+        args = FFMPEG_CODECS.get(
+            output["video_fmt"], ["-pix_fmt", "yuv420p", "-c:v", "libx264", "-q", "1"]
+        )
+
+    filters = list(filters)
+    scale = output["scale"]
+    if np.ndim(scale) == 1:
+        filters.append("scale={0}:{1}".format(*scale))
+    elif scale is not None:
+        filters.append("scale=trunc(iw*{0}/2)*2:trunc(ih*{0}/2)*2".format(float(scale)))
+    if len(filters) > 0:
+        args = ["-vf", ",".join(filters)] + args
+
+    if output["bitrate"] is not None:
+        args = args + ["-b:v", str(output["bitrate"])]
+    if isinstance(output["args"], str):
+        args = args + output["args"].split()
+    else:
+        args = args + list(output["args"])
+
+    return args
+
+
+def frame_durations(nframes, options):
+    """
+    Returns the duration of each frame in seconds.
+
+    Parameters
+    ----------
+
+    nframes : int
+        Number of frames in the film.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    if options.get("frame_counts") is None:
+        counts = np.ones(nframes)
+    else:
+        counts = np.asarray(options["frame_counts"][:nframes], dtype=float)
+
+    return counts / options["fps"]
+
+
+def write_concat_list(options, frames=None):
+    """
+    Write the concat list giving the file and duration of every frame.
+
+    The list is read by the concat demuxer of avconv/ffmpeg and written to
+    the frame directory. The last frame is repeated, as required by the
+    demuxer for its duration to be used.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    frames : range, optional
+        Frames of a single segment. Defaults to every frame of the film.
+    """
+
+    if frames is None:
+        files = frame_files(options)
+        durations = frame_durations(len(files), options)
+        name = str(options["file_name"])
+    else:
+        files = [frame_path(it, options) for it in frames]
+        durations = frame_durations(frames[-1] + 1, options)[frames[0] :]
+        name = "{0}_{1:05d}".format(options["file_name"], frames[0])
+    concat_list = options["frame_dir"] + "/" + name + ".txt"
+
+    # Opening every frame of a segment at the film's frame rate keeps the time
+    # stamps exact, rather than rounded to the 25 fps assumed for single
+    # images, so the segments join seamlessly. The option directive needs
+    # ffmpeg 5 or later.
+    version = encoder_version(options.get("encoder"))
+    if frames is not None and options.get("encoder") == "ffmpeg" and version >= 5:
+        option = "option framerate {0}\n".format(options["fps"])
+    else:
+        option = ""
+
+    with open(concat_list, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        for frame, duration in zip(files, durations):
+            f.write(
+                "file '{0}'\n{1}duration {2:.6f}\n".format(
+                    os.path.abspath(frame), option, duration
+                )
+            )
+        f.write("file '{0}'\n{1}".format(os.path.abspath(files[-1]), option))
+
+    return concat_list
+
+
+def encoder_version(encoder):
+    """
+    Returns the major version of avconv/ffmpeg, or 0 if it is unknown, e.g.
+    for a development build.
+
+    The version of each encoder is only found once.
+
+    Parameters
+    ----------
+
+    encoder : str
+        Name of the encoder.
+    """
+
+    if encoder not in ["avconv", "ffmpeg"]:
+        return 0
+
+    if encoder not in encoder_versions:
+        try:
+            output = subprocess.run(
+                [encoder, "-version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            ).stdout.decode(errors="replace")
+        except OSError:
+            output = ""
+        match = re.match(r"\S+ version [^\d\s]*(\d+)\.", output)
+        encoder_versions[encoder] = int(match.group(1)) if match else 0
+
+    return encoder_versions[encoder]
+
+
+def encode_segments(options):
+    """
+    Encode the frames into a film made of independently encoded segments.
+
+    Every options['segment_frames'] frames are encoded into a separate file,
+    which starts with a key frame, in the directory given by segment_path.
+    The segments are then joined into the film by the concat demuxer without
+    being re-encoded.
+
+    When options['frame_range'] is set only the frames in that range have
+    been plotted, so only the segments containing them are re-encoded and
+    the segments of the rest of the film are reused. This splices the
+    re-rendered frames into the existing film.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    seg_len = options["segment_frames"]
+    if options.get("frame_range") is None:
+        start, stop = 0, len(frame_files(options))
+        for output in film_outputs(options):
+            shutil.rmtree(
+                os.path.dirname(segment_path(output, 0, options)), ignore_errors=True
+            )
+    else:
+        start, stop = options["frame_range"]
+
+    for output in film_outputs(options):
+        os.makedirs(os.path.dirname(segment_path(output, 0, options)), exist_ok=True)
+
+    for first in range(start, stop, seg_len):
+        command = encoder_command(options, range(first, min(first + seg_len, stop)))
+        with start_encoder(command, options) as encoder:
+            encoder.wait()
+        print("Encode command: " + command)
+
+    for output in film_outputs(options):
+        segments = []
+        while os.path.exists(segment_path(output, len(segments), options)):
+            segments.append(segment_path(output, len(segments), options))
+        if len(segments) * seg_len < stop:
+            raise IOError(
+                "Segments of {0} are missing. Make the whole film before "
+                "re-rendering a frame range.".format(output_path(output, options))
+            )
+
+        concat_list = os.path.dirname(segments[0]) + "/segments.txt"
+        with open(concat_list, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for segment in segments:
+                f.write("file '{0}'\n".format(os.path.abspath(segment)))
+
+        command = " ".join(
+            [
+                options["encoder"],
+                "-y -f concat -safe 0 -i",
+                shlex.quote(concat_list),
+                "-c copy",
+                shlex.quote(output_path(output, options)),
+            ]
+        )
+        with start_encoder(command, options) as encoder:
+            encoder.wait()
+        print("Join command: " + command)
+
+
+def segment_path(output, segment, options):
+    """
+    Returns the path of a segment of a film returned by film_outputs.
+
+    The segments of a film are kept in a directory next to it, named after the
+    film, so they can be reused when part of the film is re-rendered.
+
+    Parameters
+    ----------
+
+    output : dict
+        Film returned by film_outputs.
+    segment : int
+        Index of the segment.
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    return options["film_dir"] + "/{0}_{1}_segments/{0}_{2:05d}.{1}".format(
+        output["file_name"], output["video_fmt"], segment
+    )
+
+
+def film_limits_path(options):
+    """
+    Returns the path of the limits stored with a segmented film.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    """
+
+    return options["film_dir"] + "/{0}_limits.pickle".format(options["file_name"])
+
+
+def save_film_limits(options, plot_options):
+    """
+    Store the limits, contours and color bar ticks of a segmented film next to
+    it, so that re-rendering a frame range of the film uses the same ones.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    limits = {
+        "options": {
+            key: options[key]
+            for key in ["xlim", "ylim", "cbar_ticks"]
+            if options.get(key) is not None
+        },
+        "plot_options": {
+            key: plot_options[key]
+            for key in ["levels", "extend"]
+            if key in plot_options
+        },
+    }
+    with open(film_limits_path(options), "wb") as f:
+        pickle.dump(limits, f)
+
+
+def load_film_limits(options, plot_options):
+    """
+    Use the limits stored by save_film_limits when re-rendering a frame range,
+    unless they are given.
+
+    Otherwise the limits would be calculated from the corrected data and the
+    re-rendered segments could have a different color scale from the rest of
+    the film.
+
+    Parameters
+    ----------
+
+    options : dict
+        Dictionary of options which control various program functions.
+    plot_options : dict
+        Dictionary of plot customizations which are evaluated for each plot.
+    """
+
+    if not os.path.exists(film_limits_path(options)):
+        return options, plot_options
+
+    with open(film_limits_path(options), "rb") as f:
+        limits = pickle.load(f)
+
+    options = dict(options)
+    plot_options = dict(plot_options)
+    for key, value in limits["options"].items():
+        if options[key] is None or (key == "cbar_ticks" and type(options[key]) == int):
+            options[key] = value
+    for key, value in limits["plot_options"].items():
+        plot_options.setdefault(key, value)
+
+    return options, plot_options
+
+
+def set_up_frame_range(nt, options):
+    """
+    Set up the re-rendering of a range of frames of an existing film.
+
+    options['frame_range'] = (start, stop) is widened to the boundaries of the
+    segments of options['segment_frames'] frames it overlaps, since segments
+    are encoded as a whole.
+
+    Returns the time indices to be plotted and the options used to plot them.
 
     Parameters
     ----------
-
-    z : array_like
-        The 3D array being plotted: z(x, y).
+    nt : int
+        Length of the time dimension.
     options : dict
         Dictionary of options which control various program functions.
-    plot_options : dict
-        Dictionary of plot customizations which are evaluated for each plot.
-        Here we modify the matplotlib option 'levels'.
     """
 
-    z_min = np.min(z)
-    z_max = np.max(z)
-    if z_min * z_max < 0:
-        if np.abs(z_max) > np.abs(z_min):
-            plot_options["levels"] = np.around(
-                np.linspace(-z_max, z_max, options["ncontours"]), 7
-            )
-        else:
-            plot_options["levels"] = np.around(
-                np.linspace(z_min, -z_min, options["ncontours"]), 7
-            )
-    elif z_min * z_max >= 0:
-        plot_options["levels"] = np.around(
-            np.linspace(z_min, z_max, options["ncontours"]), 7
+    if options["segment_frames"] is None or options["encoder"] == "pillow":
+        raise ValueError(
+            "frame_range requires segment_frames and an avconv/ffmpeg film."
         )
+    if options["dedup_tol"] is not None:
+        raise ValueError("frame_range can't be used with dedup_tol.")
 
-    return plot_options
+    seg_len = options["segment_frames"]
+    start, stop = options["frame_range"]
+    start = max(0, start // seg_len * seg_len)
+    stop = min(nt, -(-stop // seg_len) * seg_len)
 
+    options = dict(options)
+    options["frame_range"] = (start, stop)
 
-def calculate_cbar_ticks(z, options):
-    """
-    Calculate the color bar ticks based on the array extremes.
+    return range(start, stop), options
 
-    There are three options for options['cbar_ticks']:
 
-    * None: Automatically determine the extrama and set 5 ticks.
-    * int: Automatically determine the extrama and set specified number of
-      ticks.
-    * array: Set cbar_ticks to user specified values.
+def encode_images_pillow(options):
+    """
+    Encode images into an animated GIF, APNG or WebP film using Pillow.
+
+    The frames are streamed to the film one at a time by write_gif,
+    write_apng or write_webp, so only one frame is open and in memory at
+    once. A film is written for every entry of options['outputs'], scaled by
+    its 'scale'.
 
     Parameters
     ----------
 
-    z : array_like
-        The 3D array being plotted: z(x, y).
     options : dict
         Dictionary of options which control various program functions.
     """
 
-    z_min = np.min(z)
-    z_max = np.max(z)
-    if z_min * z_max < 0:
-        if options["cbar_ticks"] == None:
-            if np.abs(z_max) > np.abs(z_min):
-                options["cbar_ticks"] = np.around(np.linspace(-z_max, z_max, 5), 7)
-            else:
-                options["cbar_ticks"] = np.around(np.linspace(z_min, -z_min, 5), 7)
-        else:
-            if np.abs(z_max) > np.abs(z_min):
-                options["cbar_ticks"] = np.around(
-                    np.linspace(-z_max, z_max, options["cbar_ticks"]), 7
-                )
-            else:
-                options["cbar_ticks"] = np.around(
-                    np.linspace(z_min, -z_min, options["cbar_ticks"]), 7
-                )
-    elif z_min * z_max >= 0:
-        if options["cbar_ticks"] == None:
-            options["cbar_ticks"] = np.around(np.linspace(z_min, z_max, 5), 7)
-        else:
-            options["cbar_ticks"] = np.around(
-                np.linspace(z_min, z_max, options["cbar_ticks"]), 7
+    files = frame_files(options)
+    if len(files) == 0:
+        raise IOError("No frames found in " + options["frame_dir"])
+
+    durations = list(1000 * frame_durations(len(files), options))
+    size = Image.open(files[0]).size
+
+    for output in film_outputs(options):
+        if output["video_fmt"] not in PILLOW_FORMATS:
+            raise ValueError(
+                "Pillow can only write films in the following formats: "
+                + ", ".join(PILLOW_FORMATS)
             )
+        film = output_path(output, options)
+        scaled = scaled_size(size, output["scale"])
 
-    return options
+        if output["video_fmt"] == "gif":
+            write_gif(files, durations, film, options, scaled)
+        elif output["video_fmt"] == "apng":
+            write_apng(files, durations, film, scaled)
+        else:
+            write_webp(files, durations, film, scaled)
+        print("Encoded film: " + film)
 
 
-def plot_1d(args):
+def scaled_size(size, scale):
     """
-    Plot the 1D graph for a given time step.
+    Returns the size of the frames of a film after scaling.
 
     Parameters
     ----------
 
-    it : int
-        Time index being plotted.
-    x : array_like
-        Array specifying the x axis.
-    y : array_like
-        Two dimensional array assumed to be of the form y(t, x). This specifies
-        the values to be plotted as a function of time.
-    plot_options : dict
-        Dictionary of plot customizations which are evaluated for each plot,
-        e.g. when plot is called it will be called as
-        plt.plot(x, y, **plot_options)
-    options : dict
-        Dictionary of options which control various program functions.
+    size : tuple
+        Width and height of the frames.
+    scale : float or tuple
+        Factor applied to the width and height, or a (width, height) pair
+        where a negative value keeps the aspect ratio.
     """
 
-    it, x, y, plot_options, options = args
+    if scale is None:
+        return size
+    if np.ndim(scale) == 0:
+        return (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
 
-    fig, ax = plt.subplots()
-    ax.plot(x, y, **plot_options)
+    w, h = scale
+    if w < 0:
+        w = h * size[0] / size[1]
+    if h < 0:
+        h = w * size[1] / size[0]
 
-    ax.set_title(options["title"][it])
-    ax.set_xlabel(options["xlabel"])
-    ax.set_ylabel(options["ylabel"])
+    return (max(1, int(w)), max(1, int(h)))
 
-    ax.set_xlim(options["xlim"])
-    ax.set_ylim(options["ylim"])
-    if options["xticks"] is not None:
-        ax.set_xticks(options["xticks"])
-    if options["yticks"] is not None:
-        ax.set_yticks(options["yticks"])
 
-    ax.grid(options["grid"])
+def read_frame(path, size, scaled=None):
+    """
+    Read a frame as an RGB image.
 
-    ax.set_aspect(options["aspect"])
+    Parameters
+    ----------
 
-    fig.savefig(
-        options["frame_dir"]
-        + "/{0}_{1:05d}.{2}".format(options["file_name"], it, options["img_fmt"]),
-        dpi=options["dpi"],
-        bbox_inches=options["bbox_inches"],
-    )
-    plt.close(fig)
+    path : str
+        Path of the frame.
+    size : tuple
+        Width and height the frame is cropped to.
+    scaled : tuple, optional
+        Width and height the cropped frame is resized to.
+    """
 
+    with Image.open(path) as frame:
+        im = frame.convert("RGB").crop((0, 0) + size)
+    if scaled is not None and scaled != size:
+        im = im.resize(scaled, Image.Resampling.LANCZOS)
 
-def plot_2d(args):
+    return im
+
+
+def write_gif(files, durations, film, options, size=None):
     """
-    Plot the 2D contour plot for a given time step.
+    Write frames to an animated GIF, one frame at a time.
+
+    A single global palette is calculated from a sample of the frames by
+    gif_palette, so every frame is quantized by a lookup table rather than a
+    median cut of its own. Only the rectangle which changed since the previous
+    frame is written.
 
     Parameters
     ----------
 
-    it : int
-        Time index being plotted.
-    x : array_like
-        Array specifying the x axis.
-    y : array_like
-        Array specifying the y axis.
-    z : array_like
-        Three dimensional array assumed to be of the form z(t, x, y). This
-        specifies the values to be plotted as a function of time.
-    plot_options : dict
-        Dictionary of plot customizations which are evaluated for each plot,
-        e.g. when plot is called it will be called as
-        plt.plot(x, y, **plot_options)
+    files : list
+        Paths of the frames in the order they appear in the film.
+    durations : list
+        Duration of each frame in milliseconds.
+    film : str
+        Path of the film being written.
     options : dict
         Dictionary of options which control various program functions.
+    size : tuple, optional
+        Width and height of the film. Defaults to the size of the first frame.
     """
 
-    it, x, y, z, plot_options, options = args
+    crop = Image.open(files[0]).size
+    if size is None:
+        size = crop
+    palette = gif_palette(files, options, size)
+    lut = np.full(2**18, -1, dtype=np.int16)
+    prev = None
+
+    with open(film, "wb") as fp:
+        for f, duration in zip(files, durations):
+            rgb = np.asarray(read_frame(f, crop, size))
+            idx = quantize_frame(rgb, palette, lut)
+
+            if prev is None:
+                box = (0, 0, size[1], size[0])
+                im = Image.fromarray(idx, "P")
+                im.putpalette(palette.tobytes())
+                header, _ = GifImagePlugin.getheader(
+                    im, info={"loop": 0, "duration": duration}
+                )
+                fp.write(b"".join(header))
+            else:
+                changed = idx != prev
+                rows = np.flatnonzero(changed.any(axis=1))
+                cols = np.flatnonzero(changed.any(axis=0))
+                if rows.size == 0:
+                    box = (0, 0, 1, 1)
+                else:
+                    box = (rows[0], cols[0], rows[-1] + 1, cols[-1] + 1)
+
+            im = Image.fromarray(idx[box[0] : box[2], box[1] : box[3]], "P")
+            im.putpalette(palette.tobytes())
+            for data in GifImagePlugin.getdata(
+                im, offset=(int(box[1]), int(box[0])), duration=duration, disposal=1
+            ):
+                fp.write(data)
+            prev = idx
+
+        fp.write(b";")
+
+
+def write_apng(files, durations, film, size=None):
+    """
+    Write frames to an animated PNG, one frame at a time.
 
-    fig, ax = plt.subplots()
-    im = ax.contourf(x, y, np.transpose(z), **plot_options)
+    Each frame is compressed by Pillow's PNG encoder and its image data is
+    copied into the film's frame chunks. Only the rectangle which changed
+    since the previous frame is written.
 
-    ax.set_title(options["title"][it])
-    ax.set_xlabel(options["xlabel"])
-    ax.set_ylabel(options["ylabel"])
+    Parameters
+    ----------
 
-    ax.set_xlim(options["xlim"])
-    ax.set_ylim(options["ylim"])
-    if options["xticks"] is not None:
-        ax.set_xticks(options["xticks"])
-    if options["yticks"] is not None:
-        ax.set_yticks(options["yticks"])
+    files : list
+        Paths of the frames in the order they appear in the film.
+    durations : list
+        Duration of each frame in milliseconds.
+    film : str
+        Path of the film being written.
+    size : tuple, optional
+        Width and height of the film. Defaults to the size of the first frame.
+    """
 
-    ax.grid(options["grid"])
+    crop = Image.open(files[0]).size
+    if size is None:
+        size = crop
+    sequence = 0
+    prev = None
+
+    with open(film, "wb") as fp:
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        fp.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", *size, 8, 2, 0, 0, 0)))
+        fp.write(png_chunk(b"acTL", struct.pack(">II", len(files), 0)))
+
+        for f, duration in zip(files, durations):
+            rgb = np.asarray(read_frame(f, crop, size))
+            if prev is None:
+                box = (0, 0, size[1], size[0])
+            else:
+                changed = np.any(rgb != prev, axis=2)
+                rows = np.flatnonzero(changed.any(axis=1))
+                cols = np.flatnonzero(changed.any(axis=0))
+                if rows.size == 0:
+                    box = (0, 0, 1, 1)
+                else:
+                    box = (rows[0], cols[0], rows[-1] + 1, cols[-1] + 1)
+
+            control = struct.pack(
+                ">IIIIIHHBB",
+                sequence,
+                int(box[3] - box[1]),
+                int(box[2] - box[0]),
+                int(box[1]),
+                int(box[0]),
+                min(int(round(duration)), 2**16 - 1),
+                1000,
+                0,
+                0,
+            )
+            fp.write(png_chunk(b"fcTL", control))
+            sequence += 1
 
-    ax.set_aspect(options["aspect"])
+            buf = io.BytesIO()
+            Image.fromarray(rgb[box[0] : box[2], box[1] : box[3]]).save(buf, "PNG")
+            for kind, data in png_chunks(buf.getvalue()):
+                if kind != b"IDAT":
+                    continue
+                if prev is None:
+                    fp.write(png_chunk(b"IDAT", data))
+                else:
+                    fp.write(png_chunk(b"fdAT", struct.pack(">I", sequence) + data))
+                    sequence += 1
+            prev = rgb
 
-    divider = make_axes_locatable(ax)
-    cax = divider.append_axes("right", size="5%", pad=0.05)
+        fp.write(png_chunk(b"IEND", b""))
 
-    fig.colorbar(
-        im,
-        cax=cax,
-        label=options["cbar_label"],
-        ticks=options["cbar_ticks"],
-        format=options["cbar_tick_format"],
-    )
 
-    fig.savefig(
-        options["frame_dir"]
-        + "/{0}_{1:05d}.{2}".format(options["file_name"], it, options["img_fmt"]),
-        dpi=options["dpi"],
-        bbox_inches=options["bbox_inches"],
-    )
-    plt.close(fig)
+def png_chunk(kind, data):
+    """
+    Returns a PNG chunk of the given type.
 
+    Parameters
+    ----------
 
-def crop_images(nt, options):
+    kind : bytes
+        Four letter type of the chunk.
+    data : bytes
+        Contents of the chunk.
     """
-    Ensures that PNG files have height and width that are even.
 
-    This owes to a quirk of avconv and libx264 that requires this. At the
-    moment there is no easy way to specifically set the pixel count using
-    Matplotlib and this is not desirable anyway since plots can be almost
-    any size and aspect ratio depending on the data. The other solution
-    found online is to use the `-vf` flag for avconv to control the output
-    size but this does not seem to work. The most reliable solution
-    therefore is to use Pillow to load and crop images.
+    crc = zlib.crc32(kind + data) & 0xFFFFFFFF
+
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def png_chunks(png):
+    """
+    Returns the type and contents of each chunk of a PNG image.
 
     Parameters
     ----------
 
-    nt : int
-        Length of the time dimension.
-    options : dict
-        Dictionary of options which control various program functions.
+    png : bytes
+        The PNG image.
     """
 
-    pool = mp.Pool(processes=options["nprocs"])
-    params = zip(range(nt), [options] * nt)
-    frame_dims = np.array(pool.map(get_image_size, params))
-    pool.close()
-    pool.join()
-
-    w_min = np.min(frame_dims[:, 0])
-    h_min = np.min(frame_dims[:, 1])
-    new_w = int(w_min / 2) * 2
-    new_h = int(h_min / 2) * 2
+    chunks = []
+    i = 8
+    while i < len(png):
+        length, kind = struct.unpack(">I4s", png[i : i + 8])
+        chunks.append((kind, png[i + 8 : i + 8 + length]))
+        i += length + 12
 
-    pool = mp.Pool(processes=options["nprocs"])
-    params = zip(range(nt), [new_w] * nt, [new_h] * nt, [options] * nt)
-    pool.map(crop_image, params)
-    pool.close()
-    pool.join()
+    return chunks
 
 
-def get_image_size(args):
+def write_webp(files, durations, film, size=None):
     """
-    Returns the size of an image as a tuple of (width, height) in pixels.
+    Write frames to an animated WebP, one frame at a time.
+
+    Each frame is encoded as a still WebP image by Pillow and its bitstream
+    is copied into a frame of the film. The size of the film is written once
+    the last frame has been added.
 
     Parameters
     ----------
 
-    it : int
-        Time step of frame being analyzed.
-    options : dict
-        Dictionary of options which control various program functions.
+    files : list
+        Paths of the frames in the order they appear in the film.
+    durations : list
+        Duration of each frame in milliseconds.
+    film : str
+        Path of the film being written.
+    size : tuple, optional
+        Width and height of the film. Defaults to the size of the first frame.
     """
 
-    it, options = args
+    crop = Image.open(files[0]).size
+    if size is None:
+        size = crop
+    canvas = struct.pack("<I", size[0] - 1)[:3] + struct.pack("<I", size[1] - 1)[:3]
 
-    im = Image.open(
-        options["frame_dir"]
-        + "/{0}_{1:05d}.{2}".format(options["file_name"], it, options["img_fmt"])
-    )
+    with open(film, "wb") as fp:
+        fp.write(b"RIFF\0\0\0\0WEBP")
+        fp.write(riff_chunk(b"VP8X", b"\x02\0\0\0" + canvas))
+        fp.write(riff_chunk(b"ANIM", struct.pack("<IH", 0xFFFFFFFF, 0)))
 
-    return (im.size[0], im.size[1])
+        for f, duration in zip(files, durations):
+            buf = io.BytesIO()
+            read_frame(f, crop, size).save(buf, "WEBP")
+            # A still image holds a single VP8 or VP8L chunk after its header.
+            bitstream = buf.getvalue()[12:]
+            header = b"\0" * 6 + canvas
+            header += struct.pack("<I", min(int(round(duration)), 2**24 - 1))[:3]
+            fp.write(riff_chunk(b"ANMF", header + b"\x02" + bitstream))
 
+        riff_size = fp.tell() - 8
+        fp.seek(4)
+        fp.write(struct.pack("<I", riff_size))
 
-def crop_image(args):
+
+def riff_chunk(kind, data):
     """
-    Crop single image at a given time step.
+    Returns a RIFF chunk of the given type, padded to an even length.
 
     Parameters
     ----------
 
-    it : int
-        Time step of frame being analyzed.
-    new_w : int
-        New width to crop images to.
-    new_h : int
-        New height to crop images to.
-    options : dict
-        Dictionary of options which control various program functions.
+    kind : bytes
+        Four letter type of the chunk.
+    data : bytes
+        Contents of the chunk.
     """
 
-    it, new_w, new_h, options = args
-
-    im = Image.open(
-        options["frame_dir"]
-        + "/{0}_{1:05d}.{2}".format(options["file_name"], it, options["img_fmt"])
-    )
-    im_crop = im.crop((0, 0, new_w, new_h))
-    im_crop.save(
-        options["frame_dir"]
-        + "/{0}_{1:05d}.{2}".format(options["file_name"], it, options["img_fmt"])
-    )
+    return kind + struct.pack("<I", len(data)) + data + b"\0" * (len(data) % 2)
 
 
-def make_plot_titles(nt, options):
+def gif_palette(files, options, size=None):
     """
-    Creates the array of plot titles passed to the plotting function.
+    Calculate a global 256 color palette from a sample of the frames.
 
-    This function allows dynamic plot titles such as the frame number or time.
-    When the user has just passed in a fixed string, this is repeated to be the
-    same length as the time dimension.
+    options['palette_frames'] frames evenly spaced throughout the film are
+    quantized together using a median cut.
 
     Parameters
     ----------
 
-    nt : int
-        Length of the time dimension.
+    files : list
+        Paths of the frames in the order they appear in the film.
     options : dict
         Dictionary of options which control various program functions.
+    size : tuple, optional
+        Width and height the frames are scaled to. Defaults to the size of the
+        first frame.
     """
 
-    if type(options["title"]) == str:
-        options["title"] = [options["title"]] * nt
-    elif type(options["title"]) == list:
-        if len(options["title"]) > nt:
-            warnings.warn(
-                "Dimension of time and length of plot titles "
-                "different: {0}, {1}".format(nt, len(options["title"]))
-            )
-        elif len(options["title"]) < nt:
-            raise ValueError(
-                "Dimension of time greater than length of plot "
-                "titles: {0}, {1}".format(nt, len(options["title"]))
-            )
+    sample = np.unique(
+        np.linspace(0, len(files) - 1, options["palette_frames"]).astype(int)
+    )
+    crop = Image.open(files[0]).size
+    frames = [np.asarray(read_frame(files[i], crop, size)) for i in sample]
+    im = Image.fromarray(np.concatenate(frames, axis=0))
+    im = im.quantize(256, method=Image.Quantize.MEDIANCUT)
 
-    return options
+    palette = np.zeros([256, 3], dtype=np.uint8)
+    colors = np.reshape(im.getpalette()[:768], [-1, 3])
+    palette[: len(colors)] = colors
 
+    return palette
 
-def encode_images(options):
+
+def quantize_frame(rgb, palette, lut):
     """
-    Encode PNG images into a film.
+    Map an RGB frame onto the indices of a palette.
+
+    Colors are reduced to 6 bits per channel and looked up in lut. Entries
+    which are missing from lut are filled with the nearest palette color the
+    first time they appear, so the lookup table is built lazily and shared by
+    every frame.
 
     Parameters
     ----------
 
-    options : dict
-        Dictionary of options which control various program functions.
+    rgb : array_like
+        Frame of shape (height, width, 3) with dtype uint8.
+    palette : array_like
+        Palette of shape (256, 3).
+    lut : array_like
+        Lookup table of length 2**18 where -1 denotes a missing entry.
     """
 
-    if options["encoder"] == "avconv":
-        os.system(
-            "avconv -threads " + str(options["nprocs"]) + " -y -f "
-            "image2 -r "
-            + str(options["fps"])
-            + " -i "
-            + "'"
-            + options["frame_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "_%05d."
-            + options["img_fmt"]
-            + "' -q 1 "
-            + options["film_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "."
-            + options["video_fmt"]
-        )
-        print(
-            "Encode command: avconv -threads "
-            + str(options["nprocs"])
-            + " -y -f image2 -r "
-            + str(options["fps"])
-            + " -i "
-            + "'"
-            + options["frame_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "_%05d."
-            + options["img_fmt"]
-            + "' -q 1 "
-            + options["film_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "."
-            + options["video_fmt"]
-        )
-    elif options["encoder"] == "ffmpeg":
-        os.system(
-            "ffmpeg -threads " + str(options["nprocs"]) + " -y "
-            "-r "
-            + str(options["fps"])
-            + " -i "
-            + "'"
-            + options["frame_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "_%05d."
-            + options["img_fmt"]
-            + "' -pix_fmt yuv420p -c:v libx264 -q 1 "
-            + options["film_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "."
-            + options["video_fmt"]
-        )
-        print(
-            "Encode command: ffmpeg -threads "
-            + str(options["nprocs"])
-            + " -y -r "
-            + str(options["fps"])
-            + " -i "
-            + "'"
-            + options["frame_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "_%05d."
-            + options["img_fmt"]
-            + "' -pix_fmt yuv420p -c:v libx264 -q 1 "
-            + options["film_dir"]
-            + "/"
-            + str(options["file_name"])
-            + "."
-            + options["video_fmt"]
-        )
+    rgb = rgb.astype(np.int32) >> 2
+    codes = (rgb[..., 0] << 12) | (rgb[..., 1] << 6) | rgb[..., 2]
+    idx = lut[codes]
+
+    missing = idx < 0
+    if missing.any():
+        new = np.unique(codes[missing])
+        colors = np.stack(((new >> 12) & 63, (new >> 6) & 63, new & 63), axis=1)
+        colors = colors * 4 + 2
+        for i in range(0, len(new), 4096):
+            dist = np.sum(
+                (colors[i : i + 4096, np.newaxis, :] - palette.astype(np.int32)) ** 2,
+                axis=-1,
+            )
+            lut[new[i : i + 4096]] = np.argmin(dist, axis=1)
+        idx = lut[codes]
+
+    return idx.astype(np.uint8)
@@ -19,13 +19,14 @@ setup(
     license="GNU",
     keywords=["film", "video", "animation", "numpy", "ffmpeg", "avconv"],
     packages=["pyfilm"],
+    entry_points={"console_scripts": ["pyfilm=pyfilm.cli:main"]},
     url="https://github.com/ferdinandvwyk/pyfilm.git",
     setup_requires=["numpy>1.6"],
     install_requires=[
         "matplotlib>1.4",
-        "py-cpuinfo>0.1",
         "Pillow>2.8",
     ],
+    extras_require={"contour_threads": ["matplotlib>=3.8", "contourpy"]},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Programming Language :: Python",
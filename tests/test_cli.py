@@ -0,0 +1,60 @@
+import os
+import json
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")  # specifically for Travis CI to avoid backend errors
+
+from pyfilm.cli import *
+
+
+class TestClass(object):
+    """
+    Class containing methods which test the pyfilm command line interface.
+    """
+
+    def teardown_class(self):
+        os.system("rm -rf films")
+        os.system("rm -rf cli_data")
+
+    def setup_method(self):
+        os.system("mkdir -p cli_data")
+        np.save("cli_data/y.npy", np.random.rand(3, 4))
+        np.savez("cli_data/z.npz", z=np.random.rand(2, 3, 3))
+
+    def test_load_data(self):
+        assert load_data("y.npy", "cli_data").shape == (3, 4)
+        spec = {"file": "z.npz", "dataset": "z"}
+        assert load_data(spec, "cli_data").shape == (2, 3, 3)
+        assert load_data([1, 2], "cli_data").shape == (2,)
+
+    def test_main(self):
+        manifest = {
+            "defaults": {"options": {"fps": 5}},
+            "films": [
+                {"name": "line", "type": "1d", "args": ["y.npy"]},
+                {
+                    "name": "contour",
+                    "type": "2d",
+                    "args": [{"file": "z.npz", "dataset": "z"}],
+                    "options": {"cbar_ticks": [0, 0.5, 1]},
+                },
+                {"name": "broken", "type": "3d", "args": ["y.npy"]},
+            ],
+        }
+        with open("cli_data/manifest.json", "w") as f:
+            json.dump(manifest, f)
+
+        status = main(
+            ["cli_data/manifest.json", "--jobs", "2", "--summary", "cli_data/s.json"]
+        )
+        with open("cli_data/s.json") as f:
+            summary = json.load(f)
+
+        assert status == 1
+        assert summary["ok"] == 2 and summary["failed"] == 1
+        assert summary["films"][0]["film"] == "films/line.mp4"
+        assert "line.mp4" in os.listdir("films/")
+        assert "contour.mp4" in os.listdir("films/")
+        assert "contour_00001.png" in os.listdir("films/film_frames/contour")
@@ -1,4 +1,10 @@
 import os
+import sys
+import time
+import pstats
+import pickle
+import shlex
+import subprocess
 
 from pytest import raises
 import numpy as np
@@ -11,6 +17,35 @@ matplotlib.use("Agg")  # specifically for Travis CI to avoid backend errors
 from pyfilm.pyfilm import *
 
 
+def hanging_task(args):
+    """
+    Task which hangs on frame 1 until a marker file has been written.
+    """
+
+    it, marker = args
+    if it == 1 and not os.path.exists(marker):
+        open(marker, "w").close()
+        time.sleep(30)
+    return it
+
+
+def worker_limits(args):
+    """
+    Task which returns the thread limit and CPUs of the worker running it.
+    """
+
+    return os.environ["OMP_NUM_THREADS"], sorted(os.sched_getaffinity(0))
+
+
+def wave(it):
+    """
+    Vectorised function of the time index used as the data of a film.
+    """
+
+    x = np.linspace(0, 2 * np.pi, 12)
+    return np.sin(x[None, :, None] - 0.1 * it[:, None, None]) * np.ones(10)
+
+
 class TestClass(object):
     """
     Class containing methods which test pyfilm.
@@ -60,6 +95,10 @@ class TestClass(object):
         options = find_encoder({})
         assert options["encoder"] == "avconv" or options["encoder"] == "ffmpeg"
 
+    def test_find_encoder_pillow(self):
+        options = find_encoder({"video_fmt": "gif"})
+        assert options["encoder"] == "pillow"
+
     def test_set_ylim(self):
         y = np.array([range(5)] * 5)
         options = {}
@@ -85,10 +124,14 @@ class TestClass(object):
             check_data_1d(x, y)
 
         x = np.arange(5)
-        y = np.random.rand(5, 5, 4)
+        y = np.random.rand(5, 5, 4, 5)
         with raises(IndexError):
             check_data_1d(x, y)
 
+        y = np.random.rand(5, 5, 4)
+        with raises(ValueError):
+            check_data_1d(x, y)
+
     def test_plot_1d(self):
         x = np.arange(2)
         y = np.random.rand(2, 2)
@@ -129,6 +172,13 @@ class TestClass(object):
         h = im.size[1]
         assert w % 2 == 0 and h % 2 == 0
 
+        options = {"backend": "process", "nprocs": 2, "encoder": "pillow"}
+        options.update({"title": ["t" * 1000] * 12, "video_fmt": "gif"})
+        options = make_film_1d(np.random.rand(12, 3), options=options)
+        shared = {"options": options}
+        sizes = map_frame_files(range(12), get_image_size, shared, options)
+        assert all(w % 2 == 0 and h % 2 == 0 for w, h in sizes)
+
     def test_2d_1_arg(self):
         z = np.random.rand(2, 2, 2)
         make_film_2d(z)
@@ -162,6 +212,51 @@ class TestClass(object):
         plot_2d(args)
         assert "f_00000.png" in os.listdir("films/film_frames/")
 
+    def test_2d_irregular(self):
+        x = np.random.rand(20)
+        y = np.random.rand(20)
+        z = np.random.rand(2, 20)
+        make_film_2d(x, y, z, options={"tri_min_circle_ratio": 0.01})
+        assert "f_00000.png" in os.listdir("films/film_frames/")
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_plot_tri(self):
+        x = np.random.rand(10)
+        y = np.random.rand(10)
+        z = np.random.rand(2, 10)
+        os.system("rm films/film_frames/*.png")
+        options = {}
+        options = set_default_options(options)
+        set_up_dirs(options)
+        make_plot_titles(2, options)
+        triangulation = make_triangulation(x, y, options)
+        init_worker(
+            "tri",
+            {
+                "x": x,
+                "y": y,
+                "triangles": triangulation.triangles,
+                "mask": triangulation.mask,
+            },
+        )
+        args = (0, worker_data.pop("tri")["triangulation"], z[0, :], {}, options)
+        plot_tri(args)
+        assert "f_00000.png" in os.listdir("films/film_frames/")
+
+    def test_check_data_tri(self):
+        x = np.random.rand(5)
+        y = np.random.rand(4)
+        z = np.random.rand(2, 5)
+        with raises(ValueError):
+            check_data_tri(x, y, z)
+        y = np.random.rand(5)
+        z = np.random.rand(2, 4)
+        with raises(ValueError):
+            check_data_tri(x, y, z)
+        z = np.random.rand(2, 5, 5)
+        with raises(IndexError):
+            check_data_tri(x, y, z)
+
     def test_check_data_2d_with_wrong_sizes(self):
         x = np.arange(5)
         y = np.arange(5)
@@ -204,7 +299,7 @@ class TestClass(object):
         options = {}
         options = set_default_options(options)
         options = make_plot_titles(10, options)
-        assert len(options["title"]) == 10
+        assert options["title"] == ""
 
         options["title"] = ["test"] * 9
         with raises(ValueError):
@@ -246,3 +341,695 @@ class TestClass(object):
         z = np.reshape(np.arange(8), [2, 2, 2])
         options = calculate_contours(z, options, plot_options)
         assert np.sum(plot_options["levels"] - np.linspace(0, 7, 21)) < 1e-5
+
+    def test_quantile_sketch(self):
+        values = np.random.RandomState(0).rand(100000)
+        sketch = QuantileSketch(k=256, seed=0)
+        sketch.update(values[:50000])
+        other = QuantileSketch(k=256, seed=1).update(values[50000:])
+        sketch.merge(other)
+        assert sketch.n == 100000
+        assert sum(level.size for level in sketch.levels) < 256 * 16
+        q = sketch.quantile([0, 0.01, 0.5, 0.99, 1])
+        assert q[0] == np.min(values) and q[-1] == np.max(values)
+        assert np.all(np.abs(q[1:4] - np.percentile(values, [1, 50, 99])) < 0.02)
+
+        z = np.random.randn(300, 100, 100)
+        options = set_default_options({})
+        options.update({"clip_percentile": 1, "backend": "process", "nprocs": 2})
+        assert np.all(find_extrema(z, options) == find_extrema(z, options))
+
+    def test_find_extrema(self):
+        z = np.random.rand(10, 10, 10)
+        z[3, 3, 3] = 1000
+        options = {}
+        options = set_default_options(options)
+        assert find_extrema(z, options)[1] == 1000
+        options["clip_percentile"] = 1
+        z_min, z_max = find_extrema(z, options)
+        assert z_max < 1 and z_min > 0
+        options["clip_percentile"] = 50
+        with raises(ValueError):
+            find_extrema(z, options)
+
+    def test_clip_percentile(self):
+        z = np.random.rand(2, 5, 5)
+        z[0, 0, 0] = 100
+        plot_options = {}
+        make_film_2d(z, plot_options=plot_options, options={"clip_percentile": 5})
+        assert np.max(plot_options["levels"]) < 100
+        assert plot_options["extend"] == "both"
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_set_frame_ylim(self):
+        y = np.exp(-np.arange(4))[:, np.newaxis] * np.linspace(-1, 1, 5)
+        options = {}
+        options = set_default_options(options)
+        options["dynamic_limits"] = True
+        options = set_frame_ylim(y, options)
+        assert options["ylim"].shape == (4, 2)
+        assert np.allclose(options["ylim"][:, 1], np.exp(-np.arange(4)))
+        options["dynamic_limits"] = 3
+        options = set_frame_ylim(y, options)
+        assert np.allclose(options["ylim"][1:, 1], np.exp(-np.arange(3)))
+
+    def test_rolling_extreme(self):
+        values = np.array([3, 1, 4, 1, 5])
+        assert np.all(rolling_extreme(values, 2, np.maximum) == [3, 3, 4, 4, 5])
+        assert np.all(rolling_extreme(values, 3, np.minimum) == [1, 1, 1, 1, 1])
+        assert np.all(rolling_extreme(values, 7, np.maximum) == [4, 5, 5, 5, 5])
+
+    def test_calculate_frame_contours(self):
+        z = np.zeros([3, 2, 2])
+        z[1:] = np.reshape(np.arange(8), [2, 2, 2])
+        options = {}
+        options = set_default_options(options)
+        options["dynamic_limits"] = True
+        plot_options = calculate_frame_contours(z, options, {})
+        assert plot_options["levels"].shape == (3, 11)
+        assert np.all(np.diff(plot_options["levels"], axis=1) > 0)
+        assert np.allclose(plot_options["levels"][2], np.linspace(4, 7, 11))
+        assert options["cbar_ticks"].shape == (3, 5)
+        frame, frame_plot = frame_options(2, options, plot_options)
+        assert np.allclose(frame["cbar_ticks"], np.linspace(4, 7, 5))
+        assert frame_plot["levels"].shape == (11,)
+
+    def test_dynamic_limits(self):
+        y = np.random.rand(3, 4) * np.array([[1], [0.1], [0.01]])
+        make_film_1d(y, options={"dynamic_limits": True})
+        assert "f_00002.png" in os.listdir("films/film_frames/")
+        z = np.random.rand(3, 4, 4) * np.array([1, 0.1, 0.01])[:, None, None]
+        make_film_2d(z, options={"dynamic_limits": 2})
+        assert "f_00002.png" in os.listdir("films/film_frames/")
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_pillow_formats(self):
+        y = np.random.rand(3, 4)
+        for video_fmt in ["gif", "apng", "webp"]:
+            make_film_1d(y, options={"video_fmt": video_fmt})
+            im = Image.open("films/f." + video_fmt)
+            assert im.n_frames == 3
+
+        y[2] = y[1]
+        make_film_1d(y, options={"video_fmt": "apng", "crop": False, "fps": 4})
+        im = Image.open("films/f.apng")
+        for it in range(3):
+            im.seek(it)
+            frame = Image.open("films/film_frames/f_{0:05d}.png".format(it))
+            assert np.all(np.asarray(im.convert("RGB")) == frame.convert("RGB"))
+            assert im.info["duration"] == 250
+
+    def test_quantize_frame(self):
+        palette = np.zeros([256, 3], dtype=np.uint8)
+        palette[1] = [255, 255, 255]
+        palette[2] = [255, 0, 0]
+        lut = np.full(2**18, -1, dtype=np.int16)
+        rgb = np.array([[[250, 250, 250], [240, 10, 0], [5, 5, 5]]], dtype=np.uint8)
+        assert list(quantize_frame(rgb, palette, lut)[0]) == [1, 2, 0]
+        assert np.sum(lut >= 0) == 3
+
+    def test_find_unique_frames(self):
+        z = np.zeros([6, 3, 3])
+        z[2:4] = 1
+        z[4] = 1 + 1e-9
+        z[5] = 2
+        options = {}
+        options = set_default_options(options)
+        options = make_plot_titles(6, options)
+        options["dedup_tol"] = 0
+        assert list(find_unique_frames(z, options, {})) == [0, 2, 4, 5]
+        options["dedup_tol"] = 1e-6
+        assert list(find_unique_frames(z, options, {})) == [0, 2, 5]
+        options["title"] = ["same"] * 6
+        options["title"][1] = "changed"
+        assert list(find_unique_frames(z, options, {})) == [0, 1, 2, 5]
+
+    def test_dedup(self):
+        y = np.repeat(np.random.rand(3, 4), [1, 3, 2], axis=0)
+        make_film_1d(y, options={"dedup_tol": 0, "video_fmt": "gif"})
+        assert "f_00003.png" not in os.listdir("films/film_frames/")
+        im = Image.open("films/f.gif")
+        assert im.n_frames == 3
+        im.seek(1)
+        assert im.info["duration"] == 300
+        make_film_1d(y, options={"dedup_tol": 0})
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_preview(self):
+        y = np.random.rand(9, 4)
+        options = make_film_1d(y, options={"preview": 4})
+        frames = os.listdir("films/film_frames/")
+        assert "preview_f_00004.png" in frames
+        assert "preview_f_00002.png" not in frames
+        assert "preview_f.mp4" in os.listdir("films/")
+        assert list(options["preview_done"]) == [0, 4, 8]
+
+        ylim = options["ylim"]
+        mtime = os.path.getmtime("films/film_frames/preview_f_00004.png")
+        options["preview"] = 2
+        options = make_film_1d(y, options=options)
+        assert "preview_f_00002.png" in os.listdir("films/film_frames/")
+        assert os.path.getmtime("films/film_frames/preview_f_00004.png") == mtime
+        assert list(options["preview_done"]) == [0, 2, 4, 6, 8]
+        os.remove("films/preview_f.mp4")
+        options = make_film_1d(y, options=options)
+        assert list(options["preview_done"]) == [0, 2, 4, 6, 8]
+        assert "preview_f.mp4" in os.listdir("films/")
+
+        options["preview"] = None
+        y[3] = 5
+        options = make_film_1d(y, options=options)
+        assert options["ylim"][1] >= 5 and options["sampled_limits"] is None
+        assert "f_00008.png" in os.listdir("films/film_frames/")
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_preview_2d(self):
+        z = np.random.rand(6, 4, 4)
+        plot_options = {}
+        make_film_2d(z, plot_options=plot_options, options={"preview": 3})
+        assert "preview_f_00003.png" in os.listdir("films/film_frames/")
+        assert np.isclose(np.max(plot_options["levels"]), np.max(z[::3]))
+
+        z[1] = 10
+        plot_options = {}
+        options = make_film_2d(
+            z, plot_options=plot_options, options={"preview": 3, "cbar_ticks": 3}
+        )
+        assert np.max(plot_options["levels"]) < 10
+        options["preview"] = None
+        options = make_film_2d(z, plot_options=plot_options, options=options)
+        assert np.isclose(np.max(plot_options["levels"]), 10)
+        assert len(options["cbar_ticks"]) == 3
+        assert "extend" not in plot_options
+
+    def test_live_film(self):
+        x = np.arange(4)
+        with LiveFilm(x, options={"file_name": "live", "live_window": 2}) as film:
+            film.extend(np.linspace(0, 1, 4) * (it + 1) for it in range(3))
+            assert film.options["ylim"][1] > 2
+        assert "live_00002.png" in os.listdir("films/film_frames/")
+        assert "live.mp4" in os.listdir("films/")
+
+    def test_live_film_2d(self):
+        film = LiveFilm(options={"file_name": "live_2d"})
+        film.append(np.random.rand(4, 3))
+        film.append(np.random.rand(4, 3) * 2)
+        assert film.plot_options["levels"][-1] > 1
+        film.close()
+        assert "live_2d_00001.png" in os.listdir("films/film_frames/")
+        assert "live_2d.mp4" in os.listdir("films/")
+
+    def test_choose_backend(self):
+        options = {}
+        options = set_default_options(options)
+        options["nprocs"] = 4
+        options["start_method"] = "fork"
+        assert choose_backend(1, options) == "serial"
+        assert choose_backend(5, options) == "process"
+        options["start_method"] = "spawn"
+        assert choose_backend(5, options) == "serial"
+        assert choose_backend(50, options) == "process"
+        options["backend"] = "thread"
+        assert choose_backend(1, options) == "thread"
+        options["frame_timeout"] = 10
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            assert choose_backend(1, options) == "thread"
+            assert any("process backend" in str(x.message) for x in w)
+        options["backend"] = "auto"
+        assert choose_backend(1, options) == "process"
+        options["backend"] = "gpu"
+        with raises(ValueError):
+            choose_backend(1, options)
+
+    def test_serial_pool(self):
+        pool = make_pool(3, {"backend": "serial"})
+        assert pool.map(abs, [-1, -2]) == [1, 2]
+        assert pool.apply_async(abs, (-3,)).get() == 3
+        with raises(TypeError):
+            pool.apply_async(abs, ("a",)).get()
+
+    def test_backends(self):
+        z = np.random.rand(3, 4, 4)
+        for backend in ["serial", "thread"]:
+            make_film_2d(z, options={"backend": backend})
+            assert "f_00002.png" in os.listdir("films/film_frames/")
+        make_film_1d(z[:, 0], options={"backend": "process", "start_method": "spawn"})
+        assert "f_00002.png" in os.listdir("films/film_frames/")
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_profile(self, capsys):
+        z = np.random.rand(3, 4, 4)
+        make_film_2d(z, options={"profile": "films/f.pstats", "backend": "process"})
+        stats = pstats.Stats("films/f.pstats")
+        assert any(func[2] == "plot_2d" for func in stats.stats)
+        out = capsys.readouterr().out
+        assert "Profile of 3 frames" in out
+        assert "contour generation" in out
+        assert profile_module("~", "<built-in method zlib.compress>") == "zlib"
+        site = "/usr/lib/python3.9/site-packages/matplotlib/axes/_base.py"
+        assert profile_module(site, "draw") == "matplotlib.axes._base"
+
+    def test_memmap_float32(self):
+        os.system("mkdir -p films")
+        z = np.lib.format.open_memmap(
+            "films/z.npy", mode="w+", dtype=np.float32, shape=(4, 6, 5)
+        )
+        z[:] = np.random.rand(4, 6, 5)
+        z.flush()
+        z = np.load("films/z.npy", mmap_mode="r")
+        make_film_2d(z[:, ::2], options={"clip_percentile": 1, "dedup_tol": 0})
+        assert "f.mp4" in os.listdir("films/")
+        make_film_1d(z[..., 0].astype(np.float16))
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_sketch_dtype(self):
+        z = np.random.rand(2000).astype(np.float32)
+        sketch = QuantileSketch(k=50).update(z)
+        sketch.merge(QuantileSketch(k=50).update(z))
+        assert all(level.dtype == np.float32 for level in sketch.levels)
+
+    def test_outputs(self):
+        options = set_default_options({})
+        options["encoder"] = "ffmpeg"
+        options["outputs"] = [
+            {},
+            {"video_fmt": "webm", "bitrate": "200k"},
+            {"file_name": "small", "scale": 0.5},
+        ]
+        command = encoder_command(options)
+        assert command.count("-i ") == 1
+        assert "-c:v libvpx-vp9 -b:v 200k films/f.webm" in command
+        assert "scale=trunc(iw*0.5/2)*2:trunc(ih*0.5/2)*2" in command
+        options["outputs"].append({"file_name": "f"})
+        with raises(ValueError):
+            film_outputs(options)
+
+    def test_multiple_outputs(self):
+        y = np.random.rand(3, 5)
+        outputs = [{}, {"file_name": "small", "scale": 0.5, "video_fmt": "gif"}]
+        make_film_1d(y, options={"outputs": outputs})
+        assert "f.mp4" in os.listdir("films/")
+        assert Image.open("films/small.gif").n_frames == 3
+        make_film_1d(y, options={"video_fmt": "gif", "outputs": [{}, outputs[1]]})
+        full = Image.open("films/f.gif").size
+        assert Image.open("films/small.gif").size == (full[0] // 2, full[1] // 2)
+
+    def test_lazy_titles(self):
+        options = set_default_options({})
+        options["title"] = "it = {it}, t = {t:.1f}"
+        options["times"] = np.linspace(0, 1, 3)
+        assert frame_title(2, options) == "it = 2, t = 1.0"
+        options["title"] = lambda it, t: "frame " + str(it)
+        assert frame_title(1, options) == "frame 1"
+        options["title"] = "$x^{2}$"
+        assert frame_title(1, options) == "$x^{2}$"
+
+    def test_check_title_picklable(self):
+        options = {"title": lambda it, t: str(it)}
+        check_title_picklable(options, "fork")
+        with raises(ValueError):
+            check_title_picklable(options, "spawn")
+        check_title_picklable({"title": "{it}"}, "spawn")
+
+    def test_frame_payloads(self):
+        y = np.random.rand(4, 5)
+        options = make_film_1d(y, options={"title": "{it}", "backend": "thread"})
+        assert options["title"] == "{it}"
+        assert len(worker_data) == 0
+        os.system("rm films/film_frames/*.png")
+        make_film_1d(y[[0, 0, 0, 0]], options={"title": "{it}", "dedup_tol": 0})
+        assert "f_00003.png" in os.listdir("films/film_frames/")
+
+    def test_set_up_frame_range(self):
+        options = set_default_options({})
+        options["encoder"] = "ffmpeg"
+        options["frame_range"] = (5, 6)
+        with raises(ValueError):
+            set_up_frame_range(10, options)
+        options["segment_frames"] = 4
+        frames, options = set_up_frame_range(10, options)
+        assert list(frames) == [4, 5, 6, 7]
+        options["frame_range"] = (7, 10)
+        frames, options = set_up_frame_range(10, options)
+        assert list(frames) == [4, 5, 6, 7, 8, 9]
+
+    def test_segments(self):
+        z = np.random.rand(10, 4, 4)
+        make_film_2d(z, options={"segment_frames": 4})
+        segments = sorted(os.listdir("films/f_mp4_segments/"))
+        assert segments[:3] == ["f_00000.mp4", "f_00001.mp4", "f_00002.mp4"]
+        first = os.path.getmtime("films/f_mp4_segments/f_00000.mp4")
+        z[5] = 0
+        z[6] = 10
+        options = make_film_2d(z, options={"segment_frames": 4, "frame_range": (5, 6)})
+        assert np.all(options["cbar_ticks"] <= 1)
+        frames = sorted(f for f in os.listdir("films/film_frames/") if "png" in f)
+        assert frames == ["f_00004.png", "f_00005.png", "f_00006.png", "f_00007.png"]
+        assert os.path.getmtime("films/f_mp4_segments/f_00000.mp4") == first
+        assert "f.mp4" in os.listdir("films/")
+        concat_list = open("films/film_frames/f_00004.txt").read()
+        assert ("option framerate" in concat_list) == (encoder_version("ffmpeg") >= 5)
+
+    def test_static_background(self):
+        z = np.random.rand(3, 6, 5)
+        options = {"title": "{it}", "crop": False, "backend": "serial"}
+        make_film_2d(z, options=options)
+        full = np.asarray(Image.open("films/film_frames/f_00002.png").convert("RGB"))
+        options["static_background"] = True
+        make_film_2d(z, options=options)
+        static = np.asarray(Image.open("films/film_frames/f_00002.png").convert("RGB"))
+        assert full.shape == static.shape
+        assert np.mean(np.abs(full.astype(int) - static)) < 1
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            make_film_2d(z, options={"static_background": True, "dynamic_limits": True})
+            assert any("static_background" in str(x.message) for x in w)
+
+    def test_static_background_tri(self):
+        x = np.random.rand(20)
+        y = np.random.rand(20)
+        z = np.random.rand(4, 20)
+        make_film_2d(x, y, z, options={"static_background": True, "backend": "thread"})
+        assert "f_00003.png" in os.listdir("films/film_frames/")
+        assert "f.mp4" in os.listdir("films/")
+
+    def test_estimate_film(self):
+        z = np.random.rand(40, 5, 5)
+        estimate = estimate_film(make_film_2d, z, sample_frames=4)
+        assert estimate["sample_frames"] == 4
+        assert estimate["seconds"] > 0
+        assert estimate["disk_bytes"] > 40 * estimate["frame_bytes"]
+        assert estimate["memory_bytes"] > z.nbytes
+        estimate = estimate_film(
+            make_film_1d,
+            np.random.rand(40, 5),
+            options={"title": ["t"] * 40, "dpi": 200},
+            sample_frames=4,
+            time_budget=1e-3,
+            memory_budget=1,
+        )
+        assert estimate["recommended"] == {"nprocs": 1, "img_fmt": "jpg", "dpi": 50}
+
+    def test_frame_timeout(self):
+        options = set_default_options({})
+        options.update({"frame_timeout": 1, "backend": "process", "nprocs": 2})
+        marker = "films/hung_frame"
+        os.makedirs("films", exist_ok=True)
+        params = [(it, marker) for it in range(4)]
+        start = time.time()
+        pool = make_pool(4, options)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            assert map_frames(pool, hanging_task, params, options) == [0, 1, 2, 3]
+            assert any("timed out" in str(x.message) for x in w)
+        pool.close()
+        pool.join()
+        assert time.time() - start < 20
+
+        os.remove(marker)
+        os.makedirs(options["frame_dir"], exist_ok=True)
+        other = os.path.join(options["frame_dir"], "other_00001.png.1-2.tmp")
+        open(other, "w").close()
+        options["frame_retries"] = 0
+        pool = make_pool(4, options)
+        with raises(multiprocessing.TimeoutError):
+            map_frames(pool, hanging_task, params, options)
+        assert time.time() - start < 20
+        assert os.path.exists(other)
+
+    def test_speculative(self):
+        options = set_default_options({})
+        options.update({"speculative": True, "backend": "process", "nprocs": 2})
+        marker = "films/slow_frame"
+        os.makedirs("films", exist_ok=True)
+        start = time.time()
+        pool = make_pool(4, options)
+        params = [(it, marker) for it in range(4)]
+        assert map_frames(pool, hanging_task, params, options) == [0, 1, 2, 3]
+        pool.close()
+        pool.join()
+        assert time.time() - start < 20
+
+    def test_worker_limits(self):
+        cpus = available_cpus()
+        assert 1 <= cpu_count() <= len(cpus)
+
+        options = set_default_options({})
+        options.update({"backend": "process", "nprocs": 2, "pin_workers": True})
+        pool = make_pool(4, options)
+        limits = map_frames(pool, worker_limits, list(range(4)), options)
+        pool.close()
+        pool.join()
+        for threads, affinity in limits:
+            assert threads == "1"
+            assert len(affinity) == 1 and affinity[0] in cpus
+
+    def test_encoder_cpus(self):
+        options = set_default_options({})
+        options["encoder"] = "ffmpeg"
+        assert "-threads " + str(options["nprocs"]) in encoder_command(options)
+        assert worker_cpus(options) is None
+        assert encoder_affinity(options) is None
+
+        options["encoder_cpus"] = 2
+        assert "-threads 2 " in encoder_command(options)
+        assert live_encoder_command(options)[2] == "2"
+        cpus = available_cpus()
+        assert len(worker_cpus(options)) == max(len(cpus) - 2, 1)
+        assert encoder_affinity(options) == cpus[-2:]
+        command = [sys.executable, "-c", "import time; time.sleep(1)"]
+        with start_encoder(command, options) as encoder:
+            assert sorted(os.sched_getaffinity(encoder.pid)) == cpus[-2:]
+        # The encoder is restricted from its start, without a shell.
+        command = shlex.quote(sys.executable) + (
+            " -c 'import os; print(*sorted(os.sched_getaffinity(0)), os.getppid())'"
+        )
+        with start_encoder(command, options, stdout=subprocess.PIPE) as encoder:
+            output = encoder.communicate()[0].decode()
+        assert output.split() == [str(cpu) for cpu in cpus[-2:]] + [str(os.getpid())]
+
+    def test_line_raster(self):
+        x = np.linspace(0, 2 * np.pi, 50)
+        y = np.sin(x[np.newaxis, :] + np.linspace(0, 1, 4)[:, np.newaxis])
+        options = set_ylim(y, set_default_options({}))
+        options["title"] = "{it}"
+        set_up_dirs(options)
+        plot_1d((2, x, y[2], {}, options))
+        full = np.asarray(Image.open("films/film_frames/f_00002.png").convert("RGB"))
+        raster = LineRaster(x, y[0], options, {})
+        assert np.mean(np.abs(full.astype(int) - raster.frame(2, y[2]))) < 1
+
+        x = np.linspace(0, 1, 500)
+        y = np.sin(2 * np.pi * (x + np.linspace(0, 1, 50)[:, np.newaxis]))
+        raster = LineRaster(x, y[0], set_default_options({"dpi": 100}), {})
+        assert raster.size == (640, 480)
+        start = time.time()
+        for it in range(200):
+            raster.frame(it, y[it % 50])
+        assert time.time() - start < 2
+
+        os.system("rm -rf films")
+        make_film_1d(x, y, options={"line_raster": True})
+        assert "f.mp4" in os.listdir("films")
+        assert os.listdir("films/film_frames") == []
+        with raises(ValueError):
+            LineRaster(x, y[0], options, {"marker": "o"})
+
+    def test_decimate_lines(self):
+        x = np.linspace(0, 1, 1000)
+        y = np.random.rand(3, 1000)
+        starts = np.arange(0, 1000, 10)
+        lines = decimate_lines(x, y, starts)
+        assert lines.shape == (3, 2, 400)
+        blocks = lines[:, 1].reshape(3, 100, 4)
+        assert np.all(blocks.min(axis=2) == y.reshape(3, 100, 10).min(axis=2))
+        assert np.all(blocks.max(axis=2) == y.reshape(3, 100, 10).max(axis=2))
+        assert np.all(np.diff(lines[:, 0], axis=1) >= 0)
+
+        x = np.linspace(0, 1, 20000)
+        y = np.cumsum(np.random.RandomState(0).randn(2, 20000), axis=1)
+        options = {"crop": False, "backend": "serial", "decimate": False}
+        make_film_1d(x, y, options=options)
+        full = np.asarray(Image.open("films/film_frames/f_00001.png").convert("RGB"))
+        options["decimate"] = True
+        make_film_1d(x, y, options=options)
+        decimated = np.asarray(
+            Image.open("films/film_frames/f_00001.png").convert("RGB")
+        )
+        # The top and bottom of the blue line in every pixel column are
+        # within a pixel of those of the same or a neighbouring column of the
+        # other image.
+        envelopes = []
+        for image in [full, decimated]:
+            ink = image[..., 2].astype(int) - image[..., 0] > 0
+            rows = np.where(ink, np.arange(len(ink))[:, np.newaxis], np.nan)
+            envelope = np.array([np.nanmin(rows, 0), np.nanmax(rows, 0)])
+            padded = np.pad(envelope, ((0, 0), (1, 1)), constant_values=np.nan)
+            columns = [padded[:, :-2], padded[:, 1:-1], padded[:, 2:]]
+            near = np.array(
+                [
+                    np.nanmin([c[0] for c in columns], 0),
+                    np.nanmax([c[1] for c in columns], 0),
+                ]
+            )
+            envelopes.append((envelope, near))
+        assert np.all(np.isnan(envelopes[0][0]) == np.isnan(envelopes[1][0]))
+        for (envelope, _), (_, near) in [envelopes, envelopes[::-1]]:
+            assert np.nanmax(near[0] - envelope[0]) <= 1
+            assert np.nanmax(envelope[1] - near[1]) <= 1
+
+        make_film_1d(x, FrameFunction(lambda it: y[it], 2), options=options)
+        function = np.asarray(
+            Image.open("films/film_frames/f_00001.png").convert("RGB")
+        )
+        assert np.all(function == decimated)
+
+    def test_frame_shard(self):
+        options = {"frame_shard": 3, "crop": False, "backend": "serial"}
+        options = make_film_1d(np.random.rand(7, 5), options=options)
+        assert options["frame_digits"] == 5
+        assert frame_path(4, options) == "films/film_frames/f_00001/f_00004.png"
+        assert len(frame_files(options)) == 7
+        assert "-f concat" in encoder_command(options)
+        assert "f.mp4" in os.listdir("films")
+
+        set_up_dirs(options)
+        assert not os.path.exists("films/film_frames/f_00001")
+
+        options["frame_shard"] = None
+        options["frame_digits"] = 6
+        assert frame_path(123456, options) == "films/film_frames/f_123456.png"
+        assert "f_%06d.png" in encoder_command(options)
+
+    def test_contour_threads(self):
+        z = np.cumsum(np.random.rand(3, 12, 10), axis=1)
+        options = {"crop": False, "zlim": [1, 9], "title": "{it}"}
+        options.update({"backend": "process", "nprocs": 2})
+        make_film_2d(z, options=options, plot_options={"extend": "both"})
+        full = np.asarray(Image.open("films/film_frames/f_00002.png").convert("RGB"))
+        options["contour_threads"] = 2
+        make_film_2d(z, options=options, plot_options={"extend": "both"})
+        threaded = np.asarray(
+            Image.open("films/film_frames/f_00002.png").convert("RGB")
+        )
+        assert np.all(full == threaded)
+
+        shared = {"x": np.arange(12), "y": np.arange(10), "options": options}
+        shared["plot_options"] = {"levels": np.linspace(0, 12, 5), "extend": "both"}
+        contours = contour_slice((0, z[0], shared))
+        assert len(contours["paths"]) == 6
+        assert contour_threads(shared) == filled_contours_supported()
+        shared["plot_options"] = {}
+        assert not contour_threads(shared)
+
+    def test_contour_threads_fallback(self, monkeypatch):
+        # FilledContours no longer draws the paths, as if a later version of
+        # matplotlib had changed the internals of ContourSet.
+        monkeypatch.setattr(FilledContours, "_process_args", lambda self, c, **k: k)
+        monkeypatch.setattr("pyfilm.pyfilm.filled_contours_checks", {})
+        assert not filled_contours_supported()
+
+        z = np.cumsum(np.random.rand(3, 12, 10), axis=1)
+        options = {"crop": False, "zlim": [1, 9], "backend": "serial"}
+        make_film_2d(z, options=options)
+        full = np.asarray(Image.open("films/film_frames/f_00002.png").convert("RGB"))
+        options["contour_threads"] = 2
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            make_film_2d(z, options=options)
+        assert any("contour_threads" in str(w.message) for w in caught)
+        fallback = np.asarray(
+            Image.open("films/film_frames/f_00002.png").convert("RGB")
+        )
+        assert np.all(full == fallback)
+
+    def test_frame_function(self):
+        data = FrameFunction(wave, 30, block=4)
+        assert data.shape == (30, 12, 10) and len(data) == 30
+        assert np.all(data[[3, 7]] == wave(np.array([3, 7])))
+        assert np.all(data[5] == data.frame(5, np.arange(0, 30, 5)))
+        assert sorted(data.frames) == [5, 10, 15, 20]
+        assert data[40:].shape == (0, 12, 10)
+        thread = multiprocessing.pool.ThreadPool(1)
+        assert thread.apply(lambda: len(data.frames)) == 0
+        thread.close()
+        assert pickle.loads(pickle.dumps(data)).frames == {}
+
+        options = {"crop": False, "title": "{it}", "zlim": [-1, 1]}
+        options.update({"backend": "process", "nprocs": 2})
+        make_film_2d(wave(np.arange(30)), options=options)
+        full = np.asarray(Image.open("films/film_frames/f_00029.png"))
+        film_options = make_film_2d(data, options=options)
+        assert film_options["limit_frames"] == 100
+        assert np.all(np.asarray(Image.open("films/film_frames/f_00029.png")) == full)
+
+        plot_options = {}
+        options.update({"zlim": None, "limit_frames": 10})
+        make_film_2d(data, options=options, plot_options=plot_options)
+        assert plot_options["extend"] == "both"
+
+    def test_limit_frames(self):
+        y = np.cumsum(np.random.rand(50, 5), axis=0)
+        options = set_default_options({})
+        options["limit_frames"] = 10
+        assert preview_sample(y, options).shape == (10, 5)
+        options = make_film_1d(y, options={"limit_frames": 10, "dynamic_limits": True})
+        assert len(options["ylim"]) == 50
+        assert np.all(options["ylim"][5:10] == options["ylim"][5])
+
+    def test_ensemble(self):
+        x = np.linspace(0, 1, 50)
+        y = np.cumsum(np.random.randn(4, 30, 50), axis=2)
+        lines = EnsembleLines(x, y, None, range(4), [(0, 100), (25, 75)])
+        members, bands = lines[1]
+        assert np.all(members == y[1]) and bands.shape == (4, 50)
+        assert np.all(bands[0] == y[1].min(axis=0))
+        assert np.all(bands[1] == y[1].max(axis=0))
+        lines = EnsembleLines(x, y, np.arange(0, 50, 10), range(4), [(0, 100)])
+        assert lines[2][0].shape == (30, 2, 20) and lines[2][1].shape == (2, 2, 20)
+
+        options = set_default_options({})
+        options["member_alpha"] = np.linspace(0, 1, 30)
+        options, plot_options = set_up_ensemble(30, options, {"color": "r", "lw": 2})
+        assert plot_options["colors"].shape == (30, 4)
+        assert np.all(plot_options["colors"][:, 0] == 1)
+        assert plot_options["colors"][-1, 3] == 1 and plot_options["linewidths"] == 2
+
+        options = {"bands": [(5, 95)], "member_colors": "viridis", "crop": False}
+        options.update({"backend": "process", "nprocs": 2})
+        film_options = make_film_1d(x, y, options=options)
+        assert len(frame_files(film_options)) == 4
+        assert film_options["member_colors"] == "viridis"
+
+    def test_particle_density(self):
+        points = np.random.rand(3, 500, 2) * 10 - 5
+        points[0, 0] = np.nan
+        options = {"density_bins": [8, 5], "xlim": [-4, 4], "ylim": [-2.5, 2.5]}
+        density = ParticleDensity(points, options)
+        counts = density(np.arange(3))
+        assert counts.shape == (3, 8, 5)
+        assert np.allclose(density.x, np.arange(-3.5, 4))
+        for it in range(3):
+            hist = np.histogram2d(
+                *points[it].T, bins=[8, 5], range=[[-4, 4], [-2.5, 2.5]]
+            )
+            assert np.all(counts[it] == hist[0])
+
+    def test_make_film_particles(self):
+        points = np.random.randn(3, 50, 2)
+        options = {"scatter_max": 10, "density_bins": 20, "crop": False}
+        film_options = make_film_particles(points, options=options)
+        assert film_options["cbar_label"] == "count"
+        assert len(frame_files(film_options)) == 3
+        assert film_options["xlim"][0] == points[..., 0].min()
+
+        points[2] = 0.5
+        options["limit_frames"] = 1
+        film_options = make_film_particles(points, options=options)
+        assert film_options["zlim"] == [0, 50]
+
+        film_options = make_film_particles(points, options={"ylim": [-5, 5]})
+        assert len(frame_files(film_options)) == 3
+        assert film_options["ylim"] == [-5, 5]
+        assert film_options["cbar_label"] == "f(x,y)"